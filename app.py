@@ -1,13 +1,13 @@
 import streamlit as st
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-import re
+import hmac
+import os
 
 # Import core timetable functions
 try:
     import extract_timetable
     extract_batch_colors = extract_timetable.extract_batch_colors
     get_timetable = extract_timetable.get_timetable
+    extract_year = extract_timetable.extract_year
     
     # Try to get get_custom_timetable function
     if hasattr(extract_timetable, 'get_custom_timetable'):
@@ -25,11 +25,22 @@ except ImportError as e:
 # Import course extraction functions
 try:
     # Use the fuller extractor which reliably extracts departments and batches
-    from course_extractor import extract_departments_and_batches, extract_all_courses, search_courses
+    from course_extractor import extract_departments_and_batches, search_courses
 except ImportError as e:
     st.error(f"Failed to import course extraction functions: {e}")
     st.stop()
 
+# Import Sheets API helpers
+try:
+    from sheets_client import spreadsheet_id_from_url
+    from sheet_cache import RevisionCache, SnapshotStore
+    from fetch_backends import LiveBackend, RecordingBackend, ReplayBackend
+    from timetable_data import build_timetable_data
+    from metrics import METRICS
+except ImportError as e:
+    st.error(f"Failed to import Sheets API helpers: {e}")
+    st.stop()
+
 # Import user preferences functions
 try:
     from user_preferences import (
@@ -43,75 +54,124 @@ except ImportError as e:
     st.stop()
 
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1cmDXt7UTIKBVXBHhtZ0E4qMnJrRoexl2GmDFfTBl0Z4/edit?usp=drivesdk"
-
-
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def get_google_sheets_data(sheet_url):
-    """Fetch Google Sheets data with formatting using Sheets API v4"""
-    credentials_dict = st.secrets["google_service_account"]
-    creds = Credentials.from_service_account_info(
-        credentials_dict,
-        scopes=['https://www.googleapis.com/auth/spreadsheets.readonly']
+# "stream" decodes the day sheets while they download; "masked" and "full" go through the
+# client library, which holds the whole response, and "full" pulls every sheet and property
+FETCH_MODE = "stream"
+# "live" fetches from Google, "record" also saves each response to RECORDINGS_DIR and
+# "replay" serves saved responses offline (see fetch_backends.py)
+FETCH_BACKEND = os.environ.get("TIMETABLE_FETCH_BACKEND", "live")
+FETCH_BACKENDS = ("live", "record", "replay")
+RECORDINGS_DIR = os.environ.get("TIMETABLE_RECORDINGS_DIR", "recordings")
+REVISION_PROBE_INTERVAL = 60  # Seconds between cheap checks of the sheet's revision
+SNAPSHOT_CACHE_DIR = os.environ.get("TIMETABLE_CACHE_DIR", ".snapshot_cache")
+# Worker processes for parsing the day sheets on refresh; 0 parses them in this process
+PARSE_WORKERS = int(os.environ.get("TIMETABLE_PARSE_WORKERS", "0"))
+# Opening the app with ?admin=<token> shows the metrics panel; unset disables it
+ADMIN_TOKEN = os.environ.get("TIMETABLE_ADMIN_TOKEN", "")
+
+
+def build_snapshot(spreadsheet):
+    """Parse a fetched grid into the TimetableData every session shares until the next revision"""
+    # The precompute size and time are recorded as the render_all stage in METRICS
+    return build_timetable_data(spreadsheet, workers=PARSE_WORKERS)
+
+
+def env_float(name, default=None):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def make_fetch_backend():
+    """The fetch backend selected by TIMETABLE_FETCH_BACKEND"""
+    if FETCH_BACKEND not in FETCH_BACKENDS:
+        raise ValueError(f"Unknown TIMETABLE_FETCH_BACKEND '{FETCH_BACKEND}', expected one of {FETCH_BACKENDS}")
+    if FETCH_BACKEND == "replay":
+        # No credentials needed; latency defaults to the recorded fetch time
+        return ReplayBackend(
+            RECORDINGS_DIR,
+            latency=env_float("TIMETABLE_REPLAY_LATENCY"),
+            jitter=env_float("TIMETABLE_REPLAY_JITTER", 0.0),
+            error_rate=env_float("TIMETABLE_REPLAY_ERROR_RATE", 0.0),
+            bandwidth=env_float("TIMETABLE_REPLAY_BANDWIDTH"),
+        )
+    backend = LiveBackend(st.secrets["google_service_account"], FETCH_MODE)
+    if FETCH_BACKEND == "record":
+        backend = RecordingBackend(backend, RECORDINGS_DIR)
+    return backend
+
+
+@st.cache_resource  # One per process, shared by every session
+def get_spreadsheet_cache():
+    """Cache that probes the sheet revision and only re-downloads the grid when it changed"""
+    backend = make_fetch_backend()
+    return RevisionCache(
+        fetch=backend.fetch,
+        probe=backend.revision,
+        derive=build_snapshot,
+        probe_interval=REVISION_PROBE_INTERVAL,
+        max_age=300,  # Without a working probe, fall back to refetching every 5 minutes
+        store=SnapshotStore(SNAPSHOT_CACHE_DIR),
+        keep_spreadsheet=False,  # Only the snapshot is read, so let the grid be freed after parsing
     )
 
-    service = build('sheets', 'v4', credentials=creds)
-    spreadsheet_id = sheet_url.split('/d/')[1].split('/')[0]
-
-    # Get spreadsheet with cell formatting
-    spreadsheet = service.spreadsheets().get(
-        spreadsheetId=spreadsheet_id,
-        includeGridData=True
-    ).execute()
 
-    return spreadsheet
-
-
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def get_cached_batch_colors(sheet_url):
-    """Get batch colors with caching to avoid repeated API calls"""
-    spreadsheet = get_google_sheets_data(sheet_url)
-    return extract_batch_colors(spreadsheet)
+def get_sheet_entry(sheet_url):
+    """Current cache entry (revision, grid and parsed snapshot) for the sheet.
 
+    After a restart this is the snapshot saved on disk, checked for staleness in the background.
+    """
+    return get_spreadsheet_cache().get(spreadsheet_id_from_url(sheet_url))
 
-@st.cache_data(ttl=300)  # Cache for 5 minutes  
-def get_cached_all_courses(sheet_url):
-    """Get all courses with caching to avoid repeated extractions"""
-    spreadsheet = get_google_sheets_data(sheet_url)
-    return extract_all_courses(spreadsheet)
 
+def get_timetable_data(sheet_url):
+    """TimetableData of the current revision, shared by reference with every session.
 
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def get_cached_departments_and_years(sheet_url):
-    """Get departments and years lists with caching"""
-    all_courses = get_cached_all_courses(sheet_url)
-    
-    # Extract departments
-    department_list = sorted(set(c.get('department', '') for c in all_courses if c.get('department')))
-    
-    # Extract years from courses
-    year_list = []
-    for course in all_courses:
-        batch = str(course.get('batch', ''))
-        m = re.search(r"(20\d{2})", batch)
-        if m and m.group(1) not in year_list:
-            year_list.append(m.group(1))
-    
-    return department_list, sorted(year_list)
-
-
-def format_course_display(course: dict) -> str:
-    """Return a compact display string for a course: 'name dept section year-or-batch'
-    Example: 'Data St CS A 2024' (falls back to full batch string if year not found)
+    It is read-only, so no copy is made per rerun; a refresh swaps in a new one.
     """
-    name = course.get('name', '').strip()
-    dept = course.get('department', '').strip()
-    section = course.get('section', '').strip()
-    batch = str(course.get('batch', '')).strip()
-    # Prefer year (e.g., 2024) when available inside the batch string
-    m = re.search(r"(20\d{2})", batch)
-    year = m.group(1) if m else batch
-    parts = [p for p in [name, dept, section, year] if p]
-    return " ".join(parts)
+    return get_sheet_entry(sheet_url).derived
+
+
+def is_admin():
+    """True when the page was opened with the admin token as ?admin=..."""
+    token = ADMIN_TOKEN
+    if not token:
+        try:
+            token = st.secrets.get("admin_token", "")
+        except Exception:
+            # No secrets file (e.g. the offline replay backend): nobody is admin
+            return False
+    supplied = st.query_params.get("admin", "")
+    return bool(token) and hmac.compare_digest(str(supplied), str(token))
+
+
+def show_metrics_panel():
+    """Sidebar table of per-stage timings and counters, with JSON and Prometheus downloads"""
+    snapshot = METRICS.snapshot()
+    with st.sidebar.expander("📈 Stage metrics", expanded=True):
+        rows = [{
+            'stage': name,
+            'calls': stage['calls'],
+            'mean ms': round(stage['mean_seconds'] * 1000, 2),
+            'max ms': round(stage['max_seconds'] * 1000, 2),
+            'last ms': round(stage['last_seconds'] * 1000, 2),
+            'errors': stage['errors'],
+            'counts': ", ".join(f"{k}={v}" for k, v in sorted(stage['counts'].items())),
+        } for name, stage in snapshot['stages'].items()]
+        if rows:
+            st.dataframe(rows, hide_index=True)
+        else:
+            st.write("No stages recorded yet.")
+        st.write("**Counters**")
+        st.json(snapshot['counters'], expanded=False)
+        st.write("**Parser caches**")
+        st.json(snapshot['parser_caches'], expanded=False)
+        st.download_button("Download JSON", METRICS.to_json(), file_name="timetable_metrics.json",
+                           mime="application/json")
+        st.download_button("Download Prometheus text", METRICS.to_prometheus(),
+                           file_name="timetable_metrics.prom", mime="text/plain")
+        if st.button("Reset metrics", key="reset_metrics"):
+            METRICS.reset()
+            st.rerun()
 
 
 def main():
@@ -123,13 +183,14 @@ def main():
     # Initialize session state
     initialize_session_state()
 
-    # Fetch cached data - this will only make API calls once every 5 minutes
+    # Fetch cached data - the grid is only re-downloaded when the sheet revision changes
     st.info("Welcome Everyone!")
     try:
-        # Use cached functions to reduce API calls
-        batch_colors = get_cached_batch_colors(SHEET_URL)
-        all_courses = get_cached_all_courses(SHEET_URL)
-        department_list, year_list = get_cached_departments_and_years(SHEET_URL)
+        # Read the shared data once so the whole rerun sees a single revision, even if a
+        # refresh swaps in a new one meanwhile
+        data = get_timetable_data(SHEET_URL)
+        snapshot, catalog, batch_colors, facets = data.snapshot, data.catalog, data.batch_colors, data.facets
+        department_list, year_list = facets.departments, facets.years
     except Exception as e:
         st.error(f"❌ Connection failed: {str(e)}")
         return
@@ -149,29 +210,10 @@ def main():
         st.header("📚 Batch Timetable")
         st.write("Select your batch and section to view your timetable.")
         
-        # Prepare batch data for dropdown selection
-        batch_list = list(batch_colors.values())
-        
-        # Extract departments from batch names (e.g., "BS CS (2024)" -> "CS")
-        dept_pattern = r"BS\s+([A-Z]+)"
-        departments_in_batches = set()
-        for batch_name in batch_list:
-            match = re.search(dept_pattern, str(batch_name))
-            if match:
-                departments_in_batches.add(match.group(1))
-        department_list_tab1 = sorted(departments_in_batches)
-        
-        # Extract years from batch names
-        year_to_batches_tab1 = {}
-        year_list_tab1 = []
-        for b in batch_list:
-            m = re.search(r"(20\d{2})", str(b))
-            if m:
-                y = m.group(1)
-                year_to_batches_tab1.setdefault(y, []).append(b)
-                if y not in year_list_tab1:
-                    year_list_tab1.append(y)
-        year_list_tab1 = sorted(year_list_tab1)
+        # Departments (e.g. "BS CS (2024)" -> "CS") and years found in batch names,
+        # precomputed once per revision
+        department_list_tab1 = facets.batch_departments
+        year_list_tab1 = facets.batch_years
 
         # Dropdown selection for department and batch (no auto-refresh)
         col1, col2 = st.columns(2)
@@ -186,12 +228,8 @@ def main():
                                             [""] + year_list_tab1,
                                             key="year_tab1")
         
-        # Filter batches based on selections
-        filtered_batches = batch_list
-        if selected_department_tab1:
-            filtered_batches = [b for b in filtered_batches if selected_department_tab1 in str(b)]
-        if selected_year_tab1:
-            filtered_batches = [b for b in filtered_batches if selected_year_tab1 in str(b)]
+        # Batches matching the selections, looked up instead of filtered per rerun
+        filtered_batches = facets.filtered_batches(selected_department_tab1, selected_year_tab1)
         
         # Auto-select batch from filtered list (take first match)
         if filtered_batches:
@@ -209,10 +247,9 @@ def main():
             if not batch or not section:
                 st.warning("⚠️ Please enter both batch and section.")
             else:
-                # Only fetch spreadsheet data when actually needed
+                # Served from the timetables rendered when the snapshot was loaded
                 with st.spinner("Generating timetable..."):
-                    spreadsheet = get_google_sheets_data(SHEET_URL)
-                    schedule = get_timetable(spreadsheet, batch, section)
+                    schedule = get_timetable(snapshot, batch, section)
 
                     if schedule.startswith("⚠️"):
                         st.error(schedule)
@@ -225,10 +262,6 @@ def main():
         st.header("🔍 Custom Course Selection")
         st.write("Search and select individual courses to create your custom timetable.")
 
-        # Use cached data instead of recomputing
-        unique_batches = sorted(set(batch_colors.values())) if batch_colors else []
-        batch_list = unique_batches
-
         # Filter section - moved above search for better mobile layout
         col1, col2 = st.columns(2)
 
@@ -249,8 +282,7 @@ def main():
             # Decide initial index based on previous selection which might be a full batch or a year
             initial_index = 0
             if st.session_state.selected_batch:
-                m_prev = re.search(r"(20\d{2})", str(st.session_state.selected_batch))
-                prev_year = m_prev.group(1) if m_prev else str(st.session_state.selected_batch)
+                prev_year = extract_year(st.session_state.selected_batch) or str(st.session_state.selected_batch)
                 if prev_year in year_list:
                     initial_index = ([""] + year_list).index(prev_year)
 
@@ -263,25 +295,10 @@ def main():
         # Course search section - now appears below filters for better mobile experience
         # Get filtered courses based on current department and batch selections
         # This allows the course dropdown to update dynamically
-        current_courses = all_courses  # Use cached data
-        
-        # Apply department filter if selected
-        if selected_department:
-            current_courses = [c for c in current_courses if c.get('department') == selected_department]
-        
-        # Apply batch/year filter if selected
-        if selected_year:
-            current_courses = [c for c in current_courses if selected_year in str(c.get('batch', ''))]
-        
-        # Create course options for dropdown with the new format: "course_name department section batch"
-        course_options = [""]  # Clear option message
-        course_map = {}  # Map display text to course object
-        
-        for course in current_courses:
-            display_text = format_course_display(course)
-            course_options.append(display_text)
-            course_map[display_text] = course
-        
+        # Labels ("course_name department section batch") and the label -> course map for
+        # every department/year filter are precomputed per revision, sorted by name
+        course_options, course_map = facets.options(selected_department, selected_year)
+
         selected_course_text = st.selectbox("🔍 Search courses",
                                            course_options,
                                            index=0)
@@ -305,16 +322,17 @@ def main():
                 st.rerun()
             else:
                 # Show a brief message that it's already selected
-                st.info(f"✅ **{format_course_display(selected_course)}** is already in your selection.")
+                st.info(f"✅ **{facets.course_label(selected_course)}** is already in your selection.")
                 st.session_state.last_selected_course = selected_course_text
         
         # Selected courses section
-        selected_courses = get_selected_courses()
+        # Selected course IDs resolved against this revision's catalog
+        selected_courses = get_selected_courses(catalog)
         if selected_courses:
             st.subheader("📝 Selected Courses")
             
             # Show selection summary
-            summary = get_selection_summary()
+            summary = get_selection_summary(catalog)
             st.write(f"**Total Courses:** {summary['total_courses']}")
             st.write(f"**Departments:** {', '.join(summary['departments']) if summary['departments'] else 'None'}")
             st.write(f"**Batches:** {', '.join(summary['batches']) if summary['batches'] else 'None'}")
@@ -324,7 +342,7 @@ def main():
                 col1, col2 = st.columns([4, 1])
                 with col1:
                     # Use compact format for selected courses list
-                    st.write(f"**{format_course_display(course)}**")
+                    st.write(f"**{facets.course_label(course)}**")
                 with col2:
                     if st.button("❌ Remove", key=f"selected_remove_{i}"):
                         remove_course_from_selection(course)
@@ -343,10 +361,9 @@ def main():
             center_col1, center_col2, center_col3 = st.columns([1, 2, 1])
             with center_col2:
                 if st.button("📅 Show Custom Timetable", key="custom_timetable_btn"):
-                    # Only fetch fresh spreadsheet data when generating custom timetable
+                    # Answer from the parsed snapshot instead of rescanning the grid
                     with st.spinner("Generating custom timetable..."):
-                        spreadsheet = get_google_sheets_data(SHEET_URL)
-                        schedule = get_custom_timetable(spreadsheet, selected_courses)
+                        schedule = get_custom_timetable(snapshot, selected_courses)
                         
                         if schedule.startswith("⚠️"):
                             st.error(schedule)
@@ -359,6 +376,9 @@ def main():
 
 if __name__ == "__main__":
     main()
+    # After main() so the panel includes the stages of this rerun
+    if is_admin():
+        show_metrics_panel()
 
     # Footer with support contact and LinkedIn profile
     st.markdown("---")
@@ -0,0 +1,125 @@
+"""Benchmark the extraction and matching functions on synthetic spreadsheets.
+
+Runs without Google credentials or Streamlit:
+
+    python benchmark_timetable.py                  # every scale
+    python benchmark_timetable.py --scales small medium --repeat 5 --json results.json
+    python benchmark_timetable.py --scales xlarge --workers 5   # also time the process-pool build
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from compact_grid import compact_spreadsheet
+from course_extractor import extract_all_courses, search_courses
+from extract_timetable import TimetableSnapshot, extract_batch_colors, get_custom_timetable, get_timetable
+from synthetic_timetable import generate_spreadsheet
+
+SCALES = {
+    'small': dict(batches=6, sections=3, rows=15, columns=9, lab_rows=4, embedded_times=3),
+    'medium': dict(batches=15, sections=4, rows=30, columns=10, lab_rows=8, embedded_times=8),
+    'large': dict(batches=30, sections=6, rows=60, columns=12, lab_rows=15, embedded_times=15),
+    'xlarge': dict(batches=60, sections=8, rows=120, columns=14, lab_rows=30, embedded_times=30),
+}
+
+TIMETABLE_LOOKUPS = 20
+CUSTOM_SELECTION_SIZE = 8
+
+
+def measure(func: Callable, repeat: int) -> Dict:
+    """Median wall time over repeat runs plus the tracemalloc peak of one extra run"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'median_ms': statistics.median(times) * 1000, 'min_ms': min(times) * 1000,
+            'peak_kib': peak / 1024}
+
+
+def run_scale(name: str, params: Dict, repeat: int, seed: int = 0, workers: int = 0) -> List[Dict]:
+    spreadsheet, batches = generate_spreadsheet(seed=seed, **params)
+    snapshot = TimetableSnapshot(spreadsheet)
+    compact = compact_spreadsheet(spreadsheet)
+    materialized = TimetableSnapshot(spreadsheet, materialize=True)
+    courses = extract_all_courses(snapshot)
+
+    rnd = random.Random(seed)
+    lookups = [(rnd.choice(batches), chr(65 + rnd.randrange(params['sections'])))
+               for _ in range(TIMETABLE_LOOKUPS)]
+    selection = rnd.sample(courses, min(CUSTOM_SELECTION_SIZE, len(courses)))
+
+    cases = {
+        'TimetableSnapshot build': lambda: TimetableSnapshot(spreadsheet),
+        'compact_spreadsheet': lambda: compact_spreadsheet(spreadsheet),
+        'TimetableSnapshot build (compact)': lambda: TimetableSnapshot(compact),
+        'extract_batch_colors': lambda: extract_batch_colors(spreadsheet),
+        'extract_all_courses (raw)': lambda: extract_all_courses(spreadsheet),
+        'extract_all_courses (snapshot)': lambda: extract_all_courses(snapshot),
+        'search_courses': lambda: search_courses(courses, query="a", department="CS"),
+        f'get_timetable x{TIMETABLE_LOOKUPS} (raw)': lambda: [get_timetable(spreadsheet, b, s) for b, s in lookups],
+        f'get_timetable x{TIMETABLE_LOOKUPS} (snapshot)': lambda: [get_timetable(snapshot, b, s) for b, s in lookups],
+        'TimetableSnapshot build + materialize': lambda: TimetableSnapshot(spreadsheet).materialize(),
+        f'get_timetable x{TIMETABLE_LOOKUPS} (materialized)':
+            lambda: [get_timetable(materialized, b, s) for b, s in lookups],
+        'get_custom_timetable (raw)': lambda: get_custom_timetable(spreadsheet, selection),
+        'get_custom_timetable (snapshot)': lambda: get_custom_timetable(snapshot, selection),
+    }
+
+    if workers > 1:
+        cases[f'TimetableSnapshot build ({workers} workers)'] = lambda: TimetableSnapshot(spreadsheet, workers=workers)
+
+    cells = sum(len(row.get('values', [])) for sheet in spreadsheet['sheets']
+                for row in sheet['data'][0]['rowData'])
+    results = []
+    for case, func in cases.items():
+        result = {'scale': name, 'case': case, 'cells': cells, 'courses': len(courses)}
+        result.update(measure(func, repeat))
+        results.append(result)
+    results.append(dict({'scale': name, 'case': 'materialize report', 'cells': cells, 'courses': len(courses)},
+                        **materialized.rendered.report()))
+    return results
+
+
+def print_results(results: List[Dict]):
+    print(f"{'scale':<8} {'cells':>7} {'case':<36} {'median ms':>10} {'min ms':>9} {'peak KiB':>10}")
+    for r in results:
+        if 'timetables' in r:
+            print(f"{r['scale']:<8} {r['cells']:>7} {r['case']:<36} {r['timetables']} timetables in "
+                  f"{r['seconds'] * 1000:.2f} ms, {r['memory_bytes'] / 1024:.1f} KiB")
+            continue
+        print(f"{r['scale']:<8} {r['cells']:>7} {r['case']:<36} {r['median_ms']:>10.2f} "
+              f"{r['min_ms']:>9.2f} {r['peak_kib']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=list(SCALES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    parser.add_argument('--workers', type=int, default=0, help="Also time the snapshot build with this many processes")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.scales:
+        results.extend(run_scale(name, SCALES[name], args.repeat, args.seed, args.workers))
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
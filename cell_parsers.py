@@ -0,0 +1,251 @@
+"""Memoized, precompiled parsers for timetable cell text.
+
+The same few hundred distinct cell texts are parsed over and over across the day
+sheets and across requests, so each parser keeps a bounded LRU memo keyed by its
+arguments and every regex is compiled once (per department where the pattern
+depends on it). parser_cache_stats() reports hits and misses.
+"""
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Pattern
+import re
+
+PARSER_CACHE_SIZE = 4096
+
+# Start/end minute of a slot without a readable time; sorts after every real time
+UNKNOWN_MINUTE = 24 * 60 * 7
+
+TIME_TOKEN_PATTERN = re.compile(r"(\d{1,2}:\d{2})")
+AMPM_PATTERN = re.compile(r"\b(am|pm|AM|PM)\b")
+EMBEDDED_TIME_PATTERN = re.compile(r'\b(\d{1,2}:\d{2}(?:-\d{1,2}:\d{2})?)\b')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+DEPARTMENT_TOKEN_PATTERN = re.compile(r"\b[A-Z]{2,4}\b")
+NAME_PUNCTUATION_PATTERN = re.compile(r'[\(\)\[\]\.,;:\-]')
+NAME_LAB_WORDS_PATTERN = re.compile(r'\b(lab|lab session|practical|pract)\b')
+
+# Standard section patterns that don't depend on the department
+SECTION_DASH_PATTERN = re.compile(r'-([A-Z])\b')       # Pattern like "-E"
+SECTION_PAREN_PATTERN = re.compile(r'\(([A-Z])\)')     # Pattern like "(E)"
+SECTION_SPACED_PATTERN = re.compile(r'\s([A-Z])\s')    # Pattern like " E " (with spaces)
+
+
+class DepartmentPatterns(NamedTuple):
+    """Section and group patterns of one department, compiled once"""
+    group_with_section: Pattern      # "(CS-A,G-1)"
+    group_section_prefix: Pattern    # "CS-A," inside such a group
+    group: Pattern                   # older "(CS, G-1)"
+    section_patterns: tuple          # "(CS-E)" then the department-independent patterns
+
+
+@lru_cache(maxsize=256)
+def department_patterns(dept: str) -> DepartmentPatterns:
+    dept_re = re.escape(dept)
+    return DepartmentPatterns(
+        group_with_section=re.compile(rf'\({dept_re}-([A-Z]),\s*G-\d+\)'),
+        group_section_prefix=re.compile(rf'{dept_re}-[A-Z],'),
+        group=re.compile(rf'\({dept_re},\s*G-\d+\)'),
+        section_patterns=(
+            re.compile(rf'\({dept_re}-([A-Z])\)'),  # Pattern like "(DEPT-E)"
+            SECTION_DASH_PATTERN,
+            SECTION_PAREN_PATTERN,
+            SECTION_SPACED_PATTERN,
+        ),
+    )
+
+
+def parse_course_entry(course_entry: str, batch: str) -> Optional[Dict]:
+    """Parse a course entry to extract course name, department, and section.
+
+    Returns a fresh dict on every call, so callers may add keys to it.
+    """
+    parsed = _parse_course_entry(course_entry, batch)
+    return dict(parsed) if parsed is not None else None
+
+
+@lru_cache(maxsize=PARSER_CACHE_SIZE)
+def _parse_course_entry(course_entry: str, batch: str) -> Optional[Dict]:
+    if not course_entry:
+        return None
+
+    # Extract department from batch (e.g., "BS-CS-1" -> "CS")
+    department = ""
+    if '-' in batch:
+        parts = batch.split('-')
+        if len(parts) >= 2:
+            department = parts[1]
+    else:
+        # Handle space-separated formats like 'BS CS (2025)'
+        tokens = DEPARTMENT_TOKEN_PATTERN.findall(batch)
+        for t in tokens:
+            if t != 'BS':
+                department = t
+                break
+
+    # Extract section from course entry
+    section = ""
+    course_name = course_entry
+
+    # Look for section patterns like "(DEPT-E)", "-E", "(E)", etc.
+    # Handle special cases for group patterns in actual timetable format
+    dept_from_batch = department if department else "CS"  # Fallback to CS if no department
+    patterns = department_patterns(dept_from_batch)
+
+    # Special handling for actual timetable group patterns like "(CS-A,G-1)" or "(CS-B,G-2)"
+    group_section_match = patterns.group_with_section.search(course_entry)
+    if group_section_match:
+        # Extract section from the group pattern
+        section = group_section_match.group(1)
+        # Keep the course name as is, but replace the section in the group with just the department
+        # E.g., "Gen AI (CS-A,G-1)" -> "Gen AI (CS,G-1)" with section="A"
+        course_name = patterns.group_section_prefix.sub(lambda _: f'{dept_from_batch},', course_entry)
+    else:
+        # Special handling for older format group patterns like "(CS, G-1)" or "(CS, G-2)"
+        group_match = patterns.group.search(course_entry)
+        if group_match:
+            # For group patterns, extract the base course name without the group info
+            # E.g., "DIP (CS, G-2)" -> "DIP"
+            course_name = patterns.group.sub('', course_entry).strip()
+            section = ""  # Section will be determined from timetable cell content
+        else:
+            # Standard section extraction patterns
+            for pattern in patterns.section_patterns:
+                match = pattern.search(course_entry)
+                if match:
+                    section = match.group(1)
+                    # Remove section info from course name
+                    course_name = pattern.sub('', course_name).strip()
+                    break
+
+    # Clean up course name
+    course_name = course_name.replace('()', '').strip()
+    if course_name.endswith('-'):
+        course_name = course_name[:-1].strip()
+
+    return {
+        'name': course_name,
+        'department': department,
+        'section': section,
+        'batch': batch,
+        'full_entry': course_entry
+    }
+
+
+class TimeRange(NamedTuple):
+    """A time slot as minutes after midnight"""
+    start: int
+    end: int
+
+
+UNKNOWN_RANGE = TimeRange(UNKNOWN_MINUTE, UNKNOWN_MINUTE)
+
+
+def _clock_minutes(token: str, ampm: Optional[str]) -> Optional[int]:
+    """Minutes after midnight of an 'HH:MM' token: 12-hour with AM/PM, else 24-hour"""
+    hours, minutes = (int(part) for part in token.split(':'))
+    if minutes > 59:
+        return None
+    if ampm and 1 <= hours <= 12:
+        return (hours % 12 + (12 if ampm == 'PM' else 0)) * 60 + minutes
+    if hours <= 23:
+        return hours * 60 + minutes
+    return None
+
+
+@lru_cache(maxsize=PARSER_CACHE_SIZE)
+def parse_time_range(time_slot) -> TimeRange:
+    """Parse a time slot like '08:00-08:50' or '2:00 PM' into integer start/end minutes.
+
+    The start is UNKNOWN_MINUTE when the slot has no readable time, which sorts it
+    last. A slot without an end time ends where it starts, and an end before the
+    start (e.g. '12:35-01:25') is moved 12 hours on.
+    """
+    text = str(time_slot)
+    if text == "Unknown":
+        return UNKNOWN_RANGE
+
+    times = TIME_TOKEN_PATTERN.findall(text)
+    if not times:
+        return UNKNOWN_RANGE
+
+    ampm_match = AMPM_PATTERN.search(text)
+    ampm = ampm_match.group(1).upper() if ampm_match else None
+
+    start = _clock_minutes(times[0], ampm)
+    if start is None:
+        return UNKNOWN_RANGE
+
+    end = _clock_minutes(times[1], ampm) if len(times) > 1 else None
+    if end is None:
+        end = start
+    elif end < start:
+        end = max(end + 12 * 60, start)
+    return TimeRange(start, end)
+
+
+@lru_cache(maxsize=PARSER_CACHE_SIZE)
+def parse_embedded_time_info(course_entry):
+    """
+    Parse embedded time information from course entries like:
+    'Func Eng (SE) 09:00-10:45' or 'Islamic (SE) 11:00-12:45'
+
+    Returns: (cleaned_course_name, time_slot, has_embedded_time)
+    """
+    if not course_entry:
+        return course_entry, "Unknown", False
+
+    # Look for time patterns in the course entry (HH:MM-HH:MM or HH:MM)
+    time_match = EMBEDDED_TIME_PATTERN.search(course_entry)
+
+    if time_match:
+        # Extract the time portion
+        time_slot = time_match.group(1)
+
+        # Remove the time portion from the course name
+        cleaned_entry = EMBEDDED_TIME_PATTERN.sub('', course_entry).strip()
+
+        # Clean up any double spaces or trailing characters
+        cleaned_entry = WHITESPACE_PATTERN.sub(' ', cleaned_entry).strip()
+        if cleaned_entry.endswith('-'):
+            cleaned_entry = cleaned_entry[:-1].strip()
+
+        return cleaned_entry, time_slot, True
+
+    return course_entry, "Unknown", False
+
+
+@lru_cache(maxsize=PARSER_CACHE_SIZE)
+def normalize_course_name(name: str) -> str:
+    """Normalize course name for comparison: lower-case, remove punctuation and common suffixes like 'lab'."""
+    if not name:
+        return ""
+    s = name.lower().strip()
+    # Remove common enclosing punctuation
+    s = NAME_PUNCTUATION_PATTERN.sub(' ', s)
+    # Remove common lab/practical words
+    s = NAME_LAB_WORDS_PATTERN.sub(' ', s)
+    # Collapse whitespace
+    s = WHITESPACE_PATTERN.sub(' ', s).strip()
+    return s
+
+
+MEMOIZED_PARSERS = {
+    'parse_course_entry': _parse_course_entry,
+    'parse_time_range': parse_time_range,
+    'parse_embedded_time_info': parse_embedded_time_info,
+    'normalize_course_name': normalize_course_name,
+}
+
+
+def parser_cache_stats() -> Dict[str, Dict[str, int]]:
+    """Hits, misses and current size of each parser's memo cache"""
+    stats = {}
+    for name, parser in MEMOIZED_PARSERS.items():
+        info = parser.cache_info()
+        stats[name] = {'hits': info.hits, 'misses': info.misses,
+                       'size': info.currsize, 'maxsize': info.maxsize}
+    return stats
+
+
+def clear_parser_caches():
+    """Empty every parser memo cache and reset its statistics"""
+    for parser in MEMOIZED_PARSERS.values():
+        parser.cache_clear()
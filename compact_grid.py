@@ -0,0 +1,145 @@
+"""Compact per-sheet grid built once from a Sheets API response.
+
+A CompactGrid keeps only what the timetable parser reads: each cell's text and
+background color. Texts are stored once in a table and referenced by id, colors
+are packed with color_key, and both live in flat arrays indexed through per-row
+offsets, so a sheet costs a few bytes per cell instead of a dict tree per cell.
+"""
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+NO_TEXT = -1      # text id of a cell without formattedValue
+NO_FORMAT = -1    # color of a cell without effectiveFormat
+
+
+def color_key(color):
+    """Pack a Sheets backgroundColor dict into one integer.
+
+    Each channel is rounded to two decimals (0-100), the precision of the old
+    f"{red:.2f}{green:.2f}{blue:.2f}" strings. The two can round a channel that
+    sits exactly half-way (e.g. 0.005) differently, which the 1/255 steps of
+    sheet colors don't produce. Missing channels count as 0.
+    """
+    return ((round(color.get('red', 0) * 100) << 16) |
+            (round(color.get('green', 0) * 100) << 8) |
+            round(color.get('blue', 0) * 100))
+
+
+class CompactGrid:
+    """Cell texts and packed background colors of one sheet in parallel arrays.
+
+    Row i spans positions row_starts[i]:row_starts[i + 1] of text_ids and colors.
+    A text id indexes texts (NO_TEXT when the cell has no formattedValue) and a
+    color is a color_key (NO_FORMAT when the cell has no effectiveFormat).
+    """
+
+    __slots__ = ('texts', 'row_starts', 'text_ids', 'colors')
+
+    def __init__(self, texts: List[str], row_starts: array, text_ids: array, colors: array):
+        self.texts = texts
+        self.row_starts = row_starts
+        self.text_ids = text_ids
+        self.colors = colors
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict]) -> 'CompactGrid':
+        """Build from a rowData list"""
+        builder = CompactGridBuilder()
+        for row in rows:
+            builder.add_row(row)
+        return builder.build()
+
+    def __len__(self):
+        return len(self.row_starts) - 1
+
+    def row_width(self, row: int) -> int:
+        return self.row_starts[row + 1] - self.row_starts[row]
+
+    def row_texts(self, row: int) -> List[Optional[str]]:
+        """Text of every cell in the row, None where a cell has no formattedValue"""
+        texts = self.texts
+        return [texts[i] if i != NO_TEXT else None
+                for i in self.text_ids[self.row_starts[row]:self.row_starts[row + 1]]]
+
+    def row_colors(self, row: int) -> array:
+        """color_key of every cell in the row, NO_FORMAT where a cell has no effectiveFormat"""
+        return self.colors[self.row_starts[row]:self.row_starts[row + 1]]
+
+    def text(self, row: int, col: int) -> Optional[str]:
+        """Text of one cell, None when it has none or lies outside the row"""
+        if col >= self.row_width(row):
+            return None
+        text_id = self.text_ids[self.row_starts[row] + col]
+        return self.texts[text_id] if text_id != NO_TEXT else None
+
+
+class CompactGridBuilder:
+    """Accumulates rows one at a time, so raw row dicts can be dropped as they are read"""
+
+    def __init__(self):
+        self.texts = []
+        self._text_ids = {}
+        self.row_starts = array('i', [0])
+        self.text_ids = array('i')
+        self.colors = array('i')
+        # A sheet uses a few dozen distinct colors, so pack each (red, green, blue) once
+        self._color_keys = {}
+
+    def add_row(self, row: Dict):
+        values = row.get('values', ()) if isinstance(row, dict) else ()
+        texts, known_ids = self.texts, self._text_ids
+        text_ids, colors, color_keys = self.text_ids, self.colors, self._color_keys
+        for cell in values:
+            if not isinstance(cell, dict):
+                text_ids.append(NO_TEXT)
+                colors.append(NO_FORMAT)
+                continue
+
+            text = cell.get('formattedValue')
+            if text is None:
+                text_ids.append(NO_TEXT)
+            else:
+                text_id = known_ids.get(text)
+                if text_id is None:
+                    text_id = known_ids[text] = len(texts)
+                    texts.append(text)
+                text_ids.append(text_id)
+
+            cell_format = cell.get('effectiveFormat')
+            if cell_format is None:
+                colors.append(NO_FORMAT)
+            else:
+                color = cell_format.get('backgroundColor', {})
+                channels = (color.get('red', 0), color.get('green', 0), color.get('blue', 0))
+                key = color_keys.get(channels)
+                if key is None:
+                    key = color_keys[channels] = color_key(color)
+                colors.append(key)
+        self.row_starts.append(len(text_ids))
+
+    def build(self) -> CompactGrid:
+        return CompactGrid(self.texts, self.row_starts, self.text_ids, self.colors)
+
+
+def sheet_grid(sheet: Dict) -> CompactGrid:
+    """The sheet's CompactGrid, built from its first GridData unless the sheet already carries one"""
+    grid = sheet.get('grid')
+    if grid is None:
+        grid = CompactGrid.from_rows(sheet.get('data', [{}])[0].get('rowData', []))
+    return grid
+
+
+def compact_spreadsheet(spreadsheet: Dict, sheet_titles: Optional[Iterable[str]] = None) -> Dict:
+    """A copy of the spreadsheet dict whose sheets carry a CompactGrid instead of their grid data.
+
+    Only sheets named in sheet_titles are kept when it is given. The original dict
+    can be dropped afterwards; the compact one is accepted wherever it is.
+    """
+    wanted = set(sheet_titles) if sheet_titles is not None else None
+    sheets = []
+    for sheet in spreadsheet.get('sheets', []):
+        title = sheet['properties']['title']
+        if wanted is not None and title not in wanted:
+            continue
+        sheets.append({'properties': {'title': title}, 'grid': sheet_grid(sheet)})
+    return {'spreadsheetId': spreadsheet.get('spreadsheetId', ''), 'sheets': sheets}
@@ -1,29 +1,29 @@
-from typing import List, Dict, Set, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import hashlib
 import re
 
+from cell_parsers import parse_course_entry
+from extract_timetable import TIMETABLE_SHEETS, TimetableSnapshot, extract_year, sheet_legend_grid
+from metrics import METRICS
+
 
 def extract_departments_and_batches(spreadsheet) -> Tuple[Set[str], Set[str]]:
     """Extract unique departments and batches from the first 4 rows of all sheets"""
     departments = set()
     batches = set()
-    timetable_sheets = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
-    
+
     for sheet in spreadsheet.get('sheets', []):
         sheet_name = sheet['properties']['title']
-        if sheet_name not in timetable_sheets:
+        if sheet_name not in TIMETABLE_SHEETS:
             continue
-            
-        grid_data = sheet.get('data', [{}])[0].get('rowData', [])
-        
+
+        grid = sheet_legend_grid(sheet)
+
         # Check first 4 rows (0-indexed)
-        for row_idx in range(4):
-            if row_idx >= len(grid_data):
-                continue
-                
-            row_data = grid_data[row_idx].get('values', [])
-            for cell in row_data:
-                if 'formattedValue' in cell:
-                    value = cell['formattedValue'].strip()
+        for row_idx in range(min(4, len(grid))):
+            for text in grid.row_texts(row_idx):
+                if text is not None:
+                    value = text.strip()
                     
                     # Extract departments (look for patterns like "CS", "EE", etc.)
                     if re.match(r'^[A-Z]{2,4}$', value) and len(value) <= 4:
@@ -35,159 +35,187 @@ def extract_departments_and_batches(spreadsheet) -> Tuple[Set[str], Set[str]]:
     
     return departments, batches
 
-def extract_all_courses(spreadsheet) -> List[Dict]:
-    """Extract all courses from the spreadsheet with their metadata"""
-    courses = []
-    timetable_sheets = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
-    
-    # First, get batch colors mapping
-    batch_colors = {}
-    for sheet in spreadsheet.get('sheets', []):
-        sheet_name = sheet['properties']['title']
-        if sheet_name not in timetable_sheets:
-            continue
-            
-        grid_data = sheet.get('data', [{}])[0].get('rowData', [])
-        
-        # Extract batch colors from first 4 rows
-        for row_idx in range(4):
-            if row_idx >= len(grid_data):
+def course_key(course: Dict) -> Tuple[str, str, str, str]:
+    """Identity of a course: (name, department, section, batch)"""
+    return (course['name'], course['department'], course['section'], course['batch'])
+
+
+def course_id(course: Dict) -> str:
+    """Short stable ID of a course identity; the same course gets the same ID in every sheet revision"""
+    return hashlib.blake2b('\x1f'.join(course_key(course)).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def format_course_display(course: Dict) -> str:
+    """Return a compact display string for a course: 'name dept section year-or-batch'
+    Example: 'Data St CS A 2024' (falls back to full batch string if year not found)
+    """
+    name = course.get('name', '').strip()
+    dept = course.get('department', '').strip()
+    section = course.get('section', '').strip()
+    batch = str(course.get('batch', '')).strip()
+    # Prefer year (e.g., 2024) when available inside the batch string
+    year = extract_year(batch) or batch
+    parts = [p for p in [name, dept, section, year] if p]
+    return " ".join(parts)
+
+
+def course_sort_key(course: Dict) -> Tuple[str, str, str]:
+    """Alphabetical order by course name, then department, then section"""
+    return (course.get('name', '').lower(), course.get('department', ''), course.get('section', ''))
+
+
+class CourseCatalog:
+    """Deduplicated course list with hashed identities and department, batch and year indexes.
+
+    courses keeps first-seen order like extract_all_courses. The index lists are kept
+    in course_sort_key order, so filtered results come out already sorted.
+    """
+
+    def __init__(self, courses: Iterable[Dict] = ()):
+        self.courses = []
+        self._by_key = {}
+        self._by_id = {}
+        self._sorted = None
+        self._by_department = {}
+        self._by_batch = {}
+        self._by_year = {}
+        for course in courses:
+            self.add(course)
+
+    def __len__(self) -> int:
+        return len(self.courses)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.courses)
+
+    def __contains__(self, course: Dict) -> bool:
+        return course_key(course) in self._by_key
+
+    def get(self, key: Tuple[str, str, str, str]) -> Optional[Dict]:
+        return self._by_key.get(key)
+
+    def by_id(self, id_: str) -> Optional[Dict]:
+        """The course with this course_id, None if it isn't in the catalog"""
+        return self._by_id.get(id_)
+
+    def resolve(self, ids: Iterable[str]) -> List[Dict]:
+        """Courses for the given course_ids in the same order, skipping IDs not in the catalog"""
+        by_id = self._by_id
+        return [by_id[i] for i in ids if i in by_id]
+
+    def add(self, course: Dict) -> bool:
+        """Add a course unless one with the same identity exists; returns True if added"""
+        key = course_key(course)
+        if key in self._by_key:
+            return False
+        self._by_key[key] = course
+        self._by_id[course_id(course)] = course
+        self.courses.append(course)
+        self._sorted = None
+        return True
+
+    def _build_indexes(self):
+        # Build into locals and publish _sorted last, so a catalog shared between
+        # threads never exposes half-built indexes
+        ordered = sorted(self.courses, key=course_sort_key)
+        by_department, by_batch, by_year = {}, {}, {}
+        for course in ordered:
+            by_department.setdefault(course['department'], []).append(course)
+            by_batch.setdefault(course['batch'], []).append(course)
+            year = extract_year(course['batch'])
+            if year:
+                by_year.setdefault(year, []).append(course)
+        self._by_department, self._by_batch, self._by_year = by_department, by_batch, by_year
+        self._sorted = ordered
+
+    def sorted_courses(self) -> List[Dict]:
+        if self._sorted is None:
+            self._build_indexes()
+        return self._sorted
+
+    def departments(self) -> List[str]:
+        """Sorted non-empty departments"""
+        self.sorted_courses()
+        return sorted(d for d in self._by_department if d)
+
+    def years(self) -> List[str]:
+        """Sorted years found in batch names"""
+        self.sorted_courses()
+        return sorted(self._by_year)
+
+    def filter(self, department: str = "", batch: str = "", year: str = "") -> List[Dict]:
+        """Sorted courses matching every given filter, answered from the smallest index"""
+        candidates = [self.sorted_courses()]
+        if department:
+            candidates.append(self._by_department.get(department, []))
+        if batch:
+            candidates.append(self._by_batch.get(batch, []))
+        if year:
+            candidates.append(self._by_year.get(year, []))
+        result = min(candidates, key=len)
+
+        if department and result is not self._by_department.get(department):
+            result = [c for c in result if c['department'] == department]
+        if batch and result is not self._by_batch.get(batch):
+            result = [c for c in result if c['batch'] == batch]
+        if year and result is not self._by_year.get(year):
+            result = [c for c in result if extract_year(c['batch']) == year]
+        return list(result)
+
+    def search(self, query: str = "", department: str = "", batch: str = "", year: str = "") -> List[Dict]:
+        """Same results as search_courses over the course list, optionally narrowed to a year"""
+        filtered_courses = self.filter(department=department, batch=batch, year=year)
+        if query:
+            query_lower = query.lower()
+            filtered_courses = [c for c in filtered_courses if
+                                query_lower in c['name'].lower() or
+                                query_lower in c['department'].lower() or
+                                query_lower in c['section'].lower()]
+        return filtered_courses
+
+
+def extract_course_catalog(spreadsheet) -> CourseCatalog:
+    """Extract all courses into an indexed CourseCatalog from the snapshot's parsed cells"""
+    catalog = CourseCatalog()
+    snapshot = TimetableSnapshot.ensure(spreadsheet)
+
+    with METRICS.stage('courses') as counts:
+        for session in snapshot.sessions:
+            # Only cells drawn in a batch color hold courses
+            if not session.batch:
                 continue
-                
-            row_data = grid_data[row_idx].get('values', [])
-            for cell in row_data:
-                if 'formattedValue' in cell and 'BS' in cell['formattedValue']:
-                    color = cell.get('effectiveFormat', {}).get('backgroundColor', {})
-                    color_hex = f"{color.get('red', 0):.2f}{color.get('green', 0):.2f}{color.get('blue', 0):.2f}"
-                    batch_colors[color_hex] = cell['formattedValue'].strip()
-    
-    # Now extract courses from all sheets
-    for sheet in spreadsheet.get('sheets', []):
-        sheet_name = sheet['properties']['title']
-        if sheet_name not in timetable_sheets:
-            continue
-            
-        grid_data = sheet.get('data', [{}])[0].get('rowData', [])
-        
-        # Process timetable rows (skip header rows). Start from row index 5 (0-indexed)
-        for row_idx, row in enumerate(grid_data[5:], start=6):
-            row_values = row.get('values', []) if isinstance(row, dict) else []
-            
-            for col_idx, cell in enumerate(row_values):
-                if not isinstance(cell, dict) or 'effectiveFormat' not in cell:
-                    continue
-                
-                # Get cell color
-                color = cell.get('effectiveFormat', {}).get('backgroundColor', {})
-                cell_color = f"{color.get('red', 0):.2f}{color.get('green', 0):.2f}{color.get('blue', 0):.2f}"
-                
-                # Check if this cell has a course (has color and formatted value)
-                if cell_color in batch_colors and 'formattedValue' in cell:
-                    course_entry = cell.get('formattedValue', '').strip()
-                    
-                    if course_entry:
-                        # Extract course information
-                        course_info = parse_course_entry(course_entry, batch_colors[cell_color])
-                        
-                        if course_info:
-                            # Add day information
-                            course_info['day'] = sheet_name
-                            course_info['color_code'] = cell_color
-                            
-                            # Check if this course is already in our list
-                            existing_course = find_existing_course(courses, course_info)
-                            if not existing_course:
-                                courses.append(course_info)
-    
-    return courses
 
-def parse_course_entry(course_entry: str, batch: str) -> Dict:
-    """Parse a course entry to extract course name, department, and section"""
-    if not course_entry:
-        return None
-    
-    # Extract department from batch (e.g., "BS-CS-1" -> "CS")
-    department = ""
-    if '-' in batch:
-        parts = batch.split('-')
-        if len(parts) >= 2:
-            department = parts[1]
-    else:
-        # Handle space-separated formats like 'BS CS (2025)'
-        tokens = re.findall(r"\b[A-Z]{2,4}\b", batch)
-        for t in tokens:
-            if t != 'BS':
-                department = t
-                break
-    
-    # Extract section from course entry
-    section = ""
-    course_name = course_entry
-    
-    # Look for section patterns like "(DEPT-E)", "-E", "(E)", etc.
-    # Handle special cases for group patterns in actual timetable format
-    dept_from_batch = department if department else "CS"  # Fallback to CS if no department
-    
-    # Special handling for actual timetable group patterns like "(CS-A,G-1)" or "(CS-B,G-2)"
-    group_with_section_pattern = rf'\({dept_from_batch}-([A-Z]),\s*G-\d+\)'
-    group_section_match = re.search(group_with_section_pattern, course_entry)
-    if group_section_match:
-        # Extract section from the group pattern
-        section = group_section_match.group(1)
-        # Keep the course name as is, but replace the section in the group with just the department
-        # E.g., "Gen AI (CS-A,G-1)" -> "Gen AI (CS,G-1)" with section="A"
-        course_name = re.sub(rf'{dept_from_batch}-[A-Z],', f'{dept_from_batch},', course_entry)
-    else:
-        # Special handling for older format group patterns like "(CS, G-1)" or "(CS, G-2)"
-        group_pattern = rf'\({dept_from_batch},\s*G-\d+\)'
-        group_match = re.search(group_pattern, course_entry)
-        if group_match:
-            # For group patterns, extract the base course name without the group info
-            # E.g., "DIP (CS, G-2)" -> "DIP"
-            course_name = re.sub(group_pattern, '', course_entry).strip()
-            section = ""  # Section will be determined from timetable cell content
-        else:
-            # Standard section extraction patterns
-            section_patterns = [
-                rf'\({dept_from_batch}-([A-Z])\)',  # Pattern like "(DEPT-E)"
-                r'-([A-Z])\b',      # Pattern like "-E"
-                r'\(([A-Z])\)',     # Pattern like "(E)"
-                r'\s([A-Z])\s'      # Pattern like " E " (with spaces)
-            ]
-            
-            for pattern in section_patterns:
-                match = re.search(pattern, course_entry)
-                if match:
-                    section = match.group(1)
-                    # Remove section info from course name
-                    course_name = re.sub(pattern, '', course_name).strip()
-                    break
-    
-    # Clean up course name
-    course_name = course_name.replace('()', '').strip()
-    if course_name.endswith('-'):
-        course_name = course_name[:-1].strip()
-    
-    return {
-        'name': course_name,
-        'department': department,
-        'section': section,
-        'batch': batch,
-        'full_entry': course_entry
-    }
-
-def find_existing_course(courses: List[Dict], new_course: Dict) -> Dict:
-    """Check if a course already exists in the list"""
-    for course in courses:
-        if (course['name'] == new_course['name'] and 
-            course['department'] == new_course['department'] and
-            course['section'] == new_course['section'] and
-            course['batch'] == new_course['batch']):
-            return course
-    return None
+            course_entry = session.entry.strip()
+            if course_entry:
+                # The first cell seen for a course identity wins
+                catalog.add({
+                    'name': session.name,
+                    'department': session.dept,
+                    'section': session.section,
+                    'batch': session.batch,
+                    'full_entry': course_entry,
+                    'day': session.day,
+                    'color_code': session.color,
+                })
+
+        catalog.sorted_courses()
+        counts['sessions'] = len(snapshot.sessions)
+        counts['courses'] = len(catalog)
+    return catalog
+
+
+def extract_all_courses(spreadsheet) -> List[Dict]:
+    """Extract all courses from the spreadsheet with their metadata"""
+    return extract_course_catalog(spreadsheet).courses
 
 def search_courses(courses: List[Dict], query: str = "", department: str = "", batch: str = "") -> List[Dict]:
-    """Search courses based on query, department, and batch filters"""
+    """Search courses based on query, department, and batch filters.
+
+    courses may also be a CourseCatalog, which answers from its indexes.
+    """
+    if isinstance(courses, CourseCatalog):
+        return courses.search(query, department, batch)
+
     filtered_courses = courses.copy()
     
     # Filter by department
@@ -207,6 +235,6 @@ def search_courses(courses: List[Dict], query: str = "", department: str = "", b
                           query_lower in c['section'].lower()]
 
     # Sort alphabetically by course name, then department, then section
-    filtered_courses.sort(key=lambda c: (c.get('name', '').lower(), c.get('department', ''), c.get('section', '')))
+    filtered_courses.sort(key=course_sort_key)
 
     return filtered_courses
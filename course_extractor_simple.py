@@ -1,6 +1,8 @@
 from typing import List, Dict, Set, Tuple
 import re
 
+from compact_grid import color_key
+
 def extract_departments_and_batches_simple(spreadsheet) -> Tuple[Set[str], Set[str]]:
     """Extract departments and batches using the same logic as the working original code"""
     departments = set()
@@ -26,10 +28,10 @@ def extract_departments_and_batches_simple(spreadsheet) -> Tuple[Set[str], Set[s
                 if 'formattedValue' in cell and 'BS' in cell['formattedValue']:
                     # Get background color
                     color = cell.get('effectiveFormat', {}).get('backgroundColor', {})
-                    # Convert color to hex string
-                    color_hex = f"{color.get('red', 0):.2f}{color.get('green', 0):.2f}{color.get('blue', 0):.2f}"
+                    # Pack color into an integer key
+                    key = color_key(color)
                     batch_value = cell['formattedValue'].strip()
-                    batch_colors[color_hex] = batch_value
+                    batch_colors[key] = batch_value
                     
                     # Extract batch and department from the batch value
                     if 'BS-' in batch_value:
@@ -65,9 +67,9 @@ def extract_all_courses_simple(spreadsheet) -> List[Dict]:
                 if 'formattedValue' in cell and 'BS' in cell['formattedValue']:
                     # Get background color
                     color = cell.get('effectiveFormat', {}).get('backgroundColor', {})
-                    # Convert color to hex string
-                    color_hex = f"{color.get('red', 0):.2f}{color.get('green', 0):.2f}{color.get('blue', 0):.2f}"
-                    batch_colors[color_hex] = cell['formattedValue'].strip()
+                    # Pack color into an integer key
+                    key = color_key(color)
+                    batch_colors[key] = cell['formattedValue'].strip()
     
     # Now extract courses using the same logic as the original get_timetable function
     for sheet in spreadsheet.get('sheets', []):
@@ -90,7 +92,7 @@ def extract_all_courses_simple(spreadsheet) -> List[Dict]:
 
                 # Get cell color - same as original
                 color = cell.get('effectiveFormat', {}).get('backgroundColor', {})
-                cell_color = f"{color.get('red', 0):.2f}{color.get('green', 0):.2f}{color.get('blue', 0):.2f}"
+                cell_color = color_key(color)
 
                 # Check if this cell has a course (has color and formatted value) - same as original
                 if cell_color in batch_colors and 'formattedValue' in cell:
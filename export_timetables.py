@@ -0,0 +1,313 @@
+"""Export every batch/section timetable and the course catalog without the Streamlit UI.
+
+Reads a saved spreadsheet JSON (the Sheets API v4 includeGridData response) or
+fetches the sheet with a service account key, then writes:
+
+    timetables.json          every batch -> section -> day -> sessions
+    timetables.csv           one row per session
+    courses.json, courses.csv  the course catalog
+    ics/<batch>_<section>.ics  a weekly recurring calendar per section
+
+    python export_timetables.py --input spreadsheet.json --out exports
+    python export_timetables.py --sheet-url URL --credentials key.json --out exports --workers 8
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cell_parsers import UNKNOWN_MINUTE
+from course_extractor import extract_course_catalog
+from extract_timetable import TIMETABLE_SHEETS, TimetableSnapshot, batch_timetable_entries, extract_year
+from grid_stream import read_spreadsheet_stream
+from timetable_clashes import day_range
+
+TIMETABLE_CSV_FIELDS = ['batch', 'section', 'day', 'time', 'start', 'end', 'room', 'type', 'course']
+COURSE_CSV_FIELDS = ['name', 'department', 'section', 'batch', 'year', 'day', 'full_entry']
+ICAL_WEEKDAYS = {day: code for day, code in zip(TIMETABLE_SHEETS, ['MO', 'TU', 'WE', 'TH', 'FR'])}
+READ_CHUNK_SIZE = 64 * 1024
+DEFAULT_WEEKS = 16
+
+
+def load_spreadsheet(path: str) -> Dict:
+    """Read a saved spreadsheet JSON into compact grids without decoding it whole"""
+    with open(path, 'rb') as f:
+        return read_spreadsheet_stream(iter(lambda: f.read(READ_CHUNK_SIZE), b''))
+
+
+def fetch_spreadsheet_with_key(sheet_url: str, credentials_path: str) -> Dict:
+    """Fetch the day sheets with a service account key; needs the Google client libraries"""
+    from sheets_client import StreamingSpreadsheetFetch, spreadsheet_id_from_url
+
+    with open(credentials_path) as f:
+        credentials_info = json.load(f)
+    return StreamingSpreadsheetFetch(credentials_info)(spreadsheet_id_from_url(sheet_url))
+
+
+def clock(minute: int) -> str:
+    """'HH:MM' on the teaching day, '' for an unknown time"""
+    return f"{minute // 60:02d}:{minute % 60:02d}" if minute < UNKNOWN_MINUTE else ""
+
+
+def entry_times(entry) -> Tuple[Optional[int], Optional[int]]:
+    """Start and end minute of a TimetableEntry with afternoon times moved past noon"""
+    if entry.start >= UNKNOWN_MINUTE:
+        return None, None
+    return day_range(entry.start, entry.end)
+
+
+def safe_filename(value: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', value).strip('_') or 'unnamed'
+
+
+def ical_escape(text: str) -> str:
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def ical_fold(line: str) -> str:
+    """Fold a content line at 75 octets as RFC 5545 requires"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        # Don't split a multi-byte character
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    return '\r\n '.join(parts)
+
+
+def section_calendar(batch: str, section: str, timetable: Dict[str, List], term_start: date,
+                     weeks: int, stamp: str) -> Tuple[str, int]:
+    """iCalendar text with one weekly event per timed session, and the number of events.
+
+    Times are floating local times. Sessions without a readable time are left out.
+    """
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//FAST-NUCES FCS Timetable//Export//EN',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{ical_escape(f"{batch} Section {section}")}',
+    ]
+    events = 0
+    for day, entries in timetable.items():
+        # term_start is moved to the Monday of its week
+        first_day = term_start - timedelta(days=term_start.weekday()) + timedelta(days=TIMETABLE_SHEETS.index(day))
+        for entry in entries:
+            start, end = entry_times(entry)
+            if start is None:
+                continue
+            begin = datetime.combine(first_day, datetime.min.time()) + timedelta(minutes=start)
+            finish = datetime.combine(first_day, datetime.min.time()) + timedelta(minutes=end)
+            uid_source = '|'.join([batch, section, day, entry.slot, entry.room, entry.type, entry.course])
+            lines += [
+                'BEGIN:VEVENT',
+                f'UID:{hashlib.sha1(uid_source.encode("utf-8")).hexdigest()}@timetable-export',
+                f'DTSTAMP:{stamp}',
+                f'DTSTART:{begin:%Y%m%dT%H%M%S}',
+                f'DTEND:{finish:%Y%m%dT%H%M%S}',
+                f'RRULE:FREQ=WEEKLY;BYDAY={ICAL_WEEKDAYS[day]};COUNT={weeks}',
+                f'SUMMARY:{ical_escape(f"{entry.course} ({entry.type})")}',
+                f'LOCATION:{ical_escape(entry.room)}',
+                f'DESCRIPTION:{ical_escape(f"{batch} Section {section}, {entry.slot}")}',
+                'END:VEVENT',
+            ]
+            events += 1
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(ical_fold(line) for line in lines) + '\r\n', events
+
+
+def entry_record(entry) -> Dict:
+    start, end = entry_times(entry)
+    return {
+        'time': entry.slot,
+        'start': clock(start) if start is not None else '',
+        'end': clock(end) if end is not None else '',
+        'room': entry.room,
+        'type': entry.type,
+        'course': entry.course,
+    }
+
+
+def course_record(course: Dict) -> Dict:
+    return {
+        'name': course['name'],
+        'department': course['department'],
+        'section': course['section'],
+        'batch': course['batch'],
+        'year': extract_year(course['batch']) or '',
+        'day': course.get('day', ''),
+        'full_entry': course['full_entry'],
+    }
+
+
+# Set in each worker by _init_worker so the snapshot is sent once per process, not per task
+_worker_snapshot = None
+
+
+def _init_worker(snapshot):
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+def export_section(snapshot, batch: str, section: str, ics_dir: Optional[str], term_start: date,
+                   weeks: int, stamp: str) -> Tuple[str, str, Dict[str, List[Dict]], int]:
+    """Render one section: (batch, section, day -> session records, calendar events written)"""
+    timetable = batch_timetable_entries(snapshot, batch, section) or {}
+    events = 0
+    if ics_dir is not None:
+        calendar, events = section_calendar(batch, section, timetable, term_start, weeks, stamp)
+        path = os.path.join(ics_dir, f"{safe_filename(batch)}_{section}.ics")
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(calendar)
+    records = {day: [entry_record(entry) for entry in entries] for day, entries in timetable.items()}
+    return batch, section, records, events
+
+
+def _export_section_in_worker(batch, section, ics_dir, term_start, weeks, stamp):
+    return export_section(_worker_snapshot, batch, section, ics_dir, term_start, weeks, stamp)
+
+
+class Progress:
+    """Progress report on stderr: one updating line on a terminal, a line per tenth otherwise"""
+
+    def __init__(self, total: int, enabled: bool = True):
+        self.total = total
+        self.done = 0
+        self.enabled = enabled
+        self.interactive = sys.stderr.isatty()
+        self.started = time.perf_counter()
+
+    def advance(self, label: str):
+        self.done += 1
+        if not self.enabled:
+            return
+        if self.interactive:
+            sys.stderr.write(f"\r[{self.done}/{self.total}] {label[:60]:<60}")
+            sys.stderr.flush()
+        elif self.done == self.total or self.done % max(1, self.total // 10) == 0:
+            sys.stderr.write(f"[{self.done}/{self.total}] {label}\n")
+
+    def finish(self):
+        if self.enabled and self.interactive:
+            sys.stderr.write("\r" + " " * 80 + "\r")
+
+
+def export_all(snapshot: TimetableSnapshot, out_dir: str, workers: int = 1, formats: Iterable[str] = ('json', 'csv', 'ics'),
+               term_start: Optional[date] = None, weeks: int = DEFAULT_WEEKS, progress: bool = True) -> Dict:
+    """Write every batch/section timetable and the course catalog to out_dir; returns a summary"""
+    formats = set(formats)
+    os.makedirs(out_dir, exist_ok=True)
+    ics_dir = os.path.join(out_dir, 'ics') if 'ics' in formats else None
+    if ics_dir is not None:
+        os.makedirs(ics_dir, exist_ok=True)
+    term_start = term_start or date.today()
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    pairs = snapshot.section_pairs()
+    progress_report = Progress(len(pairs), progress)
+    results = {}
+    events = 0
+
+    if workers > 1 and len(pairs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(snapshot,)) as pool:
+            futures = [pool.submit(_export_section_in_worker, batch, section, ics_dir, term_start, weeks, stamp)
+                       for batch, section in pairs]
+            for future in as_completed(futures):
+                batch, section, records, section_events = future.result()
+                results[(batch, section)] = records
+                events += section_events
+                progress_report.advance(f"{batch} {section}")
+    else:
+        for batch, section in pairs:
+            _, _, records, section_events = export_section(snapshot, batch, section, ics_dir, term_start, weeks, stamp)
+            results[(batch, section)] = records
+            events += section_events
+            progress_report.advance(f"{batch} {section}")
+    progress_report.finish()
+
+    # Completion order varies with workers, so write in section_pairs order
+    if 'json' in formats:
+        nested = {}
+        for batch, section in pairs:
+            nested.setdefault(batch, {})[section] = results[(batch, section)]
+        with open(os.path.join(out_dir, 'timetables.json'), 'w', encoding='utf-8') as f:
+            json.dump(nested, f, indent=2, ensure_ascii=False)
+    if 'csv' in formats:
+        with open(os.path.join(out_dir, 'timetables.csv'), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=TIMETABLE_CSV_FIELDS)
+            writer.writeheader()
+            for batch, section in pairs:
+                for day, records in results[(batch, section)].items():
+                    for record in records:
+                        writer.writerow(dict(record, batch=batch, section=section, day=day))
+
+    courses = export_courses(snapshot, out_dir, formats)
+    return {'timetables': len(pairs), 'sessions': sum(len(r) for t in results.values() for r in t.values()),
+            'calendar_events': events, 'courses': courses}
+
+
+def export_courses(snapshot: TimetableSnapshot, out_dir: str, formats: Iterable[str]) -> int:
+    """Write the course catalog as JSON and/or CSV; returns the number of courses"""
+    courses = [course_record(course) for course in extract_course_catalog(snapshot).sorted_courses()]
+
+    if 'json' in formats:
+        with open(os.path.join(out_dir, 'courses.json'), 'w', encoding='utf-8') as f:
+            json.dump(courses, f, indent=2, ensure_ascii=False)
+    if 'csv' in formats:
+        with open(os.path.join(out_dir, 'courses.csv'), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COURSE_CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(courses)
+    return len(courses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help="Saved spreadsheet JSON")
+    source.add_argument('--sheet-url', help="Fetch this Google Sheet (needs --credentials)")
+    parser.add_argument('--credentials', help="Service account JSON key for --sheet-url")
+    parser.add_argument('--out', default='exports', help="Output directory (default: exports)")
+    parser.add_argument('--formats', nargs='+', choices=['json', 'csv', 'ics'], default=['json', 'csv', 'ics'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Worker processes for rendering sections (1 renders in this process)")
+    parser.add_argument('--term-start', type=date.fromisoformat, default=None,
+                        help="First teaching week as YYYY-MM-DD for calendar events (default: this week)")
+    parser.add_argument('--weeks', type=int, default=DEFAULT_WEEKS, help="Weeks each calendar event repeats")
+    parser.add_argument('--quiet', action='store_true', help="Don't print progress")
+    args = parser.parse_args()
+
+    if args.sheet_url and not args.credentials:
+        parser.error("--sheet-url needs --credentials")
+
+    started = time.perf_counter()
+    if args.input:
+        spreadsheet = load_spreadsheet(args.input)
+    else:
+        spreadsheet = fetch_spreadsheet_with_key(args.sheet_url, args.credentials)
+    snapshot = TimetableSnapshot(spreadsheet)
+    del spreadsheet
+
+    summary = export_all(snapshot, args.out, workers=args.workers, formats=args.formats,
+                         term_start=args.term_start, weeks=args.weeks, progress=not args.quiet)
+    print(f"{summary['timetables']} timetables, {summary['sessions']} sessions, "
+          f"{summary['calendar_events']} calendar events and {summary['courses']} courses written to "
+          f"{args.out} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,46 @@
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from string import ascii_uppercase
+from typing import NamedTuple
 import re
+import sys
+import time
+
+from compact_grid import NO_FORMAT, CompactGrid, color_key, sheet_grid
+from cell_parsers import (UNKNOWN_RANGE, normalize_course_name, parse_course_entry, parse_embedded_time_info,
+                          parse_time_range)
+from metrics import METRICS
+from timetable_clashes import find_clashes
+
+TIMETABLE_SHEETS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+NO_CLASSES_MESSAGE = "⚠️ No classes found for selected criteria"
+
 
 def extract_batch_colors(spreadsheet):
     """Extract batch-color mappings from spreadsheet"""
-    batch_colors = {}
-    timetable_sheets = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+    return grid_batch_colors(sheet_legend_grid(sheet) for sheet in spreadsheet.get('sheets', [])
+                             if sheet['properties']['title'] in TIMETABLE_SHEETS)
 
-    for sheet in spreadsheet.get('sheets', []):
-        sheet_name = sheet['properties']['title']
-        if sheet_name not in timetable_sheets:
-            continue
 
-        grid_data = sheet.get('data', [{}])[0].get('rowData', [])
+def sheet_legend_grid(sheet):
+    """CompactGrid holding at least the first 4 (legend) rows of a sheet"""
+    if 'grid' in sheet:
+        return sheet['grid']
+    # Only the legend rows are read, so don't compact the whole raw grid
+    return CompactGrid.from_rows(sheet.get('data', [{}])[0].get('rowData', [])[:4])
 
-        # Check first 4 rows (0-indexed)
-        for row_idx in range(4):
-            if row_idx >= len(grid_data):
-                continue
 
-            row_data = grid_data[row_idx].get('values', [])
-            for cell in row_data:
-                if 'formattedValue' in cell and 'BS' in cell['formattedValue']:
-                    # Get background color
-                    color = cell.get('effectiveFormat', {}).get('backgroundColor', {})
-                    # Convert color to hex string
-                    color_hex = f"{color.get('red', 0):.2f}{color.get('green', 0):.2f}{color.get('blue', 0):.2f}"
-                    batch_colors[color_hex] = cell['formattedValue'].strip()
+def grid_batch_colors(grids):
+    """Batch-color mappings from the legend rows of each day sheet grid"""
+    batch_colors = {}
+    for grid in grids:
+        # Check first 4 rows (0-indexed)
+        for row_idx in range(min(4, len(grid))):
+            for text, color in zip(grid.row_texts(row_idx), grid.row_colors(row_idx)):
+                if text is not None and 'BS' in text:
+                    # A legend cell without a format counts as the empty color
+                    key = color if color != NO_FORMAT else color_key({})
+                    batch_colors[key] = text.strip()
 
     return batch_colors
 
@@ -76,496 +91,618 @@ def clean_room_data(room_text):
     return room_text
 
 
-def normalize_course_name(name: str) -> str:
-    """Normalize course name for comparison: lower-case, remove punctuation and common suffixes like 'lab'."""
-    if not name:
-        return ""
-    s = name.lower().strip()
-    # Remove common enclosing punctuation
-    s = re.sub(r'[\(\)\[\]\.,;:\-]', ' ', s)
-    # Remove common lab/practical words
-    s = re.sub(r'\b(lab|lab session|practical|pract)\b', ' ', s)
-    # Collapse whitespace
-    s = re.sub(r'\s+', ' ', s).strip()
-    return s
-
+def entry_dedupe_key(room, session_type, course, section, batch):
+    """Hashable key under which two timetable entries count as duplicates.
 
-def is_similar_entry(existing_entry, new_entry) -> bool:
-    """Return True if two timetable entries are effectively duplicates.
-
-    Compares time, room, type, section and batch for equality and then compares
-    normalized course names to allow skipping rows like "Comp Net" vs "Comp Net Lab".
+    Room, type, section and batch must be equal and the course names equal after
+    normalize_course_name, so "Comp Net" and "Comp Net Lab" share a key. The time
+    slot is not part of the key.
     """
-    # existing_entry/new_entry: tuples (parse_time, time_slot, room, session_type, course, section, batch)
-    def unpack(e):
-        # Support multiple tuple shapes used in the code:
-        # - (rank, parsed_dt, time_slot, room, type, course)
-        # - (rank, parsed_dt, time_slot, room, type, course, section, batch)
-        # - (parsed_dt, time_slot, room, type, course, section, batch)
-        if not isinstance(e, (list, tuple)):
-            return None
-        if len(e) == 8:
-            _, _, _, room, type_, course, section, batch = e
-        elif len(e) == 6:
-            _, _, _, room, type_, course = e
-            section = ''
-            batch = ''
-        elif len(e) == 7:
-            _, _, room, type_, course, section, batch = e
-        else:
-            return None
-        return (room, type_, course, section, batch)
-
-    a = unpack(existing_entry)
-    b = unpack(new_entry)
-    if not a or not b:
-        return False
-
-    room_e, type_e, course_e, section_e, batch_e = a
-    room_n, type_n, course_n, section_n, batch_n = b
-
-    if room_e != room_n or type_e != type_n or section_e != section_n or batch_e != batch_n:
-        return False
-
-    # If normalized names are equal, treat as duplicate
-    if normalize_course_name(course_e) == normalize_course_name(course_n):
-        return True
+    return (room, session_type, section, batch, normalize_course_name(course))
 
-    return False
 
-
-def find_room_column(grid_data):
+def find_room_column(grid):
     """Find the column index that contains room information by looking for room-related headers"""
     room_keywords = ['room', 'rooms', 'room no', 'room number', 'location', 'venue']
-    
+
     # Search through the first few rows to find room headers
-    for row_idx in range(min(10, len(grid_data))):
-        row_values = grid_data[row_idx].get('values', [])
-        for col_idx, cell in enumerate(row_values):
-            if 'formattedValue' in cell:
-                cell_value = cell['formattedValue'].strip().lower()
+    for row_idx in range(min(10, len(grid))):
+        for col_idx, text in enumerate(grid.row_texts(row_idx)):
+            if text is not None:
+                cell_value = text.strip().lower()
                 if any(keyword in cell_value for keyword in room_keywords):
                     return col_idx
-    
+
     # If no room header found, try to find by pattern (looking for room-like values)
-    for row_idx in range(min(10, len(grid_data))):
-        row_values = grid_data[row_idx].get('values', [])
-        for col_idx, cell in enumerate(row_values):
-            if 'formattedValue' in cell:
-                cell_value = cell['formattedValue'].strip()
+    for row_idx in range(min(10, len(grid))):
+        for col_idx, text in enumerate(grid.row_texts(row_idx)):
+            if text is not None:
+                cell_value = text.strip()
                 # Look for patterns like "Room 101", "101", "Lab 1", etc.
-                if (cell_value and 
-                    (cell_value.isdigit() or 
-                     'room' in cell_value.lower() or 
+                if (cell_value and
+                    (cell_value.isdigit() or
+                     'room' in cell_value.lower() or
                      'lab' in cell_value.lower() or
                      any(char.isdigit() for char in cell_value))):
                     return col_idx
-    
-    # Default to first column if no room column found
+
     # Default to first column if no room column found
     return 0
 
 
-def build_time_col_rank(grid_data):
-    """Detect the time header row and return (time_row, col_rank).
+def build_time_col_rank(grid):
+    """Detect the time header row and return (time_row_index, col_rank).
 
     Strategy:
     - Search the first few rows for a row where the first column contains 'room' (case-insensitive).
       If found, that row holds the room header in col0 and time headers to its right (col_idx >= 1).
     - Otherwise, fallback to row index 4 (if exists) as the time header row and consider times starting at col 0.
     - Build a mapping col_idx -> rank (0-based) for columns that contain a non-empty formattedValue in the time row.
+
+    time_row_index is None when the grid has no such row.
     """
     time_row = None
     start_col = 0
-    for i in range(min(10, len(grid_data))):
-        row_values = grid_data[i].get('values', [])
-        if row_values and isinstance(row_values, list) and len(row_values) > 0:
-            first_cell = row_values[0]
-            if isinstance(first_cell, dict) and 'formattedValue' in first_cell:
-                if 'room' in first_cell['formattedValue'].strip().lower():
-                    time_row = grid_data[i]
-                    start_col = 1
-                    break
+    for i in range(min(10, len(grid))):
+        first_text = grid.text(i, 0)
+        if first_text is not None and 'room' in first_text.strip().lower():
+            time_row = i
+            start_col = 1
+            break
 
     if time_row is None:
-        time_row = grid_data[4] if len(grid_data) > 4 else None
+        time_row = 4 if len(grid) > 4 else None
         start_col = 0
 
     col_rank = {}
-    if time_row:
+    if time_row is not None:
         rank = 0
-        for col_idx, cell in enumerate(time_row.get('values', [])):
+        for col_idx, text in enumerate(grid.row_texts(time_row)):
             if col_idx < start_col:
                 continue
-            if isinstance(cell, dict) and 'formattedValue' in cell and cell['formattedValue'].strip():
+            if text is not None and text.strip():
                 col_rank[col_idx] = rank
                 rank += 1
 
     return time_row, col_rank
 
 
-def parse_time_slot(time_slot):
-    """Extracts the start time from a given time slot string and converts it to a sortable datetime object."""
-    if time_slot == "Unknown":
-        return datetime.max  # Place unknown times at the end
-
-    # Try to extract the first HH:MM token
-    try:
-        m = re.search(r"(\d{1,2}:\d{2})", str(time_slot))
-        if not m:
-            return datetime.max
-
-        first_time_str = m.group(1)
-
-        # Detect if AM/PM appears anywhere in the slot
-        ampm_match = re.search(r"\b(am|pm|AM|PM)\b", str(time_slot))
-        if ampm_match:
-            # If AM/PM is present, parse using 12-hour format
-            ampm = ampm_match.group(1).upper()
-            try:
-                return datetime.strptime(f"{first_time_str} {ampm}", "%I:%M %p")
-            except ValueError:
-                pass
-
-        # Otherwise, try 24-hour format first, then 12-hour without AM/PM
-        try:
-            return datetime.strptime(first_time_str, "%H:%M")
-        except ValueError:
-            try:
-                return datetime.strptime(first_time_str, "%I:%M")
-            except ValueError:
-                return datetime.max
-    except Exception:
-        return datetime.max
-
-
-def parse_embedded_time_info(course_entry):
-    """
-    Parse embedded time information from course entries like:
-    'Func Eng (SE) 09:00-10:45' or 'Islamic (SE) 11:00-12:45'
-    
-    Returns: (cleaned_course_name, time_slot, has_embedded_time)
+def column_time_slots(time_texts):
+    """(slot text, TimeRange) for each column of a class or lab time header row"""
+    slots = []
+    for text in time_texts:
+        time_slot = text if text is not None else 'Unknown'
+        slots.append((time_slot, parse_time_range(time_slot)))
+    return slots
+
+
+def read_room_column(row_texts, room_column):
+    """Return the raw text of the room column for a timetable row, or 'Unknown'"""
+    room = "Unknown"
+    if row_texts and len(row_texts) > room_column:
+        room_text = row_texts[room_column]
+        if room_text is not None:
+            room = room_text.strip()
+    return room
+
+
+def find_row_room(row_texts, room_column):
+    """Return the raw room text for a timetable row.
+
+    Uses the detected room column first, then falls back to any room-like cell and
+    finally to the first non-empty cell that doesn't look like a course or time.
     """
-    if not course_entry:
-        return course_entry, "Unknown", False
-    
-    # Look for time patterns in the course entry (HH:MM-HH:MM or HH:MM)
-    time_pattern = r'\b(\d{1,2}:\d{2}(?:-\d{1,2}:\d{2})?)\b'
-    time_match = re.search(time_pattern, course_entry)
-    
-    if time_match:
-        # Extract the time portion
-        time_slot = time_match.group(1)
-        
-        # Remove the time portion from the course name
-        cleaned_entry = re.sub(time_pattern, '', course_entry).strip()
-        
-        # Clean up any double spaces or trailing characters
-        cleaned_entry = re.sub(r'\s+', ' ', cleaned_entry).strip()
-        if cleaned_entry.endswith('-'):
-            cleaned_entry = cleaned_entry[:-1].strip()
-        
-        return cleaned_entry, time_slot, True
-    
-    return course_entry, "Unknown", False
+    # First try the detected room column
+    room = read_room_column(row_texts, room_column)
+
+    # If room is still unknown or empty, search for room info in other columns
+    if not room or room == "Unknown":
+        for col_idx, text in enumerate(row_texts):
+            if col_idx != room_column and text is not None:
+                cell_value = text.strip()
+                # Look for room-like patterns
+                if (cell_value and
+                    (cell_value.isdigit() or
+                     'room' in cell_value.lower() or
+                     'lab' in cell_value.lower() or
+                     'class' in cell_value.lower() or
+                     any(char.isdigit() for char in cell_value))):
+                    room = cell_value
+                    break
 
+    # If still no room found, try to extract from the first non-empty cell
+    if not room or room == "Unknown":
+        for text in row_texts:
+            if text is not None and text.strip():
+                potential_room = text.strip()
+                # Skip if it looks like a course name or time
+                if (not any(keyword in potential_room.lower() for keyword in ['am', 'pm', ':', '-']) and
+                    not any(keyword in potential_room.lower() for keyword in ['cs-', 'bs-', 'semester', 'batch'])):
+                    room = potential_room
+                    break
 
-def get_timetable(spreadsheet, user_batch, user_section):
-    """Generate timetable using color-based matching and return formatted output"""
-    batch_colors = extract_batch_colors(spreadsheet)
+    return room
 
-    # Find target color for user's batch
-    target_color = next((color for color, batch in batch_colors.items() if batch == user_batch), None)
 
-    if not target_color:
-        return f"⚠️ Batch '{user_batch}' not found!"
+def batch_section_patterns(user_batch, user_section):
+    """Build the substring patterns used to match a section inside a cell of the given batch"""
+    # Extract department from batch for pattern matching
+    dept_from_batch = ""
+    if user_batch:
+        if '-' in user_batch:
+            parts = user_batch.split('-')
+            if len(parts) >= 2:
+                dept_from_batch = parts[1]
 
-    timetable = {}
-    timetable_sheets = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+    return [
+        f"({dept_from_batch}-{user_section})" if dept_from_batch else f"({user_section})",  # Pattern like "(DEPT-E)"
+        f"-{user_section}",      # Pattern like "-E"
+        f"({user_section})",     # Pattern like "(E)"
+        f" {user_section} "      # Pattern like " E " (with spaces)
+    ]
 
-    for sheet in spreadsheet.get('sheets', []):
-        sheet_name = sheet['properties']['title']
-        if sheet_name not in timetable_sheets:
-            continue
 
-        grid_data = sheet.get('data', [{}])[0].get('rowData', [])
-        if len(grid_data) < 6:
-            continue
+def extract_year(batch):
+    """Return the year (e.g. '2024') embedded in a batch string, or None"""
+    m = re.search(r"(20\d{2})", str(batch))
+    return m.group(1) if m else None
+
+
+class Session(NamedTuple):
+    """A formatted timetable cell, normalized once when the snapshot is built"""
+    seq: int                 # position in sheet/row/column scan order
+    day: str
+    row: int
+    col: int
+    rank: int                # time column rank from build_time_col_rank
+    slot: str                # embedded time, else the class/lab header time for the column
+    start: int               # slot start in minutes after midnight (UNKNOWN_MINUTE if unreadable)
+    end: int                 # slot end in minutes after midnight
+    room: str                # room column, falling back to other room-like cells in the row
+    listed_room: str         # room column only
+    type: str                # "Class" or "Lab"
+    entry: str               # raw cell text
+    course: str              # cell text with any embedded time removed
+    has_embedded_time: bool
+    color: int               # color_key of the cell background
+    dept: str
+    name: str
+    section: str
+    batch: str               # '' when the cell color isn't a batch color
+
+
+def parse_day_sheet(sheet_name, grid, batch_colors, first_seq=0, colors=None):
+    """Sessions of one day sheet's CompactGrid in row/column order, numbered from first_seq.
+
+    Needs only the grid and the batch color map, so day sheets can be parsed
+    independently (and in worker processes, see TimetableSnapshot). colors, if
+    given, limits the sessions to cells of those color keys.
+    """
+    sessions = []
+    room_column = find_room_column(grid)
+    class_time_row, col_rank = build_time_col_rank(grid)
+
+    # Detect the correct lab row dynamically by searching for 'Lab' in first column
+    lab_time_row = None
+    for i in range(len(grid)):
+        first_cell_value = grid.text(i, 0)
+        if first_cell_value is not None and 'Lab' in first_cell_value:
+            lab_time_row = i
+            break
+
+    # Read and parse each header time once per column instead of once per cell
+    class_slots = column_time_slots(grid.row_texts(class_time_row)) if class_time_row is not None else []
+    lab_slots = column_time_slots(grid.row_texts(lab_time_row)) if lab_time_row is not None else class_slots
+
+    for row_idx in range(5, len(grid)):
+        # The 'Lab' timing row and everything below it are lab rows
+        is_lab = lab_time_row is not None and row_idx >= lab_time_row
+        column_slots = lab_slots if is_lab else class_slots
+
+        row_texts = grid.row_texts(row_idx)
+        row_colors = grid.row_colors(row_idx)
+        room = None
+        listed_room = None
+
+        for col_idx, class_entry in enumerate(row_texts):
+            cell_color = row_colors[col_idx]
+            if cell_color == NO_FORMAT or not class_entry or (colors is not None and cell_color not in colors):
+                continue
 
-        # Analyze sheet structure for debugging (uncomment for debugging)
-        # analyze_sheet_structure(grid_data, sheet_name)
+            if room is None:
+                room = clean_room_data(find_row_room(row_texts, room_column))
+                listed_room = clean_room_data(read_room_column(row_texts, room_column))
 
-        # Find the room column dynamically
-        room_column = find_room_column(grid_data)
+            cleaned_entry, embedded_time, has_embedded_time = parse_embedded_time_info(class_entry)
+            if has_embedded_time:
+                time_slot, time_range = embedded_time, parse_time_range(embedded_time)
+            elif col_idx < len(column_slots):
+                time_slot, time_range = column_slots[col_idx]
+            else:
+                time_slot, time_range = "Unknown", UNKNOWN_RANGE
+
+            batch = batch_colors.get(cell_color, "")
+            course_info = parse_course_entry(class_entry.strip(), batch) if batch else None
+
+            session = Session(
+                seq=first_seq + len(sessions),
+                day=sheet_name,
+                row=row_idx,
+                col=col_idx,
+                rank=col_rank.get(col_idx, 999),
+                slot=time_slot,
+                start=time_range.start,
+                end=time_range.end,
+                room=room,
+                listed_room=listed_room,
+                type="Lab" if is_lab else "Class",
+                entry=class_entry,
+                course=cleaned_entry,
+                has_embedded_time=has_embedded_time,
+                color=cell_color,
+                dept=course_info['department'] if course_info else "",
+                name=course_info['name'] if course_info else "",
+                section=course_info['section'] if course_info else "",
+                batch=batch,
+            )
+            sessions.append(session)
+
+    return sessions
+
+
+def parse_day_sheets_in_processes(days, day_grids, batch_colors, workers):
+    """parse_day_sheet for each day in a pool of worker processes, results in the order of days"""
+    with ProcessPoolExecutor(max_workers=min(workers, len(days))) as pool:
+        return list(pool.map(parse_day_sheet, days, day_grids, repeat(batch_colors)))
+
+
+class TimetableSnapshot:
+    """Parse-once, indexed view of a fetched spreadsheet: every formatted cell as a Session.
+
+    materialize renders every timetable up front, workers > 1 parses the day sheets in
+    worker processes (worth it on large grids only), only_batch parses one batch's cells.
+    """
 
-        # Extract class timings (Row 5) and build column rank mapping
-        class_time_row, col_rank = build_time_col_rank(grid_data)
+    def __init__(self, spreadsheet, materialize=False, workers=None, only_batch=None):
+        self.spreadsheet_id = spreadsheet.get('spreadsheetId', '')
+        self.days = []
+        self.sessions = []
+        self.by_color = {}
+        self.by_batch = {}
+        # color -> cell text -> sessions, used to route cells to course matchers
+        self.by_color_text = {}
+        self._section_index = {}
+        self._text_features = {}
+        self.rendered = None
+
+        # Compact each day sheet once; the legend rows of every day sheet give the batch colors
+        with METRICS.stage('compact') as counts:
+            grids = [(sheet['properties']['title'], sheet_grid(sheet)) for sheet in spreadsheet.get('sheets', [])
+                     if sheet['properties']['title'] in TIMETABLE_SHEETS]
+            counts['sheets'] = len(grids)
+            counts['cells'] = sum(len(grid.text_ids) for _, grid in grids)
+        with METRICS.stage('batch_colors') as counts:
+            self.batch_colors = grid_batch_colors(grid for _, grid in grids)
+            counts['cells'] = sum(grid.row_starts[min(len(grid), 4)] for _, grid in grids)
+            counts['batches'] = len(self.batch_colors)
+
+        # get_timetable matches on the first color found for a batch name
+        self.batch_color = {}
+        for color, batch in self.batch_colors.items():
+            self.batch_color.setdefault(batch, color)
+
+        day_grids = []
+        for sheet_name, grid in grids:
+            if len(grid) < 6:
+                continue
+            self.days.append(sheet_name)
+            day_grids.append(grid)
+
+        with METRICS.stage('parse') as counts:
+            if only_batch is not None:
+                colors = {self.batch_color[only_batch]} if only_batch in self.batch_color else set()
+                for sheet_name, grid in zip(self.days, day_grids):
+                    self._add_sessions(parse_day_sheet(sheet_name, grid, self.batch_colors, len(self.sessions),
+                                                       colors))
+            elif workers and workers > 1 and len(day_grids) > 1:
+                # Sessions come back per day in sheet order and are renumbered while indexing,
+                # so the result is identical to the serial path
+                for sessions in parse_day_sheets_in_processes(self.days, day_grids, self.batch_colors, workers):
+                    self._add_sessions(sessions)
+            else:
+                for sheet_name, grid in zip(self.days, day_grids):
+                    self._add_sessions(parse_day_sheet(sheet_name, grid, self.batch_colors, len(self.sessions)))
+            counts['sheets'] = len(day_grids)
+            counts['cells'] = sum(len(grid.text_ids) for grid in day_grids)
+            counts['sessions'] = len(self.sessions)
+
+        if materialize:
+            self.materialize()
+
+    @classmethod
+    def ensure(cls, spreadsheet, only_batch=None):
+        """Return spreadsheet unchanged if it is already a snapshot, otherwise build one.
+
+        Every function taking a spreadsheet accepts the raw Sheets API response or a
+        TimetableSnapshot built from it and goes through here. Pass a snapshot when making
+        many calls; a raw one is parsed per call, only as far as only_batch needs when given.
+        """
+        if isinstance(spreadsheet, cls):
+            return spreadsheet
+        return cls(spreadsheet, only_batch=only_batch)
+
+    def materialize(self):
+        """Render every batch/section timetable now so later get_timetable calls are lookups"""
+        if self.rendered is None:
+            # Rendering fills the section index for every batch and letter A-Z, so a
+            # materialized snapshot is never written to by later lookups
+            self.rendered = RenderedTimetables(self)
+        return self.rendered
+
+    def _add_sessions(self, sessions):
+        """Append parsed sessions and index them by color, cell text and batch"""
+        for session in sessions:
+            if session.seq != len(self.sessions):
+                session = session._replace(seq=len(self.sessions))
+            self.sessions.append(session)
+            self.by_color.setdefault(session.color, []).append(session)
+            self.by_color_text.setdefault(session.color, {}).setdefault(session.entry, []).append(session)
+            if session.batch:
+                self.by_batch.setdefault(session.batch, []).append(session)
+
+    def section_pairs(self):
+        """(batch, section letter) pairs with at least one session, sorted"""
+        if self.rendered is not None:
+            return list(self.rendered.tables)
+        return [(batch, section) for batch in sorted(self.batch_color) for section in ascii_uppercase
+                if self.section_sessions(batch, section)]
+
+    def batch_sessions(self, batch):
+        """Sessions drawn in the color get_timetable associates with batch"""
+        color = self.batch_color.get(batch)
+        if color is None:
+            return []
+        return self.by_color.get(color, [])
+
+    def section_sessions(self, batch, section):
+        """Sessions of batch whose cell text matches section, memoized per known batch and letter A-Z"""
+        key = (batch, section)
+        sessions = self._section_index.get(key)
+        if sessions is None:
+            patterns = batch_section_patterns(batch, section)
+            sessions = [s for s in self.batch_sessions(batch) if any(p in s.entry for p in patterns)]
+            # Sections come from free-text input, so only the keys section_pairs() fills are kept
+            if section in ascii_uppercase and len(section) == 1 and batch in self.batch_color:
+                self._section_index[key] = sessions
+        return sessions
+
+    def text_features(self, session):
+        """CellText features of a session's cell, computed once per distinct cell text"""
+        features = self._text_features.get(session.entry)
+        if features is None:
+            features = cell_text_features(session.entry, session.course, session.has_embedded_time)
+            self._text_features[session.entry] = features
+        return features
+
+
+class TimetableEntry(NamedTuple):
+    """One row of a batch or custom timetable"""
+    day: str
+    rank: int
+    start: int
+    end: int
+    slot: str
+    room: str
+    type: str
+    course: str
+    section: str
+    batch: str
+    seq: int        # Session.seq of the cell the entry was read from
+
+
+class RenderedTimetables:
+    """get_timetable output for every batch of a snapshot and every section letter A-Z.
+
+    Rendered in one pass when a snapshot loads. Only timetables with classes are
+    stored; other single-letter sections of a known batch get NO_CLASSES_MESSAGE.
+    seconds and memory_bytes record what the precompute cost.
+    """
 
-        # Detect the correct lab row dynamically by searching for 'Lab' in first column
-        lab_time_row_index = None
-        lab_time_row = None
+    SECTIONS = ascii_uppercase  # the letters TimetableSnapshot.section_pairs() covers
+
+    def __init__(self, snapshot):
+        start = time.perf_counter()
+        self.tables = {}
+        self.batches = set(snapshot.batch_color)
+        with METRICS.stage('render_all') as counts:
+            # Rendered directly so the precompute doesn't count as 'timetable' requests
+            for batch, section in snapshot.section_pairs():
+                self.tables[(batch, section)] = format_timetable(batch_timetable_entries(snapshot, batch, section))
+            self.memory_bytes = sys.getsizeof(self.tables) + sum(
+                sys.getsizeof(key) + sys.getsizeof(key[1]) + sys.getsizeof(text)
+                for key, text in self.tables.items())
+            counts.update(timetables=len(self.tables), batches=len(self.batches), memory_bytes=self.memory_bytes)
+        self.seconds = time.perf_counter() - start
+
+    def get(self, batch, section):
+        """The stored timetable, or None when the pair wasn't precomputed"""
+        text = self.tables.get((batch, section))
+        if text is not None:
+            return text
+        if batch in self.batches and section in self.SECTIONS and len(section) == 1:
+            return NO_CLASSES_MESSAGE
+        return None
+
+    def report(self):
+        """Size and cost of the precompute"""
+        return {
+            'batches': len(self.batches),
+            'timetables': len(self.tables),
+            'seconds': self.seconds,
+            'memory_bytes': self.memory_bytes,
+        }
+
+
+def batch_timetable_entries(spreadsheet, user_batch, user_section):
+    """TimetableEntry lists per day for a batch and section in display order, None if the batch is unknown"""
+    snapshot = TimetableSnapshot.ensure(spreadsheet, only_batch=user_batch)
 
-        # Search through all rows to find the one containing 'Lab' in the first column
-        for i in range(len(grid_data)):
-            row_values = grid_data[i].get('values', [])
-            if row_values:
-                first_cell_value = row_values[0].get('formattedValue', '').strip()
-                if 'Lab' in first_cell_value:
-                    lab_time_row_index = i
-                    lab_time_row = grid_data[i]
-                    break
+    # Find target color for user's batch
+    if user_batch not in snapshot.batch_color:
+        return None
 
-        # Process timetable rows (skip headers)
-        for row_idx, row in enumerate(grid_data[5:], start=6):
-            # Determine if this is a lab row based on whether we found a lab timing row
-            # and if the current row is after the lab timing row
-            is_lab = lab_time_row_index is not None and row_idx >= lab_time_row_index + 1
-
-            # Extract room number from the correct column
-            row_values = row.get('values', []) if isinstance(row, dict) else []
-            room = "Unknown"
-
-            # First try the detected room column
-            if row_values and len(row_values) > room_column:
-                room_cell = row_values[room_column]
-                if 'formattedValue' in room_cell:
-                    room = room_cell['formattedValue'].strip()
-
-            # If room is still unknown or empty, search for room info in other columns
-            if not room or room == "Unknown":
-                for col_idx, cell in enumerate(row_values):
-                    if col_idx != room_column and 'formattedValue' in cell:
-                        cell_value = cell['formattedValue'].strip()
-                        # Look for room-like patterns
-                        if (cell_value and
-                            (cell_value.isdigit() or
-                             'room' in cell_value.lower() or
-                             'lab' in cell_value.lower() or
-                             'class' in cell_value.lower() or
-                             any(char.isdigit() for char in cell_value))):
-                            room = cell_value
-                            break
-
-            # If still no room found, try to extract from the first non-empty cell
-            if not room or room == "Unknown":
-                for cell in row_values:
-                    if 'formattedValue' in cell and cell['formattedValue'].strip():
-                        potential_room = cell['formattedValue'].strip()
-                        # Skip if it looks like a course name or time
-                        if (not any(keyword in potential_room.lower() for keyword in ['am', 'pm', ':', '-']) and
-                            not any(keyword in potential_room.lower() for keyword in ['cs-', 'bs-', 'semester', 'batch'])):
-                            room = potential_room
-                            break
-
-            # Clean the room data
-            room = clean_room_data(room)
-
-            # Check all cells in row
-            for col_idx, cell in enumerate(row_values):
-                if not isinstance(cell, dict) or 'effectiveFormat' not in cell:
-                    continue
-
-                # Get cell color
-                color = cell.get('effectiveFormat', {}).get('backgroundColor', {})
-                cell_color = f"{color.get('red', 0):.2f}{color.get('green', 0):.2f}{color.get('blue', 0):.2f}"
-
-                if cell_color == target_color:
-                    class_entry = cell.get('formattedValue', '')
-                    # More strict section filtering - check for exact section matches
-                    section_match = False
-                    if class_entry:
-                        # Check for patterns like "(DEPT-E)", "-E", "(E)", etc.
-                        # Extract department from batch for pattern matching
-                        dept_from_batch = ""
-                        if user_batch:
-                            if '-' in user_batch:
-                                parts = user_batch.split('-')
-                                if len(parts) >= 2:
-                                    dept_from_batch = parts[1]
-                        
-                        section_patterns = [
-                            f"({dept_from_batch}-{user_section})" if dept_from_batch else f"({user_section})",  # Pattern like "(DEPT-E)"
-                            f"-{user_section}",      # Pattern like "-E"
-                            f"({user_section})",     # Pattern like "(E)"
-                            f" {user_section} "      # Pattern like " E " (with spaces)
-                        ]
-                        section_match = any(pattern in class_entry for pattern in section_patterns)
-
-                    if class_entry and section_match:
-                        # First, try to parse embedded time information from the course entry itself
-                        cleaned_entry, embedded_time, has_embedded_time = parse_embedded_time_info(class_entry)
-                        
-                        if has_embedded_time:
-                            # Use the embedded time from the course entry
-                            time_slot = embedded_time
-                            # Clean the course name further by removing section patterns
-                            clean_entry = cleaned_entry
-                            for pattern in section_patterns:
-                                clean_entry = clean_entry.replace(pattern, '').strip()
-                            clean_entry = clean_entry.replace('()', '').strip()
-                            if clean_entry.endswith('-'):
-                                clean_entry = clean_entry[:-1].strip()
-                        else:
-                            # Fall back to the original logic for non-embedded time entries
-                            clean_entry = class_entry
-                            # Remove section patterns from the course name
-                            for pattern in section_patterns:
-                                clean_entry = clean_entry.replace(pattern, '').strip()
-                            # Also remove any remaining parentheses and clean up
-                            clean_entry = clean_entry.replace('()', '').strip()
-                            if clean_entry.endswith('-'):
-                                clean_entry = clean_entry[:-1].strip()
-
-                            # Extract time slot from header row
-                            time_row_for_slot = lab_time_row if (is_lab and lab_time_row is not None) else class_time_row
-                            time_slot = "Unknown"
-                            if time_row_for_slot:
-                                time_values = time_row_for_slot.get('values', [])
-                                if len(time_values) > col_idx:
-                                    time_slot = time_values[col_idx].get('formattedValue', 'Unknown')
-                        
-                        rank = col_rank.get(col_idx, 999)
-
-                        # Store in dictionary (group by day)
-                        if sheet_name not in timetable:
-                            timetable[sheet_name] = []
-
-                        # Entry includes (rank, parsed_time, time_slot, room, type, course)
-                        timetable[sheet_name].append((rank, parse_time_slot(time_slot), time_slot, room, "Lab" if is_lab else "Class", clean_entry))
+    section_patterns = batch_section_patterns(user_batch, user_section)
+    timetable = {}
 
-    # Format output as a Markdown table
+    for session in snapshot.section_sessions(user_batch, user_section):
+        # Clean the course name by removing section patterns
+        clean_entry = session.course if session.has_embedded_time else session.entry
+        for pattern in section_patterns:
+            clean_entry = clean_entry.replace(pattern, '').strip()
+        # Also remove any remaining parentheses and clean up
+        clean_entry = clean_entry.replace('()', '').strip()
+        if clean_entry.endswith('-'):
+            clean_entry = clean_entry[:-1].strip()
+
+        # Store in dictionary (group by day)
+        if session.day not in timetable:
+            timetable[session.day] = []
+
+        timetable[session.day].append(TimetableEntry(
+            day=session.day,
+            rank=session.rank,
+            start=session.start,
+            end=session.end,
+            slot=session.slot,
+            room=session.room,
+            type=session.type,
+            course=clean_entry,
+            section=user_section,
+            batch=user_batch,
+            seq=session.seq,
+        ))
+
+    # Sort sessions by column rank then extracted start time
+    for entries in timetable.values():
+        entries.sort(key=lambda e: (e.rank, e.start))
+    return timetable
+
+
+def get_timetable(spreadsheet, user_batch, user_section):
+    """Generate timetable using color-based matching and return formatted output"""
+    with METRICS.stage('timetable') as counts:
+        snapshot = TimetableSnapshot.ensure(spreadsheet, only_batch=user_batch)
+        if snapshot.rendered is not None:
+            rendered = snapshot.rendered.get(user_batch, user_section)
+            if rendered is not None:
+                counts['rendered_hits'] = 1
+                return rendered
+            counts['rendered_misses'] = 1
+
+        timetable = batch_timetable_entries(snapshot, user_batch, user_section)
+        if timetable is None:
+            return f"⚠️ Batch '{user_batch}' not found!"
+        counts['sessions'] = sum(len(entries) for entries in timetable.values())
+        return format_timetable(timetable)
+
+
+def format_timetable(timetable):
+    """Markdown tables of a batch_timetable_entries result, one per day"""
     output = []
     for day, sessions in timetable.items():
         output.append(f"### 📌 {day}\n")
         output.append("| Time | Room | Type | Course |")
         output.append("|------|------|------|--------|")
-
-        # Sort sessions by column rank then extracted start time before displaying
-        for _, _, time_slot, room, session_type, course in sorted(sessions, key=lambda x: (x[0], x[1])):
-            output.append(f"| {time_slot} | {room} | {session_type} | {course} |")
+        for entry in sessions:
+            output.append(f"| {entry.slot} | {entry.room} | {entry.type} | {entry.course} |")
         output.append("\n")
 
-    return "\n".join(output) if output else "⚠️ No classes found for selected criteria"
+    return "\n".join(output) if output else NO_CLASSES_MESSAGE
 
 
-def get_custom_timetable(spreadsheet, selected_courses):
-    """Generate timetable for custom selected courses"""
-    if not selected_courses:
-        return "⚠️ No courses selected. Please select courses first."
-    
-    timetable = {}
-    timetable_sheets = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
-    
-    # Create a set of course identifiers for faster lookup
-    selected_course_ids = set()
-    for course in selected_courses:
-        course_id = f"{course['name']}_{course['department']}_{course['section']}_{course['batch']}"
-        selected_course_ids.add(course_id)
-    
-    # Precompute batch color mapping so we can validate the batch for each cell
-    batch_colors = extract_batch_colors(spreadsheet)
+def custom_timetable_entries(spreadsheet, selected_courses):
+    """Matched, de-duplicated TimetableEntry lists per day in display order"""
+    started = time.perf_counter()
+    snapshot = TimetableSnapshot.ensure(spreadsheet)
 
-    for sheet in spreadsheet.get('sheets', []):
-        sheet_name = sheet['properties']['title']
-        if sheet_name not in timetable_sheets:
-            continue
+    # Compile every selected course once, route cells to it by color and distinct cell
+    # text, then restore grid order so duplicate suppression and day order match a full scan
+    matches = []
+    for course_idx, selected_course in enumerate(selected_courses):
+        matcher = CourseMatcher(selected_course, snapshot.batch_colors)
+        for session in matcher.matching_sessions(snapshot):
+            matches.append((session.seq, course_idx, session, selected_course))
+    matches.sort(key=lambda m: (m[0], m[1]))
 
-        grid_data = sheet.get('data', [{}])[0].get('rowData', [])
-        if len(grid_data) < 6:
+    timetable = {}
+    seen_keys = {}
+    for _, _, session, selected_course in matches:
+        # Embedded time entries keep their cleaned cell text, others use the selected course name
+        course_name = session.course if session.has_embedded_time else selected_course['name']
+
+        # Avoid adding exact or near-duplicate entries (same room, type, section, batch
+        # and similar course name like "Comp Net" vs "Comp Net Lab") with one set lookup
+        key = entry_dedupe_key(session.listed_room, session.type, course_name,
+                               selected_course['section'], selected_course['batch'])
+        day_keys = seen_keys.setdefault(session.day, set())
+        if key in day_keys:
             continue
+        day_keys.add(key)
+
+        entry = TimetableEntry(
+            day=session.day,
+            rank=session.rank,
+            start=session.start,
+            end=session.end,
+            slot=session.slot,
+            room=session.listed_room,
+            type=session.type,
+            course=course_name,
+            section=selected_course['section'],
+            batch=selected_course['batch'],
+            seq=session.seq,
+        )
+
+        # Store in dictionary (group by day)
+        if session.day not in timetable:
+            timetable[session.day] = []
+        timetable[session.day].append(entry)
+
+    # Sort sessions by column rank then extracted start time
+    for day, entries in timetable.items():
+        entries.sort(key=lambda e: (e.rank, e.start))
+    METRICS.record('custom_match', time.perf_counter() - started, {
+        'courses': len(selected_courses),
+        'sessions_matched': len(matches),
+        'entries': sum(len(entries) for entries in timetable.values()),
+    })
+    return timetable
+
+
+def get_custom_timetable_clashes(spreadsheet, selected_courses):
+    """Overlapping pairs of entries in the custom timetable of selected_courses.
+
+    Returns a list of timetable_clashes.Clash(day, first, second) holding
+    TimetableEntry values. Pass a TimetableSnapshot when checking many selections.
+    """
+    if not selected_courses:
+        return []
+    return find_clashes(custom_timetable_entries(spreadsheet, selected_courses))
 
-        # Find the room column dynamically
-        room_column = find_room_column(grid_data)
-
-        # Extract class timings (Row 5) and build column rank mapping
-        class_time_row, col_rank = build_time_col_rank(grid_data)
-
-        # Detect the correct lab row dynamically
-        lab_time_row_index = None
-        lab_time_row = None
-        
-        for i in range(len(grid_data)):
-            row_values = grid_data[i].get('values', [])
-            if row_values:
-                first_cell_value = row_values[0].get('formattedValue', '').strip()
-                if 'Lab' in first_cell_value:
-                    lab_time_row_index = i
-                    lab_time_row = grid_data[i]
-                    break
 
-        # Process timetable rows (skip headers)
-        for row_idx, row in enumerate(grid_data[5:], start=6):
-            is_lab = lab_time_row_index is not None and row_idx >= lab_time_row_index + 1
-
-            # Extract room number
-            row_values = row.get('values', []) if isinstance(row, dict) else []
-            room = "Unknown"
-            
-            if row_values and len(row_values) > room_column:
-                room_cell = row_values[room_column]
-                if 'formattedValue' in room_cell:
-                    room = room_cell['formattedValue'].strip()
-            
-            # Clean the room data
-            room = clean_room_data(room)
-
-            # Check all cells in row
-            for col_idx, cell in enumerate(row_values):
-                if not isinstance(cell, dict) or 'effectiveFormat' not in cell:
-                    continue
-
-                # Get cell color
-                color = cell.get('effectiveFormat', {}).get('backgroundColor', {})
-                cell_color = f"{color.get('red', 0):.2f}{color.get('green', 0):.2f}{color.get('blue', 0):.2f}"
-
-                class_entry = cell.get('formattedValue', '')
-                if class_entry:
-                    # Try to match this course with selected courses
-                    for selected_course in selected_courses:
-                        # Check if this cell matches the selected course (including batch validation)
-                        if matches_selected_course(class_entry, selected_course, cell_color, batch_colors):
-                            # First, try to parse embedded time information from the course entry itself
-                            cleaned_entry, embedded_time, has_embedded_time = parse_embedded_time_info(class_entry)
-                            
-                            if has_embedded_time:
-                                # Use the embedded time from the course entry
-                                time_slot = embedded_time
-                                course_name = cleaned_entry
-                            else:
-                                # Fall back to extracting time from header row
-                                time_row = lab_time_row if (is_lab and lab_time_row is not None) else class_time_row
-                                time_slot = "Unknown"
-                                if time_row:
-                                    time_values = time_row.get('values', [])
-                                    if len(time_values) > col_idx:
-                                        time_slot = time_values[col_idx].get('formattedValue', 'Unknown')
-                                course_name = selected_course['name']
-
-                            # Store in dictionary (group by day)
-                            if sheet_name not in timetable:
-                                timetable[sheet_name] = []
-
-                            rank = col_rank.get(col_idx, 999)
-                            entry = (
-                                rank,
-                                parse_time_slot(time_slot),
-                                time_slot,
-                                room,
-                                "Lab" if is_lab else "Class",
-                                course_name,  # Use the cleaned course name (either from embedded parsing or selected course)
-                                selected_course['section'],
-                                selected_course['batch']
-                            )
-
-                            # Avoid adding exact or near-duplicate entries (same time, room, type, section, batch
-                            # and similar course name like "Comp Net" vs "Comp Net Lab")
-                            already = False
-                            for existing in timetable[sheet_name]:
-                                if is_similar_entry(existing, entry):
-                                    already = True
-                                    break
-                            if not already:
-                                timetable[sheet_name].append(entry)
+def format_clash_entry(entry):
+    """Short description of a TimetableEntry for the clash list"""
+    details = ", ".join(part for part in (entry.section, extract_year(entry.batch) or str(entry.batch)) if part)
+    return f"{entry.course} ({details}) {entry.slot} in {entry.room}" if details else f"{entry.course} {entry.slot} in {entry.room}"
+
+
+def get_custom_timetable(spreadsheet, selected_courses):
+    """Generate timetable for custom selected courses, listing overlapping sessions after the day tables"""
+    if not selected_courses:
+        return "⚠️ No courses selected. Please select courses first."
+
+    timetable = custom_timetable_entries(spreadsheet, selected_courses)
+    started = time.perf_counter()
 
     # Format output as a Markdown table
     output = []
@@ -574,163 +711,196 @@ def get_custom_timetable(spreadsheet, selected_courses):
         output.append("| Time | Room | Type | Course | Section | Batch |")
         output.append("|------|------|------|--------|---------|-------|")
 
-        # Sort sessions by column rank then extracted start time before displaying
-        for _, _, time_slot, room, session_type, course, section, batch in sorted(sessions, key=lambda x: (x[0], x[1])):
+        for entry in sessions:
             # Extract year from batch for compact display
-            import re
-            m = re.search(r"(20\d{2})", str(batch))
-            display_batch = m.group(1) if m else str(batch)
-            output.append(f"| {time_slot} | {room} | {session_type} | {course} | {section} | {display_batch} |")
+            display_batch = extract_year(entry.batch) or str(entry.batch)
+            output.append(f"| {entry.slot} | {entry.room} | {entry.type} | {entry.course} | "
+                          f"{entry.section} | {display_batch} |")
         output.append("\n")
 
+    clashes = find_clashes(timetable)
+    if clashes:
+        output.append(f"### ⚠️ Time clashes ({len(clashes)})\n")
+        for clash in clashes:
+            output.append(f"- **{clash.day}**: {format_clash_entry(clash.first)} overlaps "
+                          f"{format_clash_entry(clash.second)}")
+        output.append("\n")
+
+    METRICS.record('custom_render', time.perf_counter() - started, {'clashes': len(clashes)})
     return "\n".join(output) if output else "⚠️ No classes found for selected courses"
 
-def matches_selected_course(class_entry, selected_course, cell_color, batch_colors):
-    """Check if a class entry matches a selected course"""
-    # Parse embedded time info if present to get clean course name for matching
-    cleaned_entry, _, has_embedded_time = parse_embedded_time_info(class_entry)
-    
+GROUP_PATTERN = re.compile(r'\([A-Z]{2,4}(?:-[A-Z])?,\s*G-\d+\)')
+DEPT_SECTION_PATTERN = re.compile(r"\b([A-Z]{2,4})-[A-Z]\b")
+PAREN_DEPT_SECTION_PATTERN = re.compile(r"\(\s*([A-Z]{2,4})\s*-\s*[A-Z]\s*\)")
+GROUP_NUMBER_PATTERN = re.compile(r'G-(\d+)')
+
+
+def extract_dept_from_batch(batch_str: str) -> str:
+    """Extract department token from batch strings like 'BS-CS-1' or 'BS CS (2023)'."""
+    if not batch_str:
+        return ""
+    # Handle dash-separated e.g., BS-CS-1
+    if '-' in batch_str:
+        parts = batch_str.split('-')
+        if len(parts) >= 2:
+            return parts[1]
+    # Otherwise look for 2-4 uppercase tokens
+    tokens = re.findall(r"\b[A-Z]{2,4}\b", batch_str)
+    for t in tokens:
+        if t != 'BS':
+            return t
+    return ""
+
+
+class CellText(NamedTuple):
+    """What course matching needs to know about a cell's text, independent of the course"""
+    text: str                # raw cell text
+    text_lower: str
+    match_lower: str         # lower-cased text with any embedded time removed
+    has_group: bool          # contains a group pattern like "(CS-A,G-1)"
+    base_lower: str          # lower-cased text before the first '('
+    dept_in_entry: str       # department of a "DS-B" / "(DS-B)" token, or ''
+
+
+def cell_text_features(class_entry, cleaned_entry=None, has_embedded_time=None):
+    """Compute the CellText for a cell; pass the parse_embedded_time_info result if known"""
+    if has_embedded_time is None:
+        cleaned_entry, _, has_embedded_time = parse_embedded_time_info(class_entry)
+
     # Use cleaned entry for matching if it has embedded time, otherwise use original
     entry_to_match = cleaned_entry if has_embedded_time else class_entry
-    
-    # Extract base course name for matching (handle group patterns like "(CS, G-1)")
-    selected_course_name = selected_course['name']
-    
-    # Check if this is a group course (contains patterns like "(CS,G-1)" - normalized format)
-    import re
-    group_pattern = r'\([A-Z]{2,4}(?:-[A-Z])?,\s*G-\d+\)'
-    entry_has_group = re.search(group_pattern, entry_to_match)
-    selected_has_group = re.search(group_pattern, selected_course_name)
-    
-    # For group courses, we need special matching logic
-    if entry_has_group or selected_has_group:
-        # Both should have group patterns for a match
-        if entry_has_group and selected_has_group:
-            # Extract base course names (everything before the parentheses)
-            selected_base = selected_course_name.split('(')[0].strip()
-            entry_base = entry_to_match.split('(')[0].strip()
-            
-            # Check if base course names match
-            if selected_base.lower() != entry_base.lower():
-                return False
-        else:
-            # If only one has group pattern, no match
-            return False
-    else:
-        # For non-group courses, check if the course name is in the entry
-        if selected_course_name.lower() not in entry_to_match.lower():
-            return False
-    
-    # If the selected course doesn't contain "Lab" but the class entry does, reject it
-    # This prevents fetching lab sessions when only the main course is selected
-    if 'lab' not in selected_course_name.lower() and 'lab' in entry_to_match.lower():
-        return False
-    
-    # Check if the section matches
-    department = selected_course.get('department', '')
-    section = selected_course.get('section', '')
-    
-    # Build section patterns
-    section_patterns = [
-        f"({department}-{section})" if department else f"({section})",
-        f"-{section}",
-        f"({section})",
-        f" {section} "
-    ]
-    
-    # For group courses, we need precise section matching since the format is standardized
-    if entry_has_group or selected_has_group:
-        # For group courses, check for the specific format in the original cell entry
-        # The actual timetable format is like "Gen AI (CS-A,G-1)"
-        if department and section:
-            # Extract the group number from the selected course
-            group_match = re.search(r'G-(\d+)', selected_course_name)
+
+    m_dept = DEPT_SECTION_PATTERN.search(class_entry) or PAREN_DEPT_SECTION_PATTERN.search(class_entry)
+    return CellText(
+        text=class_entry,
+        text_lower=class_entry.lower(),
+        match_lower=entry_to_match.lower(),
+        has_group=GROUP_PATTERN.search(entry_to_match) is not None,
+        base_lower=entry_to_match.split('(')[0].strip().lower(),
+        dept_in_entry=m_dept.group(1) if m_dept else "",
+    )
+
+
+# Color verdicts of a CourseMatcher
+REJECT, ACCEPT, NEEDS_DEPT_IN_ENTRY = 0, 1, 2
+
+
+class CourseMatcher:
+    """A selected course compiled once for matching against many cells.
+
+    Everything that depends on the course alone (lower-cased name, group base name,
+    section patterns, the group section regex, department and year) is computed up
+    front, and the batch/department check is reduced to one verdict per cell color.
+    Cells are routed by color first and then by distinct cell text, so cells of other
+    batches are never looked at.
+
+    There is no index by course name: a course matches any cell whose text contains
+    its name ("DB" matches "Adv DB Lab (CS-A)"), which a key lookup can't express
+    without changing which cells match.
+    """
+
+    def __init__(self, selected_course, batch_colors=None):
+        self.course = selected_course
+        self.batch_colors = batch_colors or {}
+        name = selected_course['name']
+        self.name_lower = name.lower()
+        self.has_group = GROUP_PATTERN.search(name) is not None
+        self.base_lower = name.split('(')[0].strip().lower()
+        self.wants_lab = 'lab' in self.name_lower
+
+        self.department = selected_course.get('department', '')
+        self.department_lower = self.department.lower()
+        self.batch = selected_course.get('batch', '')
+        self.year = extract_year(self.batch)
+        section = selected_course.get('section', '')
+
+        # Build section patterns
+        self.section_patterns = [
+            f"({self.department}-{section})" if self.department else f"({section})",
+            f"-{section}",
+            f"({section})",
+            f" {section} "
+        ]
+
+        # Group courses need the precise "(CS-A,G-1)" form with the selected group number
+        self.group_section_re = None
+        if self.has_group and self.department and section:
+            group_match = GROUP_NUMBER_PATTERN.search(name)
             if group_match:
-                group_number = group_match.group(1)
-                group_section_pattern = rf"\({department}-{section},\s*G-{group_number}\)"
-                section_match = re.search(group_section_pattern, class_entry) is not None
-            else:
-                section_match = False
-        else:
-            section_match = False
-    else:
-        # Use the original class_entry for section matching since patterns might include time info
-        section_match = any(pattern in class_entry for pattern in section_patterns)
-    
-    if not section_match:
-        return False
-
-    # If the class entry explicitly mentions a department token like 'DS-B' or '(DS-B)',
-    # extract that department and reject if it doesn't match the selected department.
-    dept_in_entry = None
-    m_dept = re.search(r"\b([A-Z]{2,4})-[A-Z]\b", class_entry)
-    if m_dept:
-        dept_in_entry = m_dept.group(1)
-    else:
-        m_paren = re.search(r"\(\s*([A-Z]{2,4})\s*-\s*[A-Z]\s*\)", class_entry)
-        if m_paren:
-            dept_in_entry = m_paren.group(1)
-
-    if dept_in_entry and selected_course.get('department'):
-        if dept_in_entry != selected_course.get('department'):
-            return False
+                self.group_section_re = re.compile(
+                    rf"\({re.escape(self.department)}-{re.escape(section)},\s*G-{group_match.group(1)}\)")
 
-    # Validate batch and department: map cell_color to a batch string (if available)
-    # and ensure it corresponds to the selected course's batch (exact match).
-    # If exact batch doesn't match, allow same-year only if department also matches.
-    batch_from_color = batch_colors.get(cell_color, "") if batch_colors else ""
-    selected_batch = selected_course.get('batch', '')
-    selected_dept = selected_course.get('department', '')
-
-    def extract_dept_from_batch(batch_str: str) -> str:
-        """Extract department token from batch strings like 'BS-CS-1' or 'BS CS (2023)'."""
-        if not batch_str:
-            return ""
-        # Handle dash-separated e.g., BS-CS-1
-        if '-' in batch_str:
-            parts = batch_str.split('-')
-            if len(parts) >= 2:
-                return parts[1]
-        # Otherwise look for 2-4 uppercase tokens
-        tokens = re.findall(r"\b[A-Z]{2,4}\b", batch_str)
-        for t in tokens:
-            if t != 'BS':
-                return t
-        return ""
+        self._color_verdicts = {}
+
+    def color_verdict(self, cell_color):
+        """Whether a cell of this color can belong to the course's batch"""
+        verdict = self._color_verdicts.get(cell_color)
+        if verdict is None:
+            verdict = self._compute_color_verdict(self.batch_colors.get(cell_color, ""))
+            self._color_verdicts[cell_color] = verdict
+        return verdict
+
+    def _compute_color_verdict(self, batch_from_color):
+        # Without batch info for the color, require the department in the cell text
+        if not batch_from_color:
+            return NEEDS_DEPT_IN_ENTRY
 
-    # If we have a batch/color mapping, use it to validate department and batch
-    if batch_from_color:
         dept_from_color = extract_dept_from_batch(batch_from_color)
         # If department is known from color and doesn't match selected, reject
-        if dept_from_color and selected_dept and dept_from_color != selected_dept:
-            return False
+        if dept_from_color and self.department and dept_from_color != self.department:
+            return REJECT
 
         # If exact batch matches, accept
-        if selected_batch and batch_from_color == selected_batch:
-            return True
+        if self.batch and batch_from_color == self.batch:
+            return ACCEPT
 
         # Fallback: allow same-year matching only if department matches (or not provided)
-        y1 = re.search(r"(20\d{2})", batch_from_color)
-        y2 = re.search(r"(20\d{2})", selected_batch)
-        if y1 and y2 and y1.group(1) == y2.group(1):
-            # ensure department alignment if we can
-            if dept_from_color:
-                if selected_dept and dept_from_color != selected_dept:
-                    return False
-                return True
-            else:
-                # No dept info from color; require department token to be present in class entry
-                if selected_dept and selected_dept.lower() not in class_entry.lower():
-                    return False
-                return True
+        year_from_color = extract_year(batch_from_color)
+        if year_from_color and self.year and year_from_color == self.year:
+            return ACCEPT if dept_from_color else NEEDS_DEPT_IN_ENTRY
 
-        return False
+        return REJECT
 
-    # If no batch/color info is available for the cell, require department to appear in the cell entry
-    # to avoid cross-batch matches. This is a conservative fallback.
-    if selected_dept:
-        if selected_dept.lower() not in class_entry.lower():
+    def matches_text(self, cell, verdict=ACCEPT):
+        """Check a CellText against the course, given the color verdict of its cell"""
+        if verdict == REJECT:
+            return False
+
+        # Group courses must both be groups with the same base name, others match by substring
+        if cell.has_group or self.has_group:
+            if not (cell.has_group and self.has_group) or self.base_lower != cell.base_lower:
+                return False
+        elif self.name_lower not in cell.match_lower:
             return False
 
-    # If department can't be validated, fall back to name+section match (already checked)
-    return True
+        # If the selected course doesn't contain "Lab" but the class entry does, reject it
+        if not self.wants_lab and 'lab' in cell.match_lower:
+            return False
+
+        # Check if the section matches, on the original text since patterns might include time info
+        if self.has_group:
+            if self.group_section_re is None or not self.group_section_re.search(cell.text):
+                return False
+        elif not any(pattern in cell.text for pattern in self.section_patterns):
+            return False
+
+        # Reject cells that explicitly name another department like 'DS-B' or '(DS-B)'
+        if cell.dept_in_entry and self.department and cell.dept_in_entry != self.department:
+            return False
+
+        if verdict == NEEDS_DEPT_IN_ENTRY and self.department_lower not in cell.text_lower:
+            return False
+
+        return True
+
+    def matching_sessions(self, snapshot):
+        """Sessions of a TimetableSnapshot that match the course, in no particular order"""
+        matched = []
+        for cell_color, texts in snapshot.by_color_text.items():
+            verdict = self.color_verdict(cell_color)
+            if verdict == REJECT:
+                continue
+            for sessions in texts.values():
+                if self.matches_text(snapshot.text_features(sessions[0]), verdict):
+                    matched.extend(sessions)
+        return matched
@@ -0,0 +1,333 @@
+"""Pluggable spreadsheet fetch backends: live, recording and replaying.
+
+A backend turns a spreadsheet ID into the spreadsheet dict the parser reads
+(day sheets with compact grids) and, optionally, a revision token. fetch and
+revision plug straight into RevisionCache as its fetch and probe callables.
+
+    LiveBackend       the Sheets API over a service account (stream, masked, full or gspread)
+    RecordingBackend  wraps another backend and saves each raw response to a directory
+    ReplayBackend     serves recorded responses offline with injected latency, jitter,
+                      bandwidth limits and error rates
+
+Record once with credentials, then benchmark or load test anywhere:
+
+    python fetch_backends.py record --sheet-url URL --credentials key.json --out recordings
+    python fetch_backends.py replay recordings --latency 0.8 --jitter 0.3 --error-rate 0.05 --fetches 20
+"""
+from abc import ABC, abstractmethod
+import argparse
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from compact_grid import compact_spreadsheet
+from extract_timetable import TIMETABLE_SHEETS
+from grid_stream import read_spreadsheet_stream
+from sheet_cache import atomic_write
+
+LIVE_MODES = ("stream", "masked", "full", "gspread")
+REPLAY_CHUNK_SIZE = 64 * 1024
+
+
+class FetchError(Exception):
+    """A failed fetch; ReplayBackend raises it for injected errors"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class FetchBackend(ABC):
+    """Source of spreadsheet responses.
+
+    Subclasses implement response_chunks() (the raw Sheets API JSON as byte chunks)
+    and may override fetch() when they can produce the spreadsheet more directly,
+    and revision() when they can tell versions apart.
+    """
+
+    @abstractmethod
+    def response_chunks(self, spreadsheet_id: str) -> Iterator[bytes]:
+        """The raw Sheets API response as UTF-8 byte chunks"""
+
+    def fetch(self, spreadsheet_id: str) -> Dict:
+        """The spreadsheet with a CompactGrid per day sheet"""
+        return read_spreadsheet_stream(self.response_chunks(spreadsheet_id))
+
+    def revision(self, spreadsheet_id: str) -> Optional[str]:
+        """Revision token of the spreadsheet, None when unknown"""
+        return None
+
+
+class LiveBackend(FetchBackend):
+    """The Google APIs with a service account.
+
+    mode "stream" decodes the masked response while it downloads; "masked" and
+    "full" go through the API client library; "gspread" requests the masked
+    response through gspread. Revisions come from the Drive file version.
+    The Google libraries are only imported here, so offline backends don't need them.
+    """
+
+    def __init__(self, credentials_info: Dict, mode: str = "stream"):
+        if mode not in LIVE_MODES:
+            raise ValueError(f"Unknown fetch mode '{mode}', expected one of {LIVE_MODES}")
+        from sheets_client import DriveRevisionProbe, StreamingSpreadsheetFetch, build_sheets_service
+
+        self.mode = mode
+        self.credentials_info = credentials_info
+        self.probe = DriveRevisionProbe(credentials_info)
+        self.streaming = StreamingSpreadsheetFetch(credentials_info) if mode == "stream" else None
+        self.service = build_sheets_service(credentials_info) if mode in ("masked", "full") else None
+        self.gspread = None
+        if mode == "gspread":
+            from google_sheets import gspread_client
+            self.gspread = gspread_client(credentials_info)
+
+    def response_chunks(self, spreadsheet_id: str) -> Iterator[bytes]:
+        if self.streaming is not None:
+            return self.streaming.response_chunks(spreadsheet_id)
+        return iter([json.dumps(self._fetch_json(spreadsheet_id), ensure_ascii=False).encode('utf-8')])
+
+    def fetch(self, spreadsheet_id: str) -> Dict:
+        if self.streaming is not None:
+            return self.streaming(spreadsheet_id)
+        # The client libraries hand back the decoded tree; compact it right away
+        return compact_spreadsheet(self._fetch_json(spreadsheet_id), TIMETABLE_SHEETS)
+
+    def _fetch_json(self, spreadsheet_id: str) -> Dict:
+        from sheets_client import TIMETABLE_FIELDS, day_sheet_ranges, fetch_spreadsheet
+
+        if self.gspread is None:
+            return fetch_spreadsheet(self.service, spreadsheet_id, mode=self.mode)
+        sheet = self.gspread.open_by_key(spreadsheet_id)
+        ranges = day_sheet_ranges([worksheet.title for worksheet in sheet.worksheets()])
+        if not ranges:
+            return {'spreadsheetId': spreadsheet_id, 'sheets': []}
+        return sheet.fetch_sheet_metadata(params={'ranges': ranges, 'fields': TIMETABLE_FIELDS})
+
+    def revision(self, spreadsheet_id: str) -> Optional[str]:
+        return self.probe(spreadsheet_id)
+
+
+def recording_path(directory: str, spreadsheet_id: str) -> str:
+    return os.path.join(directory, f"{spreadsheet_id}.json")
+
+
+def recording_meta_path(directory: str, spreadsheet_id: str) -> str:
+    return os.path.join(directory, f"{spreadsheet_id}.meta.json")
+
+
+def read_recording_meta(directory: str, spreadsheet_id: str) -> Dict:
+    """Revision, size and timings saved next to a recorded response ({} when there are none)"""
+    try:
+        with open(recording_meta_path(directory, spreadsheet_id), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_json_atomically(path: str, payload: Dict):
+    with atomic_write(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2)
+
+
+class RecordingBackend(FetchBackend):
+    """Passes another backend through and saves every response it downloads.
+
+    Each response is written to <directory>/<spreadsheet_id>.json while it is
+    decoded, and moved into place only once it is complete. The latest revision,
+    size and fetch time go to <spreadsheet_id>.meta.json for ReplayBackend.
+    """
+
+    def __init__(self, inner: FetchBackend, directory: str):
+        self.inner = inner
+        self.directory = directory
+
+    def response_chunks(self, spreadsheet_id: str) -> Iterator[bytes]:
+        os.makedirs(self.directory, exist_ok=True)
+        started = time.perf_counter()
+        size = 0
+        # An abandoned download leaves the previous recording in place
+        with atomic_write(recording_path(self.directory, spreadsheet_id)) as f:
+            for chunk in self.inner.response_chunks(spreadsheet_id):
+                f.write(chunk)
+                size += len(chunk)
+                yield chunk
+        meta = read_recording_meta(self.directory, spreadsheet_id)
+        meta.update({'spreadsheet_id': spreadsheet_id, 'bytes': size, 'recorded_at': time.time(),
+                     'fetch_seconds': time.perf_counter() - started})
+        _write_json_atomically(recording_meta_path(self.directory, spreadsheet_id), meta)
+
+    def fetch(self, spreadsheet_id: str) -> Dict:
+        chunks = self.response_chunks(spreadsheet_id)
+        spreadsheet = read_spreadsheet_stream(chunks)
+        # The decoder stops at the closing brace; read the rest so the recording is completed
+        for _ in chunks:
+            pass
+        return spreadsheet
+
+    def revision(self, spreadsheet_id: str) -> Optional[str]:
+        revision = self.inner.revision(spreadsheet_id)
+        os.makedirs(self.directory, exist_ok=True)
+        meta = read_recording_meta(self.directory, spreadsheet_id)
+        meta.update({'spreadsheet_id': spreadsheet_id, 'revision': revision})
+        _write_json_atomically(recording_meta_path(self.directory, spreadsheet_id), meta)
+        return revision
+
+
+class ReplayBackend(FetchBackend):
+    """Serves responses saved by RecordingBackend, with simulated network behavior.
+
+    Each fetch first waits latency seconds (the recorded fetch time when latency is
+    None) plus a uniform jitter of up to +/- jitter seconds, then streams the file
+    in chunks, throttled to bandwidth bytes per second when given. With probability
+    error_rate a fetch raises FetchError instead; probes behave the same way with
+    probe_latency and probe_error_rate. Pass seed for a repeatable run.
+    """
+
+    def __init__(self, directory: str, latency: Optional[float] = None, jitter: float = 0.0,
+                 error_rate: float = 0.0, bandwidth: Optional[float] = None, probe_latency: float = 0.0,
+                 probe_error_rate: float = 0.0, seed: Optional[int] = None,
+                 sleep: Callable[[float], None] = time.sleep, chunk_size: int = REPLAY_CHUNK_SIZE):
+        self.directory = directory
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+        self.probe_latency = probe_latency
+        self.probe_error_rate = probe_error_rate
+        self.sleep = sleep
+        self.chunk_size = chunk_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'fetches': 0, 'fetch_errors': 0, 'probes': 0, 'probe_errors': 0}
+
+    def _draw(self, error_rate: float, latency: float) -> Tuple[bool, float]:
+        """Whether this call fails, and how long it waits first"""
+        with self._lock:
+            failed = self._random.random() < error_rate
+            delay = latency + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        return failed, max(0.0, delay)
+
+    def response_chunks(self, spreadsheet_id: str) -> Iterator[bytes]:
+        path = recording_path(self.directory, spreadsheet_id)
+        if not os.path.exists(path):
+            raise FetchError(f"No recorded response for spreadsheet '{spreadsheet_id}' in {self.directory}", 404)
+
+        latency = self.latency
+        if latency is None:
+            latency = read_recording_meta(self.directory, spreadsheet_id).get('fetch_seconds', 0.0)
+        failed, delay = self._draw(self.error_rate, latency)
+        self.sleep(delay)
+        with self._lock:
+            self.stats['fetches'] += 1
+            if failed:
+                self.stats['fetch_errors'] += 1
+        if failed:
+            raise FetchError(f"Injected fetch failure for spreadsheet '{spreadsheet_id}'", 503)
+        return self._read_chunks(path)
+
+    def _read_chunks(self, path: str) -> Iterator[bytes]:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                if self.bandwidth:
+                    self.sleep(len(chunk) / self.bandwidth)
+                yield chunk
+
+    def revision(self, spreadsheet_id: str) -> Optional[str]:
+        failed, delay = self._draw(self.probe_error_rate, self.probe_latency)
+        self.sleep(delay)
+        with self._lock:
+            self.stats['probes'] += 1
+            if failed:
+                self.stats['probe_errors'] += 1
+        if failed:
+            raise FetchError(f"Injected probe failure for spreadsheet '{spreadsheet_id}'", 503)
+        return read_recording_meta(self.directory, spreadsheet_id).get('revision')
+
+
+def recorded_spreadsheet_ids(directory: str) -> List[str]:
+    """Spreadsheet IDs with a recorded response in directory"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(n[:-len('.json')] for n in names if n.endswith('.json') and not n.endswith('.meta.json'))
+
+
+def replay_fetches(backend: FetchBackend, spreadsheet_id: str, fetches: int) -> Dict:
+    """Fetch repeatedly and report success count and fetch time percentiles"""
+    times: List[float] = []
+    errors = 0
+    for _ in range(fetches):
+        start = time.perf_counter()
+        try:
+            spreadsheet = backend.fetch(spreadsheet_id)
+        except FetchError:
+            errors += 1
+            continue
+        times.append(time.perf_counter() - start)
+    report = {'fetches': fetches, 'errors': errors}
+    if times:
+        ordered = sorted(times)
+        report.update({'median_seconds': statistics.median(ordered), 'max_seconds': ordered[-1],
+                       'p95_seconds': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                       'sheets': len(spreadsheet.get('sheets', []))})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record = commands.add_parser('record', help="Fetch the sheet with credentials and save the response")
+    record.add_argument('--sheet-url', required=True)
+    record.add_argument('--credentials', required=True, help="Service account JSON key")
+    record.add_argument('--mode', choices=LIVE_MODES, default="stream")
+    record.add_argument('--out', default='recordings', help="Recording directory (default: recordings)")
+
+    replay = commands.add_parser('replay', help="Time fetches served from a recording directory")
+    replay.add_argument('directory')
+    replay.add_argument('--spreadsheet-id', help="Recorded spreadsheet to fetch (default: the only one)")
+    replay.add_argument('--fetches', type=int, default=10)
+    replay.add_argument('--latency', type=float, default=None,
+                        help="Seconds before each response (default: the recorded fetch time)")
+    replay.add_argument('--jitter', type=float, default=0.0, help="Uniform +/- seconds added to the latency")
+    replay.add_argument('--error-rate', type=float, default=0.0, help="Fraction of fetches that fail")
+    replay.add_argument('--bandwidth', type=float, default=None, help="Bytes per second while streaming")
+    replay.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        from sheets_client import spreadsheet_id_from_url
+
+        with open(args.credentials) as f:
+            credentials_info = json.load(f)
+        backend = RecordingBackend(LiveBackend(credentials_info, args.mode), args.out)
+        spreadsheet_id = spreadsheet_id_from_url(args.sheet_url)
+        revision = backend.revision(spreadsheet_id)
+        spreadsheet = backend.fetch(spreadsheet_id)
+        meta = read_recording_meta(args.out, spreadsheet_id)
+        print(f"Recorded {len(spreadsheet['sheets'])} day sheets ({meta['bytes']:,} bytes, revision {revision}) "
+              f"in {meta['fetch_seconds']:.2f}s to {recording_path(args.out, spreadsheet_id)}")
+        return
+
+    ids = recorded_spreadsheet_ids(args.directory)
+    spreadsheet_id = args.spreadsheet_id or (ids[0] if len(ids) == 1 else None)
+    if spreadsheet_id is None:
+        parser.error(f"--spreadsheet-id is needed; recorded: {', '.join(ids) or 'none'}")
+    backend = ReplayBackend(args.directory, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            bandwidth=args.bandwidth, seed=args.seed)
+    report = replay_fetches(backend, spreadsheet_id, args.fetches)
+    line = f"{report['fetches']} fetches, {report['errors']} failed"
+    if 'median_seconds' in report:
+        line += (f"; median {report['median_seconds'] * 1000:.0f} ms, p95 {report['p95_seconds'] * 1000:.0f} ms, "
+                 f"max {report['max_seconds'] * 1000:.0f} ms, {report['sheets']} day sheets")
+    print(line)
+
+
+if __name__ == "__main__":
+    main()
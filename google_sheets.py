@@ -1,15 +1,25 @@
-import streamlit as st
 import gspread
 from google.oauth2.service_account import Credentials
 
+GSPREAD_SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
-def get_google_sheets_data(sheet_url):
-    """Fetch Google Sheets file as a gspread object."""
-    credentials_dict = st.secrets["google_service_account"]
-    creds = Credentials.from_service_account_info(credentials_dict, scopes=["https://spreadsheets.google.com/feeds",
-                                                                            "https://www.googleapis.com/auth/drive"])
 
-    client = gspread.authorize(creds)
+def gspread_client(credentials_info):
+    """Authorized gspread client for service account info"""
+    creds = Credentials.from_service_account_info(credentials_info, scopes=GSPREAD_SCOPES)
+    return gspread.authorize(creds)
+
+
+def get_google_sheets_data(sheet_url, credentials_info=None):
+    """Fetch Google Sheets file as a gspread object.
+
+    credentials_info defaults to the service account in st.secrets.
+    """
+    if credentials_info is None:
+        import streamlit as st
+        credentials_info = st.secrets["google_service_account"]
+
+    client = gspread_client(credentials_info)
     sheet = client.open_by_url(sheet_url)
 
     return sheet
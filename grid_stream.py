@@ -0,0 +1,176 @@
+"""Incremental decoding of a Sheets API v4 spreadsheet response.
+
+read_spreadsheet_stream() walks the JSON text as it downloads and adds each row to
+a CompactGrid as soon as that row is complete. Neither the whole response text
+nor its full dict tree is ever held in memory; only the compact grids of the day
+sheets are kept.
+"""
+import codecs
+import json
+from typing import Dict, Iterable, Iterator, Union
+
+from compact_grid import CompactGridBuilder
+from extract_timetable import TIMETABLE_SHEETS
+
+JSON_WHITESPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+class StreamReader:
+    """Buffer over text or UTF-8 byte chunks with just enough JSON navigation.
+
+    members() and items() step through an object or array without decoding it;
+    the caller consumes each member or element with value() (or steps into it)
+    before asking for the next one.
+    """
+
+    def __init__(self, chunks: Iterable[Union[str, bytes]]):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Append the next chunk, dropping text already consumed; False at the end of the stream"""
+        while not self.eof:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.eof = True
+                chunk = self._utf8.decode(b'', final=True)
+            elif isinstance(chunk, bytes):
+                chunk = self._utf8.decode(chunk)
+            if chunk:
+                self.buffer = self.buffer[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self) -> str:
+        """Next non-whitespace character without consuming it, '' at the end of the stream"""
+        while True:
+            buffer, pos = self.buffer, self.pos
+            while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in spreadsheet stream, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number or literal that ends at the buffer edge may continue in the next chunk
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self) -> Iterator[str]:
+        """Keys of the object at the current position"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self._separator('}'):
+                return
+
+    def items(self) -> Iterator[None]:
+        """Steps through the elements of the array at the current position"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield None
+            if self._separator(']'):
+                return
+
+    def skip_items(self):
+        """Consume an array one element at a time, so a huge array is never decoded whole"""
+        for _ in self.items():
+            self.value()
+
+    def _separator(self, closing: str) -> bool:
+        char = self.peek()
+        self.pos += 1
+        if char == closing:
+            return True
+        if char != ',':
+            raise ValueError(f"Expected ',' or {closing!r} in spreadsheet stream, found {char!r}")
+        return False
+
+
+def read_spreadsheet_stream(chunks: Iterable[Union[str, bytes]], sheet_titles=TIMETABLE_SHEETS) -> Dict:
+    """Decode a spreadsheet response from text or byte chunks, keeping only what the parser reads.
+
+    Returns a spreadsheet dict with the spreadsheetId and, for each sheet named in
+    sheet_titles, its title and a CompactGrid of its first GridData under 'grid'.
+    Rows of other sheets are read one at a time and dropped.
+    """
+    reader = StreamReader(chunks)
+    spreadsheet = {'sheets': []}
+
+    for key in reader.members():
+        if key == 'spreadsheetId':
+            spreadsheet['spreadsheetId'] = reader.value()
+        elif key == 'sheets':
+            for _ in reader.items():
+                sheet = _read_sheet(reader, sheet_titles)
+                if sheet is not None:
+                    spreadsheet['sheets'].append(sheet)
+        elif reader.peek() == '[':
+            reader.skip_items()
+        else:
+            reader.value()
+
+    return spreadsheet
+
+
+def _read_sheet(reader: StreamReader, sheet_titles):
+    title = None
+    builder = CompactGridBuilder()
+
+    for key in reader.members():
+        if key == 'properties':
+            title = reader.value().get('title')
+        elif key == 'data':
+            for grid_index, _ in enumerate(reader.items()):
+                for data_key in reader.members():
+                    # The parser only reads the first GridData of a sheet; the title
+                    # normally comes first, but rows are kept if it hasn't been seen yet
+                    wanted = grid_index == 0 and (title is None or title in sheet_titles)
+                    if data_key == 'rowData' and wanted:
+                        for _ in reader.items():
+                            builder.add_row(reader.value())
+                    elif reader.peek() == '[':
+                        reader.skip_items()
+                    else:
+                        reader.value()
+        elif reader.peek() == '[':
+            reader.skip_items()
+        else:
+            reader.value()
+
+    if title not in sheet_titles:
+        return None
+    return {'properties': {'title': title}, 'grid': builder.build()}
@@ -0,0 +1,149 @@
+"""Process-wide timings and counters for each stage of serving a timetable.
+
+Code wraps a stage in METRICS.stage(name) and adds whatever it counted to the
+dict it gets back:
+
+    with METRICS.stage('parse') as counts:
+        counts['cells'] = len(grid.text_ids)
+
+Every call adds to the stage's totals (calls, seconds, slowest and latest call,
+summed counts, errors). snapshot() returns them as plain data, together with the
+counters recorded with METRICS.count() and the parser memo cache statistics;
+to_json() and to_prometheus() export that snapshot.
+"""
+from contextlib import contextmanager
+import json
+import threading
+import time
+from typing import Dict, Iterator
+
+from cell_parsers import parser_cache_stats
+
+METRIC_PREFIX = 'timetable'
+
+# Stages in pipeline order; others are listed after these in name order
+STAGE_ORDER = ['probe', 'fetch', 'compact', 'batch_colors', 'parse', 'render_all', 'courses',
+               'timetable', 'custom_match', 'custom_render']
+
+
+class StageTotals:
+    __slots__ = ('calls', 'errors', 'seconds', 'max_seconds', 'last_seconds', 'counts')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+        self.counts = {}
+
+
+class Metrics:
+    """Thread-safe stage timings and named counters"""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self.started_at = time.time()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, int]]:
+        """Time the block and add the counts it puts in the yielded dict to stage name"""
+        counts = {}
+        failed = False
+        start = self.clock()
+        try:
+            yield counts
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.record(name, self.clock() - start, counts, failed)
+
+    def record(self, name: str, seconds: float, counts: Dict[str, int] = None, failed: bool = False):
+        """Add one call of a stage measured elsewhere"""
+        with self._lock:
+            totals = self._stages.get(name)
+            if totals is None:
+                totals = self._stages[name] = StageTotals()
+            totals.calls += 1
+            totals.errors += failed
+            totals.seconds += seconds
+            totals.last_seconds = seconds
+            if seconds > totals.max_seconds:
+                totals.max_seconds = seconds
+            for key, value in (counts or {}).items():
+                totals.counts[key] = totals.counts.get(key, 0) + value
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self.started_at = time.time()
+
+    def snapshot(self) -> Dict:
+        """Stage totals, counters and parser cache statistics as plain data"""
+        with self._lock:
+            stages = {name: {
+                'calls': t.calls,
+                'errors': t.errors,
+                'seconds': t.seconds,
+                'mean_seconds': t.seconds / t.calls if t.calls else 0.0,
+                'max_seconds': t.max_seconds,
+                'last_seconds': t.last_seconds,
+                'counts': dict(t.counts),
+            } for name, t in self._stages.items()}
+            counters = dict(self._counters)
+            started_at = self.started_at
+
+        ordered = [n for n in STAGE_ORDER if n in stages] + sorted(n for n in stages if n not in STAGE_ORDER)
+        return {
+            'since': started_at,
+            'stages': {name: stages[name] for name in ordered},
+            'counters': dict(sorted(counters.items())),
+            'parser_caches': parser_cache_stats(),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """The snapshot in the Prometheus text exposition format"""
+        snap = self.snapshot()
+        p = METRIC_PREFIX
+        lines = [f"# HELP {p}_stage_seconds Time spent in each stage",
+                 f"# TYPE {p}_stage_seconds summary"]
+        for name, s in snap['stages'].items():
+            lines.append(f'{p}_stage_seconds_sum{{stage="{name}"}} {s["seconds"]:.6f}')
+            lines.append(f'{p}_stage_seconds_count{{stage="{name}"}} {s["calls"]}')
+        lines += [f"# HELP {p}_stage_max_seconds Slowest call of each stage",
+                  f"# TYPE {p}_stage_max_seconds gauge"]
+        lines += [f'{p}_stage_max_seconds{{stage="{name}"}} {s["max_seconds"]:.6f}'
+                  for name, s in snap['stages'].items()]
+        lines += [f"# HELP {p}_stage_errors_total Calls of each stage that raised",
+                  f"# TYPE {p}_stage_errors_total counter"]
+        lines += [f'{p}_stage_errors_total{{stage="{name}"}} {s["errors"]}' for name, s in snap['stages'].items()]
+        lines += [f"# HELP {p}_stage_items_total Items counted by each stage (cells, sessions, hits, ...)",
+                  f"# TYPE {p}_stage_items_total counter"]
+        for name, s in snap['stages'].items():
+            lines += [f'{p}_stage_items_total{{stage="{name}",item="{item}"}} {value}'
+                      for item, value in sorted(s['counts'].items())]
+        lines += [f"# HELP {p}_events_total Named event counters",
+                  f"# TYPE {p}_events_total counter"]
+        lines += [f'{p}_events_total{{event="{name}"}} {value}' for name, value in snap['counters'].items()]
+        lines += [f"# HELP {p}_parser_cache_total Parser memo cache lookups",
+                  f"# TYPE {p}_parser_cache_total counter"]
+        for name, c in snap['parser_caches'].items():
+            lines.append(f'{p}_parser_cache_total{{parser="{name}",result="hit"}} {c["hits"]}')
+            lines.append(f'{p}_parser_cache_total{{parser="{name}",result="miss"}} {c["misses"]}')
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every session, thread and module of the process
+METRICS = Metrics()
@@ -0,0 +1,246 @@
+"""Profile the timetable code on a saved spreadsheet, offline.
+
+Loads a spreadsheet JSON (the Sheets API v4 includeGridData response, e.g. saved
+from production), builds the shared TimetableData the app serves, then replays a
+random mix of get_timetable, get_custom_timetable and catalog searches. The
+build and the replay run under cProfile and tracemalloc, and the reports go to
+--out:
+
+    hot_functions.txt   functions sorted by cumulative and by own time
+    allocations.txt     top allocation sites at the end of the run, and the peak
+    profile.pstats      raw cProfile data for pstats, snakeviz, ...
+    summary.json        request mix, latency per request kind, peak memory, stage metrics
+
+    python profile_timetable.py --input spreadsheet.json
+    python profile_timetable.py --input spreadsheet.json --requests 5000 --mix timetable=6 custom=3 search=1
+    python profile_timetable.py --input spreadsheet.json --mode raw --tools cprofile --structure
+"""
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from course_extractor import search_courses
+from export_timetables import load_spreadsheet
+from extract_timetable import TIMETABLE_SHEETS, analyze_sheet_structure, get_custom_timetable, get_timetable
+from metrics import METRICS
+from timetable_data import build_timetable_data
+
+DEFAULT_MIX = {'timetable': 6, 'custom': 2, 'search': 2}
+DEFAULT_REQUESTS = 2000
+REPORT_LINES = 40
+TRACE_FRAMES = 10
+MAX_CUSTOM_SELECTION = 8
+
+
+def parse_mix(items: List[str]) -> Dict[str, int]:
+    """{'timetable': 6, ...} from ['timetable=6', ...]"""
+    mix = {}
+    for item in items:
+        kind, _, weight = item.partition('=')
+        if kind not in DEFAULT_MIX or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"Bad --mix entry {item!r}; use kind=weight with kind in "
+                                             f"{', '.join(DEFAULT_MIX)}")
+        mix[kind] = int(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("--mix needs at least one non-zero weight")
+    return mix
+
+
+def build_workload(data, mix: Dict[str, int], requests: int, seed: int) -> List[Tuple[str, Callable]]:
+    """Requests as (kind, call) pairs drawn with the mix weights"""
+    rnd = random.Random(seed)
+    pairs = data.snapshot.section_pairs()
+    courses = data.catalog.sorted_courses()
+    departments = data.facets.departments
+    kinds = [k for k in mix if mix[k] and (k != 'timetable' or pairs) and (k == 'timetable' or courses)]
+    if not kinds:
+        raise SystemExit("The spreadsheet has no timetables or courses to replay")
+    weights = [mix[k] for k in kinds]
+
+    workload = []
+    for kind in rnd.choices(kinds, weights, k=requests):
+        if kind == 'timetable':
+            batch, section = rnd.choice(pairs)
+            workload.append((kind, lambda s=data.snapshot, b=batch, sec=section: get_timetable(s, b, sec)))
+        elif kind == 'custom':
+            selection = rnd.sample(courses, rnd.randint(1, min(MAX_CUSTOM_SELECTION, len(courses))))
+            workload.append((kind, lambda s=data.snapshot, sel=selection: get_custom_timetable(s, sel)))
+        else:
+            name = rnd.choice(courses)['name']
+            start = rnd.randrange(max(1, len(name) - 2))
+            query = name[start:start + rnd.randint(2, 4)]
+            department = rnd.choice([""] + departments) if departments and rnd.random() < 0.5 else ""
+            workload.append((kind, lambda c=data.catalog, q=query, d=department: search_courses(c, q, d)))
+    return workload
+
+
+def load_for_mode(path: str, mode: str):
+    """The spreadsheet as the app would hold it: compact grids ('stream') or the full dict tree ('raw')"""
+    if mode == 'stream':
+        return load_spreadsheet(path)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def print_structure(spreadsheet: Dict):
+    """Print the first rows of every day sheet of a raw spreadsheet with analyze_sheet_structure"""
+    for sheet in spreadsheet.get('sheets', []):
+        title = sheet['properties']['title']
+        if title in TIMETABLE_SHEETS and 'data' in sheet:
+            analyze_sheet_structure(sheet['data'][0].get('rowData', []), title)
+
+
+def latency_summary(samples: List[float]) -> Dict:
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'total_ms': sum(ordered) * 1000,
+        'median_ms': statistics.median(ordered) * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def hot_functions_report(profiler: cProfile.Profile, lines: int) -> str:
+    out = io.StringIO()
+    for sort_key in ('cumulative', 'tottime'):
+        out.write(f"=== Top {lines} functions by {sort_key} time ===\n")
+        pstats.Stats(profiler, stream=out).strip_dirs().sort_stats(sort_key).print_stats(lines)
+    return out.getvalue()
+
+
+def allocations_report(snapshot: tracemalloc.Snapshot, peak: int, lines: int) -> str:
+    out = io.StringIO()
+    out.write(f"Peak traced memory: {peak / 1024:.0f} KiB\n")
+    stats = snapshot.statistics('lineno')
+    out.write(f"Live at the end of the run: {sum(s.size for s in stats) / 1024:.0f} KiB "
+              f"in {sum(s.count for s in stats)} blocks\n\n")
+    out.write(f"=== Top {lines} allocation sites by size ===\n")
+    for stat in stats[:lines]:
+        out.write(f"{stat}\n")
+    out.write(f"\n=== Top {lines} allocation tracebacks by size ===\n")
+    for stat in snapshot.statistics('traceback')[:min(lines, 10)]:
+        out.write(f"\n{stat.count} blocks, {stat.size / 1024:.1f} KiB\n")
+        out.write("\n".join(stat.traceback.format()) + "\n")
+    return out.getvalue()
+
+
+def run_profile(spreadsheet, mix: Dict[str, int], requests: int, seed: int, tools: List[str], out_dir: str,
+                lines: int = REPORT_LINES, frames: int = TRACE_FRAMES) -> Dict:
+    """Build, replay and write the reports; returns the summary that is also saved as summary.json"""
+    os.makedirs(out_dir, exist_ok=True)
+    profiler = cProfile.Profile() if 'cprofile' in tools else None
+    trace = 'tracemalloc' in tools
+    METRICS.reset()
+
+    if trace:
+        tracemalloc.start(frames)
+    if profiler:
+        profiler.enable()
+
+    started = time.perf_counter()
+    data = build_timetable_data(spreadsheet)
+    build_seconds = time.perf_counter() - started
+    # The workload is drawn outside the profile so it doesn't show up as a hot spot
+    if profiler:
+        profiler.disable()
+    workload = build_workload(data, mix, requests, seed)
+    if profiler:
+        profiler.enable()
+
+    latencies = {}
+    replay_started = time.perf_counter()
+    for kind, call in workload:
+        start = time.perf_counter()
+        call()
+        latencies.setdefault(kind, []).append(time.perf_counter() - start)
+    replay_seconds = time.perf_counter() - replay_started
+
+    if profiler:
+        profiler.disable()
+    peak = 0
+    if trace:
+        # Leave out the replayed request closures themselves
+        allocations = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__)])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    if profiler:
+        profiler.dump_stats(os.path.join(out_dir, 'profile.pstats'))
+        with open(os.path.join(out_dir, 'hot_functions.txt'), 'w', encoding='utf-8') as f:
+            f.write(hot_functions_report(profiler, lines))
+    if trace:
+        with open(os.path.join(out_dir, 'allocations.txt'), 'w', encoding='utf-8') as f:
+            f.write(allocations_report(allocations, peak, lines))
+
+    summary = {
+        'spreadsheet_id': data.snapshot.spreadsheet_id,
+        'sessions': len(data.snapshot.sessions),
+        'timetables': len(data.snapshot.section_pairs()),
+        'courses': len(data.catalog),
+        'tools': list(tools),
+        'mix': mix,
+        'seed': seed,
+        'build_seconds': build_seconds,
+        'replay_seconds': replay_seconds,
+        'requests': {kind: latency_summary(samples) for kind, samples in sorted(latencies.items())},
+        'peak_traced_kib': peak / 1024 if trace else None,
+        'metrics': METRICS.snapshot(),
+    }
+    with open(os.path.join(out_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', required=True, help="Saved spreadsheet JSON")
+    parser.add_argument('--out', default='profile', help="Report directory (default: profile)")
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help="Requests to replay")
+    parser.add_argument('--mix', nargs='+', default=None, metavar='KIND=WEIGHT',
+                        help="Relative weights of timetable, custom and search requests (default: "
+                             + " ".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()) + ")")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=['stream', 'raw'], default='stream',
+                        help="Load into compact grids like the app (stream) or keep the full JSON tree (raw)")
+    parser.add_argument('--tools', nargs='+', choices=['cprofile', 'tracemalloc'], default=['cprofile', 'tracemalloc'])
+    parser.add_argument('--lines', type=int, default=REPORT_LINES, help="Entries per report section")
+    parser.add_argument('--frames', type=int, default=TRACE_FRAMES, help="Frames kept per traced allocation")
+    parser.add_argument('--structure', action='store_true',
+                        help="Print the first rows of each day sheet first (needs --mode raw)")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix) if args.mix else dict(DEFAULT_MIX)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if args.structure and args.mode != 'raw':
+        parser.error("--structure needs --mode raw")
+
+    spreadsheet = load_for_mode(args.input, args.mode)
+    if args.structure:
+        print_structure(spreadsheet)
+
+    summary = run_profile(spreadsheet, mix, args.requests, args.seed, args.tools, args.out,
+                          lines=args.lines, frames=args.frames)
+    print(f"Built {summary['timetables']} timetables and {summary['courses']} courses in "
+          f"{summary['build_seconds'] * 1000:.0f} ms; replayed {args.requests} requests in "
+          f"{summary['replay_seconds'] * 1000:.0f} ms")
+    for kind, stats in summary['requests'].items():
+        print(f"{kind:>10}: {stats['count']:>6} requests  median {stats['median_ms']:.3f} ms  "
+              f"p95 {stats['p95_ms']:.3f} ms  max {stats['max_ms']:.3f} ms")
+    if summary['peak_traced_kib'] is not None:
+        print(f"Peak traced memory {summary['peak_traced_kib']:.0f} KiB")
+    print(f"Reports written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+import os
+import pickle
+import random
+import re
+import threading
+import time
+from typing import IO, Callable, Dict, Iterator, NamedTuple, Optional
+
+from metrics import METRICS
+
+# Bump when the pickled snapshot classes change shape so old cache files are ignored
+SNAPSHOT_FORMAT = 7
+
+
+class CacheEntry(NamedTuple):
+    """A fetched spreadsheet, its revision token and whatever was derived from it.
+
+    spreadsheet is None when the entry was restored from a SnapshotStore, since only
+    the derived data is persisted, or when the cache was told not to keep grids.
+    """
+    revision: Optional[str]
+    spreadsheet: Optional[Dict]
+    derived: object
+    fetched_at: float
+
+
+class StoredSnapshot(NamedTuple):
+    revision: Optional[str]
+    data: object
+    saved_at: float
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'wb', **open_args) -> Iterator[IO]:
+    """Open a temporary file next to path and move it over path only if the block completes.
+
+    Readers see the old file or the complete new one, never a partial write; on an
+    exception (or an abandoned generator) the temporary file is removed.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode, **open_args) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class SnapshotStore:
+    """Persists derived snapshots in a local directory, keyed by spreadsheet ID and revision.
+
+    Each snapshot is one pickle file written atomically, so a restarted process can load
+    the last parsed data in milliseconds instead of re-downloading and re-parsing the
+    sheet. Only point this at a directory the app itself writes to.
+    """
+
+    def __init__(self, cache_dir: str, keep: int = 3):
+        self.cache_dir = cache_dir
+        self.keep = keep
+
+    def path(self, spreadsheet_id: str, revision: Optional[str]) -> str:
+        name = f"{_safe_name(spreadsheet_id)}-{_safe_name(revision or 'unversioned')}.snapshot"
+        return os.path.join(self.cache_dir, name)
+
+    def save(self, spreadsheet_id: str, revision: Optional[str], data) -> str:
+        """Write data for this revision and prune older snapshots of the spreadsheet"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(spreadsheet_id, revision)
+        payload = {
+            'format': SNAPSHOT_FORMAT,
+            'spreadsheet_id': spreadsheet_id,
+            'revision': revision,
+            'saved_at': time.time(),
+            'data': data,
+        }
+        with atomic_write(path) as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._prune(spreadsheet_id)
+        return path
+
+    def load(self, spreadsheet_id: str, revision: Optional[str] = None) -> Optional[StoredSnapshot]:
+        """Load the snapshot for revision, or the newest one when revision is None"""
+        if revision is not None:
+            paths = [self.path(spreadsheet_id, revision)]
+        else:
+            paths = self._snapshot_paths(spreadsheet_id)
+
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    payload = pickle.load(f)
+            except Exception:
+                # Missing, truncated or written by an incompatible version of the code
+                continue
+            if (isinstance(payload, dict) and payload.get('format') == SNAPSHOT_FORMAT
+                    and payload.get('spreadsheet_id') == spreadsheet_id):
+                return StoredSnapshot(payload['revision'], payload['data'], payload['saved_at'])
+        return None
+
+    def _snapshot_paths(self, spreadsheet_id: str):
+        """Snapshot files of the spreadsheet, newest first"""
+        prefix = f"{_safe_name(spreadsheet_id)}-"
+        try:
+            names = [n for n in os.listdir(self.cache_dir) if n.startswith(prefix) and n.endswith('.snapshot')]
+        except FileNotFoundError:
+            return []
+        paths = [os.path.join(self.cache_dir, n) for n in names]
+        return sorted(paths, key=lambda p: os.path.getmtime(p), reverse=True)
+
+    def _prune(self, spreadsheet_id: str):
+        for path in self._snapshot_paths(spreadsheet_id)[self.keep:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _safe_name(value: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(value))
+
+
+class FetchBackoff(Exception):
+    """Raised instead of fetching while a spreadsheet with no cached entry is backing off after failures"""
+
+    def __init__(self, spreadsheet_id: str, retry_in: float, failures: int):
+        super().__init__(f"Fetching spreadsheet '{spreadsheet_id}' failed {failures} time(s) in a row; "
+                         f"retrying in {retry_in:.0f}s")
+        self.retry_in = retry_in
+        self.failures = failures
+
+
+class FetchFailure(NamedTuple):
+    count: int
+    retry_at: float
+    error: BaseException
+
+
+class RevisionCache:
+    """Keeps the fetched spreadsheet and data derived from it until its revision changes.
+
+    fetch(spreadsheet_id) returns the grid, probe(spreadsheet_id) returns a revision
+    token and derive(spreadsheet), if given, builds parsed data (e.g. a TimetableSnapshot)
+    that is cached next to the grid. Any callables work, so tests can pass local fakes.
+
+    The probe runs at most once per probe_interval seconds; a full fetch happens only
+    when the token changed, the probe failed and the entry is older than max_age, or
+    there is no probe at all and the entry is older than max_age.
+
+    Refreshes are single-flight: per spreadsheet, one caller probes, fetches and
+    derives while every other caller waits for its result, so an expiry at peak
+    load costs one download instead of one per session. Other spreadsheets and
+    callers served from a fresh entry never wait on it.
+
+    A failed fetch is retried after an exponential backoff (backoff_base doubling up
+    to backoff_max seconds, with +/-50% jitter so processes don't retry in step).
+    Until then callers get the current entry, or FetchBackoff when there is none.
+
+    With a store, derived data is saved after every fetch, and the first get() after a
+    restart serves the newest stored snapshot straight away while a background thread
+    checks whether it is stale.
+
+    With keep_spreadsheet=False only the derived data is kept, so the fetched grid can
+    be freed as soon as derive() has parsed it.
+    """
+
+    def __init__(self, fetch: Callable[[str], Dict], probe: Optional[Callable[[str], str]] = None,
+                 derive: Optional[Callable[[Dict], object]] = None, probe_interval: float = 60.0,
+                 max_age: float = 300.0, clock: Callable[[], float] = time.monotonic,
+                 store: Optional[SnapshotStore] = None, keep_spreadsheet: bool = True,
+                 backoff_base: float = 2.0, backoff_max: float = 300.0,
+                 jitter: Callable[[], float] = random.random):
+        self.fetch = fetch
+        self.probe = probe
+        self.derive = derive
+        self.probe_interval = probe_interval
+        self.max_age = max_age
+        self.clock = clock
+        self.store = store
+        self.keep_spreadsheet = keep_spreadsheet
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self._entries = {}
+        self._probed_at = {}
+        self._flights = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'probes': 0, 'probe_errors': 0, 'fetches': 0, 'reuses': 0, 'restored': 0,
+                      'coalesced': 0, 'fetch_errors': 0, 'backoff_reuses': 0, 'backoff_rejections': 0}
+
+    def get(self, spreadsheet_id: str) -> CacheEntry:
+        """Return the current entry, probing and refetching only when needed"""
+        with self._lock:
+            entry = self._entries.get(spreadsheet_id)
+            now = self.clock()
+
+            if entry is not None and now - self._probed_at.get(spreadsheet_id, 0) < self.probe_interval:
+                self._count('reuses')
+                return entry
+
+            failure = self._failures.get(spreadsheet_id)
+            if failure is not None and now < failure.retry_at:
+                if entry is not None:
+                    self._count('backoff_reuses')
+                    return entry
+                self._count('backoff_rejections')
+                raise FetchBackoff(spreadsheet_id, failure.retry_at - now, failure.count) from failure.error
+
+            flight = self._flights.get(spreadsheet_id)
+            if flight is None:
+                flight = self._flights[spreadsheet_id] = Future()
+                leader = True
+            else:
+                self._count('coalesced')
+                leader = False
+
+        if not leader:
+            # Another caller is already refreshing this spreadsheet; share its outcome
+            return flight.result()
+        if entry is None and self.store is not None:
+            restored = self._restore(spreadsheet_id, flight)
+            if restored is not None:
+                return restored
+        return self._lead(spreadsheet_id, flight, entry, now, background=False)
+
+    def check_in_background(self, spreadsheet_id: str) -> threading.Thread:
+        """Probe the spreadsheet on a daemon thread and swap in a fresh entry if it is stale.
+
+        Readers keep getting the current entry while the fetch runs. When the probe
+        can't tell (no probe, or it failed) the spreadsheet is refetched.
+        """
+        thread = threading.Thread(target=self._check, args=(spreadsheet_id,), daemon=True,
+                                  name=f"revision-check-{spreadsheet_id}")
+        thread.start()
+        return thread
+
+    def invalidate(self, spreadsheet_id: str):
+        """Drop the cached entry so the next get() does a full fetch"""
+        with self._lock:
+            self._entries.pop(spreadsheet_id, None)
+            self._probed_at.pop(spreadsheet_id, None)
+            self._failures.pop(spreadsheet_id, None)
+
+    def _check(self, spreadsheet_id: str):
+        with self._lock:
+            if spreadsheet_id in self._flights:
+                # A refresh is already running and will swap in whatever it finds
+                return
+            entry = self._entries.get(spreadsheet_id)
+            flight = self._flights[spreadsheet_id] = Future()
+        try:
+            self._lead(spreadsheet_id, flight, entry, self.clock(), background=True)
+        except Exception:
+            # Keep serving the current entry; the next foreground probe will retry
+            pass
+
+    def _lead(self, spreadsheet_id: str, flight: Future, entry: Optional[CacheEntry], now: float,
+              background: bool) -> CacheEntry:
+        """Refresh as the single caller doing so, then publish the outcome to everyone waiting on flight"""
+        try:
+            fresh = self._refresh(spreadsheet_id, entry, now, background)
+        except BaseException as error:
+            with self._lock:
+                self._flights.pop(spreadsheet_id, None)
+                self._record_failure(spreadsheet_id, error)
+            if entry is not None and isinstance(error, Exception):
+                # Waiters and the leader keep the entry they had until the backoff ends
+                flight.set_result(entry)
+                return entry
+            flight.set_exception(error)
+            raise
+        with self._lock:
+            self._entries[spreadsheet_id] = fresh
+            self._failures.pop(spreadsheet_id, None)
+            self._flights.pop(spreadsheet_id, None)
+        flight.set_result(fresh)
+        return fresh
+
+    def _refresh(self, spreadsheet_id: str, entry: Optional[CacheEntry], now: float,
+                 background: bool) -> CacheEntry:
+        """The entry to serve next: entry itself when it is still current, otherwise a new fetch"""
+        revision = self._probe(spreadsheet_id)
+        with self._lock:
+            self._probed_at[spreadsheet_id] = self.clock() if background else now
+
+        if entry is not None:
+            if revision is not None and revision == entry.revision:
+                self._count('reuses')
+                return entry
+            # A foreground probe that can't tell keeps a young entry; the background check refetches
+            if revision is None and not background and now - entry.fetched_at < self.max_age:
+                self._count('reuses')
+                return entry
+
+        return self._build(spreadsheet_id, revision, self.clock() if background else now)
+
+    def _record_failure(self, spreadsheet_id: str, error: BaseException) -> FetchFailure:
+        """Count a failed refresh and schedule the next attempt; call with the lock held"""
+        self._count('fetch_errors')
+        previous = self._failures.get(spreadsheet_id)
+        count = previous.count + 1 if previous is not None else 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (count - 1))
+        delay *= 0.5 + self.jitter()  # +/-50% jitter
+        failure = FetchFailure(count, self.clock() + delay, error)
+        self._failures[spreadsheet_id] = failure
+        return failure
+
+    def _count(self, stat: str):
+        """Bump one of self.stats and its process-wide counter"""
+        with self._stats_lock:
+            self.stats[stat] += 1
+        METRICS.count(f"revision_cache_{stat}")
+
+    def _probe(self, spreadsheet_id: str) -> Optional[str]:
+        if self.probe is None:
+            return None
+        self._count('probes')
+        try:
+            with METRICS.stage('probe'):
+                return self.probe(spreadsheet_id)
+        except Exception:
+            self._count('probe_errors')
+            return None
+
+    def _restore(self, spreadsheet_id: str, flight: Future) -> Optional[CacheEntry]:
+        """As the flight's leader, serve the newest stored snapshot and check it in the background.
+
+        The pickle is read without the lock; when nothing is stored the flight stays open
+        for the fetch that follows.
+        """
+        try:
+            stored = self.store.load(spreadsheet_id)
+        except BaseException as error:
+            with self._lock:
+                self._flights.pop(spreadsheet_id, None)
+            flight.set_exception(error)
+            raise
+        if stored is None:
+            return None
+        self._count('restored')
+        with self._lock:
+            now = self.clock()
+            entry = CacheEntry(stored.revision, None, stored.data, now)
+            self._entries[spreadsheet_id] = entry
+            self._probed_at[spreadsheet_id] = now
+            self._flights.pop(spreadsheet_id, None)
+        flight.set_result(entry)
+        self.check_in_background(spreadsheet_id)
+        return entry
+
+    def _build(self, spreadsheet_id: str, revision: Optional[str], now: float) -> CacheEntry:
+        self._count('fetches')
+        with METRICS.stage('fetch') as counts:
+            spreadsheet = self.fetch(spreadsheet_id)
+            counts['sheets'] = len(spreadsheet.get('sheets', []))
+        derived = self.derive(spreadsheet) if self.derive else None
+        if self.store is not None and derived is not None:
+            try:
+                self.store.save(spreadsheet_id, revision, derived)
+            except OSError:
+                # A read-only or full disk only costs the next cold start
+                pass
+        return CacheEntry(revision, spreadsheet if self.keep_spreadsheet or derived is None else None,
+                          derived, now)
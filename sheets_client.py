@@ -0,0 +1,192 @@
+import json
+import time
+from typing import Dict, Iterator, List
+from urllib.parse import quote
+
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
+
+from extract_timetable import TIMETABLE_SHEETS
+from grid_stream import read_spreadsheet_stream
+from metrics import METRICS
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+SHEETS_API_URL = "https://sheets.googleapis.com/v4/spreadsheets/"
+DRIVE_METADATA_SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly']
+
+# Only the fields the timetable parser reads: sheet titles, cell text and background color
+TIMETABLE_FIELDS = (
+    "spreadsheetId,"
+    "sheets(properties(title),"
+    "data(rowData(values(formattedValue,effectiveFormat(backgroundColor)))))"
+)
+
+# "masked" requests TIMETABLE_FIELDS for the day sheets only, "full" is the unrestricted grid
+FETCH_MODES = ("masked", "full")
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def spreadsheet_id_from_url(sheet_url: str) -> str:
+    """Extract the spreadsheet ID from a docs.google.com URL"""
+    return sheet_url.split('/d/')[1].split('/')[0]
+
+
+def build_sheets_service(credentials_info: Dict):
+    """Build a read-only Sheets API v4 service from service account info"""
+    creds = Credentials.from_service_account_info(credentials_info, scopes=SCOPES)
+    return build('sheets', 'v4', credentials=creds)
+
+
+def list_sheet_titles(service, spreadsheet_id: str) -> List[str]:
+    """Return the sheet titles of a spreadsheet without any grid data"""
+    response = service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        fields="sheets(properties(title))"
+    ).execute()
+    return [sheet['properties']['title'] for sheet in response.get('sheets', [])]
+
+
+def fetch_spreadsheet(service, spreadsheet_id: str, mode: str = "masked") -> Dict:
+    """Fetch the spreadsheet grid with cell formatting.
+
+    In "masked" mode only the Monday-Friday sheets are requested and only the fields
+    in TIMETABLE_FIELDS come back, which drops fonts, borders, padding and number
+    formats from the payload. "full" mode returns every sheet and property.
+    """
+    if mode == "full":
+        return service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            includeGridData=True
+        ).execute()
+
+    if mode != "masked":
+        raise ValueError(f"Unknown fetch mode '{mode}', expected one of {FETCH_MODES}")
+
+    # Ranges must name existing sheets, so look the titles up first (a tiny request)
+    ranges = day_sheet_ranges(list_sheet_titles(service, spreadsheet_id))
+    if not ranges:
+        return {'spreadsheetId': spreadsheet_id, 'sheets': []}
+
+    # A field mask that names sheets.data implies grid data, includeGridData is not needed
+    return service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        ranges=ranges,
+        fields=TIMETABLE_FIELDS
+    ).execute()
+
+
+def day_sheet_ranges(titles: List[str]) -> List[str]:
+    """A1 ranges covering the whole of each Monday-Friday sheet in titles"""
+    return ["'{}'".format(t.replace("'", "''")) for t in titles if t in TIMETABLE_SHEETS]
+
+
+def payload_size(spreadsheet: Dict) -> int:
+    """Size in bytes of the spreadsheet encoded as compact JSON"""
+    return len(json.dumps(spreadsheet, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+
+def measure_fetch(service, spreadsheet_id: str, modes=FETCH_MODES) -> Dict[str, Dict]:
+    """Fetch the spreadsheet once per mode and report payload size, fetch and decode time.
+
+    Decode time is measured by re-parsing the JSON encoding, which approximates the
+    client library's own decode of the HTTP response.
+    """
+    report = {}
+    for mode in modes:
+        start = time.perf_counter()
+        spreadsheet = fetch_spreadsheet(service, spreadsheet_id, mode)
+        fetch_seconds = time.perf_counter() - start
+
+        encoded = json.dumps(spreadsheet, separators=(',', ':'), ensure_ascii=False)
+        start = time.perf_counter()
+        json.loads(encoded)
+        decode_seconds = time.perf_counter() - start
+
+        report[mode] = {
+            'bytes': len(encoded.encode('utf-8')),
+            'sheets': len(spreadsheet.get('sheets', [])),
+            'fetch_seconds': fetch_seconds,
+            'decode_seconds': decode_seconds,
+        }
+    return report
+
+
+class StreamingSpreadsheetFetch:
+    """Fetch callable that decodes the masked day-sheet response while it downloads.
+
+    The client library reads the whole body and json-decodes it in one go, so the
+    response text and the complete dict tree are in memory together. This streams
+    the same request over an authorized HTTP session into read_spreadsheet_stream,
+    which keeps only the trimmed rows of the day sheets.
+    """
+
+    def __init__(self, credentials_info: Dict, chunk_size: int = STREAM_CHUNK_SIZE):
+        creds = Credentials.from_service_account_info(credentials_info, scopes=SCOPES)
+        self.session = AuthorizedSession(creds)
+        self.chunk_size = chunk_size
+
+    def __call__(self, spreadsheet_id: str) -> Dict:
+        return read_spreadsheet_stream(self.response_chunks(spreadsheet_id))
+
+    def response_chunks(self, spreadsheet_id: str) -> Iterator[bytes]:
+        """The masked day-sheet response as it downloads, in UTF-8 byte chunks"""
+        url = SHEETS_API_URL + quote(spreadsheet_id, safe='')
+
+        response = self.session.get(url, params={'fields': "sheets(properties(title))"})
+        response.raise_for_status()
+        titles = [sheet['properties']['title'] for sheet in response.json().get('sheets', [])]
+        ranges = day_sheet_ranges(titles)
+        if not ranges:
+            yield json.dumps({'spreadsheetId': spreadsheet_id, 'sheets': []}).encode('utf-8')
+            return
+
+        params = [('ranges', r) for r in ranges] + [('fields', TIMETABLE_FIELDS)]
+        with self.session.get(url, params=params, stream=True) as response:
+            response.raise_for_status()
+            yield from _counted_chunks(response.iter_content(self.chunk_size))
+
+
+def _counted_chunks(chunks):
+    """Pass chunks through, adding their size to the fetch_bytes counter"""
+    received = 0
+    for chunk in chunks:
+        received += len(chunk)
+        yield chunk
+    METRICS.count('fetch_bytes', received)
+
+
+class DriveRevisionProbe:
+    """Freshness probe that reads the spreadsheet's Drive file version.
+
+    Drive bumps 'version' on every edit, so comparing it is enough to tell whether
+    the grid changed. The call returns a few bytes instead of the whole grid. The
+    service account needs the drive.metadata.readonly scope and the Drive API enabled.
+    """
+
+    def __init__(self, credentials_info: Dict):
+        creds = Credentials.from_service_account_info(credentials_info, scopes=DRIVE_METADATA_SCOPES)
+        self.service = build('drive', 'v3', credentials=creds)
+
+    def __call__(self, spreadsheet_id: str) -> str:
+        metadata = self.service.files().get(
+            fileId=spreadsheet_id,
+            fields="version,modifiedTime"
+        ).execute()
+        return str(metadata.get('version') or metadata.get('modifiedTime', ''))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare Sheets payload size for each fetch mode")
+    parser.add_argument("sheet_url")
+    parser.add_argument("--credentials", required=True, help="Path to a service account JSON key")
+    args = parser.parse_args()
+
+    with open(args.credentials) as f:
+        service = build_sheets_service(json.load(f))
+
+    for mode, stats in measure_fetch(service, spreadsheet_id_from_url(args.sheet_url)).items():
+        print(f"{mode:>6}: {stats['bytes']:>12,} bytes  {stats['sheets']} sheets  "
+              f"fetch {stats['fetch_seconds']:.2f}s  decode {stats['decode_seconds']:.3f}s")
@@ -0,0 +1,133 @@
+import random
+from typing import Dict, List, Tuple
+
+from extract_timetable import TIMETABLE_SHEETS
+
+DEPARTMENTS = ["CS", "SE", "DS", "AI", "CY", "EE", "BBA", "FT"]
+COURSE_NAMES = ["Data St", "Comp Net", "Gen AI", "DIP", "Func Eng", "Islamic", "OOP", "Prob Stats",
+                "Calc", "Linear Alg", "OS", "DB", "Comp Arch", "Discrete", "PF", "TOA"]
+CLASS_TIMES = ["08:00-08:50", "08:55-09:45", "09:50-10:40", "10:45-11:35", "11:40-12:30",
+               "12:35-01:25", "01:30-02:20", "02:25-03:15", "03:20-04:10", "04:15-05:05"]
+LAB_TIMES = ["08:00-10:45", "", "", "11:00-01:45", "", "", "02:00-04:45", "", ""]
+EMBEDDED_TIMES = ["09:00-10:45", "11:00-12:45", "2:00"]
+
+WHITE = {"red": 1, "green": 1, "blue": 1}
+GREY = {"red": 0.8509804, "green": 0.8509804, "blue": 0.8509804}
+
+
+def _cell(text=None, color=None) -> Dict:
+    """A CellData dict carrying the formatting keys a real includeGridData response has"""
+    cell = {}
+    if text is not None:
+        cell['formattedValue'] = text
+        cell['userEnteredValue'] = {'stringValue': text}
+    if color is not None:
+        cell['effectiveFormat'] = {
+            'backgroundColor': color,
+            'padding': {'top': 2, 'right': 3, 'bottom': 2, 'left': 3},
+            'horizontalAlignment': 'CENTER',
+            'verticalAlignment': 'MIDDLE',
+            'wrapStrategy': 'WRAP',
+            'textFormat': {'foregroundColor': {}, 'fontFamily': 'Arial', 'fontSize': 10,
+                           'bold': False, 'italic': False},
+        }
+    return cell
+
+
+def batch_names(batches: int, dash_format: bool = False) -> List[str]:
+    """Batch header strings like 'BS CS (2024)' (or 'BS-CS-2024' with dash_format)"""
+    names = []
+    for i in range(batches):
+        dept = DEPARTMENTS[i % len(DEPARTMENTS)]
+        year = 2021 + (i // len(DEPARTMENTS)) % 5
+        suffix = "" if i < len(DEPARTMENTS) * 5 else f" {chr(65 + i // (len(DEPARTMENTS) * 5))}"
+        names.append(f"BS-{dept}-{year}{suffix}" if dash_format else f"BS {dept} ({year}){suffix}")
+    return names
+
+
+def _batch_color(rnd: random.Random) -> Dict:
+    # Sheets stores 8-bit channels as n/255 floats
+    return {channel: rnd.randrange(40, 230) / 255 for channel in ("red", "green", "blue")}
+
+
+def _course_text(rnd: random.Random, name: str, dept: str, sections: int) -> str:
+    section = chr(65 + rnd.randrange(sections))
+    form = rnd.random()
+    if form < 0.15:
+        return f"{name} ({dept}-{section},G-{rnd.randint(1, 2)})"
+    if form < 0.25:
+        return f"{name} ({dept}, G-{rnd.randint(1, 2)})"
+    if form < 0.35:
+        return f"{name}-{section}"
+    if form < 0.40:
+        return f"{name} ({section})"
+    return f"{name} ({dept}-{section})"
+
+
+def generate_spreadsheet(batches: int = 10, sections: int = 4, rows: int = 20, columns: int = 10,
+                         lab_rows: int = 6, embedded_times: int = 5, fill: float = 0.55,
+                         dash_format: bool = False, seed: int = 0) -> Tuple[Dict, List[str]]:
+    """Generate a spreadsheet dict shaped like a Sheets API v4 includeGridData response.
+
+    Each Monday-Friday sheet has batch legend cells in the first rows, a 'Room' time
+    header on row 5, `rows` class rows, a 'Lab' timing row and `lab_rows` lab rows,
+    each `columns` wide (room column included). About `fill` of the slots hold a course
+    cell in its batch's color, and `embedded_times` of those per sheet carry a time
+    like '09:00-10:45' in their text. A non-timetable 'Info' sheet is included too.
+
+    Returns (spreadsheet, batch names).
+    """
+    rnd = random.Random(seed)
+    names = batch_names(batches, dash_format)
+    colors = []
+    while len(colors) < batches:
+        color = _batch_color(rnd)
+        if color not in colors:
+            colors.append(color)
+
+    sheets = [{'properties': {'sheetId': 0, 'title': 'Info', 'index': 0},
+               'data': [{'rowData': [{'values': [_cell("Published timetable", WHITE)]}]}]}]
+
+    for day_idx, day in enumerate(TIMETABLE_SHEETS, start=1):
+        legend = [_cell(name, color) for name, color in zip(names, colors)]
+        half = (len(legend) + 1) // 2
+        grid = [
+            {'values': [_cell("Batches", WHITE)] + legend[:half]},
+            {'values': [_cell("", WHITE)] + legend[half:]},
+            {'values': [_cell("FAST NUCES Islamabad", WHITE)]},
+            {},
+            {'values': [_cell("Room", GREY)] +
+                       [_cell(CLASS_TIMES[i % len(CLASS_TIMES)], GREY) for i in range(columns - 1)]},
+        ]
+
+        course_cells = []
+        for r in range(rows + 1 + lab_rows):
+            if r == rows:
+                grid.append({'values': [_cell("Lab", GREY)] +
+                                       [_cell(LAB_TIMES[i % len(LAB_TIMES)], GREY) for i in range(columns - 1)]})
+                continue
+
+            is_lab = r > rows
+            values = [_cell(f"{'Lab' if is_lab else 'C'}-{r + 1}", GREY)]
+            for _ in range(1, columns):
+                if rnd.random() >= fill:
+                    values.append(_cell(None, WHITE) if rnd.random() < 0.5 else {})
+                    continue
+                batch_idx = rnd.randrange(batches)
+                dept = DEPARTMENTS[batch_idx % len(DEPARTMENTS)]
+                name = rnd.choice(COURSE_NAMES) + (" Lab" if is_lab else "")
+                values.append(_cell(_course_text(rnd, name, dept, sections), colors[batch_idx]))
+                course_cells.append(values[-1])
+            grid.append({'values': values})
+
+        for cell in rnd.sample(course_cells, min(embedded_times, len(course_cells))):
+            cell['formattedValue'] += " " + rnd.choice(EMBEDDED_TIMES)
+
+        sheets.append({
+            'properties': {'sheetId': day_idx, 'title': day, 'index': day_idx,
+                           'gridProperties': {'rowCount': len(grid), 'columnCount': columns}},
+            'data': [{'startRow': 0, 'startColumn': 0, 'rowData': grid}],
+        })
+
+    return {'spreadsheetId': f"synthetic-{seed}", 'properties': {'title': 'Synthetic timetable'},
+            'sheets': sheets}, names
@@ -0,0 +1,55 @@
+import json
+import os
+
+import pytest
+
+from compact_grid import compact_spreadsheet
+from extract_timetable import TimetableSnapshot, get_custom_timetable, get_timetable
+from synthetic_timetable import generate_spreadsheet
+
+# get_timetable/get_custom_timetable output of the original cell-by-cell implementation
+# (before TimetableSnapshot) on synthetic spreadsheets generated from 'params'
+with open(os.path.join(os.path.dirname(__file__), 'data', 'baseline_timetables.json'), encoding='utf-8') as f:
+    BASELINE = json.load(f)
+
+CLASH_HEADER = "\n### ⚠️ Time clashes"
+
+
+def spreadsheet_inputs(params):
+    spreadsheet, _ = generate_spreadsheet(**params)
+    return {
+        'raw': spreadsheet,
+        'snapshot': TimetableSnapshot(spreadsheet),
+        'compact': TimetableSnapshot(compact_spreadsheet(spreadsheet)),
+        'materialized': TimetableSnapshot(spreadsheet, materialize=True),
+    }
+
+
+@pytest.fixture(scope='module', params=range(len(BASELINE)), ids=lambda i: f"seed-{BASELINE[i]['params']['seed']}")
+def case(request):
+    baseline = BASELINE[request.param]
+    return baseline, spreadsheet_inputs(baseline['params'])
+
+
+@pytest.mark.parametrize('kind', ['raw', 'snapshot', 'compact', 'materialized'])
+def test_get_timetable_matches_baseline(case, kind):
+    baseline, inputs = case
+    for batch, section, expected in baseline['timetables']:
+        assert get_timetable(inputs[kind], batch, section) == expected, (batch, section)
+
+
+@pytest.mark.parametrize('kind', ['raw', 'snapshot', 'compact'])
+def test_get_custom_timetable_matches_baseline(case, kind):
+    baseline, inputs = case
+    for selected, expected in baseline['custom_timetables']:
+        # The clash list is new; the day tables before it must be unchanged
+        assert get_custom_timetable(inputs[kind], selected).split(CLASH_HEADER)[0] == expected
+
+
+
+@pytest.mark.parametrize('workers', [2, 5])
+def test_pooled_build_matches_serial_build(case, workers):
+    _, inputs = case
+    spreadsheet = inputs['raw']
+    assert TimetableSnapshot(spreadsheet, workers=workers).sessions == inputs['snapshot'].sessions
+    assert TimetableSnapshot(compact_spreadsheet(spreadsheet), workers=workers).sessions == inputs['snapshot'].sessions
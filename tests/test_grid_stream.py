@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from compact_grid import compact_spreadsheet
+from extract_timetable import TIMETABLE_SHEETS
+from grid_stream import read_spreadsheet_stream
+from synthetic_timetable import generate_spreadsheet
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def grid_rows(spreadsheet):
+    """(title, row texts, row colors) of every sheet, for comparing CompactGrids by content"""
+    return [(sheet['properties']['title'],
+             [(grid.row_texts(row), list(grid.row_colors(row))) for row in range(len(grid))])
+            for sheet in spreadsheet['sheets'] for grid in [sheet['grid']]]
+
+
+@pytest.fixture(scope='module')
+def spreadsheet():
+    spreadsheet, _ = generate_spreadsheet(batches=6, sections=3, rows=12, columns=9, lab_rows=4,
+                                          embedded_times=3, seed=3)
+    return spreadsheet
+
+
+@pytest.mark.parametrize('size', [13, 64, 4096, 10 ** 9])
+def test_stream_matches_compact_spreadsheet(spreadsheet, size):
+    text = json.dumps(spreadsheet, indent=1, ensure_ascii=False)
+    streamed = read_spreadsheet_stream(chunked(text, size))
+    assert streamed['spreadsheetId'] == spreadsheet['spreadsheetId']
+    assert grid_rows(streamed) == grid_rows(compact_spreadsheet(spreadsheet, TIMETABLE_SHEETS))
+
+
+@pytest.mark.parametrize('size', [1, 5, 333])
+def test_byte_chunks_split_inside_utf8_characters(size):
+    spreadsheet = {'spreadsheetId': 'utf8', 'properties': {'title': 'Ünïcode'}, 'sheets': [
+        {'properties': {'title': 'Monday'}, 'data': [{'rowData': [
+            {'values': [{'formattedValue': 'Room – ☕ 𝄞', 'effectiveFormat': {'backgroundColor': {'red': 1}}}]},
+            {},
+            {'values': [{}, {'formattedValue': '"quoted" \\ text'}]},
+        ]}]},
+    ]}
+    data = json.dumps(spreadsheet, ensure_ascii=False).encode('utf-8')
+    streamed = read_spreadsheet_stream([data[i:i + size] for i in range(0, len(data), size)])
+    assert grid_rows(streamed) == grid_rows(compact_spreadsheet(spreadsheet, TIMETABLE_SHEETS))
+    assert streamed['sheets'][0]['grid'].text(0, 0) == 'Room – ☕ 𝄞'
@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pytest
+
+from sheet_cache import FetchBackoff, RevisionCache, SnapshotStore
+
+
+class FakeSheet:
+    """Probe and fetch callables over a revision token that tests can change or break"""
+
+    def __init__(self):
+        self.revision = 'r1'
+        self.probe_fails = False
+        self.fetch_fails = False
+        self.fetch_delay = 0.0
+        self.fetched = []
+
+    def probe(self, spreadsheet_id):
+        if self.probe_fails:
+            raise ConnectionError("probe down")
+        return self.revision
+
+    def fetch(self, spreadsheet_id):
+        if self.fetch_delay:
+            time.sleep(self.fetch_delay)
+        if self.fetch_fails:
+            raise ConnectionError("fetch down")
+        self.fetched.append(self.revision)
+        return {'sheets': [], 'revision': self.revision}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_unchanged_revision_is_reused():
+    sheet, clock = FakeSheet(), FakeClock()
+    cache = RevisionCache(sheet.fetch, sheet.probe, probe_interval=60, max_age=300, clock=clock)
+    first = cache.get('sheet')
+    assert sheet.fetched == ['r1'] and first.revision == 'r1'
+
+    # Within probe_interval nothing is probed; after it the probe runs and the grid is kept
+    clock.now += 30
+    assert cache.get('sheet') is first
+    clock.now += 31
+    assert cache.get('sheet') is first
+    assert sheet.fetched == ['r1']
+    assert cache.stats['probes'] == 2 and cache.stats['reuses'] == 2
+
+
+def test_changed_revision_is_refetched():
+    sheet, clock = FakeSheet(), FakeClock()
+    cache = RevisionCache(sheet.fetch, sheet.probe, probe_interval=60, max_age=300, clock=clock)
+    cache.get('sheet')
+    sheet.revision = 'r2'
+    clock.now += 61
+    second = cache.get('sheet')
+    assert sheet.fetched == ['r1', 'r2']
+    assert second.revision == 'r2' and second.spreadsheet['revision'] == 'r2'
+
+
+def test_failed_probe_refetches_only_after_max_age():
+    sheet, clock = FakeSheet(), FakeClock()
+    cache = RevisionCache(sheet.fetch, sheet.probe, probe_interval=60, max_age=300, clock=clock)
+    first = cache.get('sheet')
+    sheet.probe_fails = True
+    clock.now += 61
+    assert cache.get('sheet') is first and len(sheet.fetched) == 1
+    clock.now += 300
+    fresh = cache.get('sheet')
+    assert len(sheet.fetched) == 2 and fresh is not first and fresh.revision is None
+    assert cache.stats['probe_errors'] == 2 and cache.stats['fetch_errors'] == 0
+
+
+def test_concurrent_misses_share_one_fetch():
+    sheet = FakeSheet()
+    sheet.fetch_delay = 0.2
+    cache = RevisionCache(sheet.fetch, sheet.probe)
+    results = []
+    start = threading.Barrier(8)
+
+    def reader():
+        start.wait()
+        results.append(cache.get('sheet'))
+
+    threads = [threading.Thread(target=reader) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sheet.fetched == ['r1']
+    assert len(results) == 8 and all(entry is results[0] for entry in results)
+    assert cache.stats['fetches'] == 1 and cache.stats['coalesced'] == 7
+
+
+def test_failed_fetch_backs_off():
+    sheet, clock = FakeSheet(), FakeClock()
+    cache = RevisionCache(sheet.fetch, sheet.probe, probe_interval=60, clock=clock,
+                          backoff_base=10, backoff_max=100, jitter=lambda: 0.5)
+
+    # Nothing cached: the failure propagates, then callers are turned away until the retry
+    sheet.fetch_fails = True
+    with pytest.raises(ConnectionError):
+        cache.get('sheet')
+    clock.now += 5
+    with pytest.raises(FetchBackoff) as backoff:
+        cache.get('sheet')
+    assert backoff.value.failures == 1
+    assert cache.stats['fetches'] == 1 and cache.stats['backoff_rejections'] == 1
+
+    sheet.fetch_fails = False
+    clock.now += 10
+    assert cache.get('sheet').revision == 'r1'
+    assert sheet.fetched == ['r1'] and cache.stats['fetch_errors'] == 1
+
+
+def test_backoff_reuses_entry_within_retry_window():
+    sheet, clock = FakeSheet(), FakeClock()
+    cache = RevisionCache(sheet.fetch, sheet.probe, probe_interval=1, clock=clock,
+                          backoff_base=100, backoff_max=1000, jitter=lambda: 0.5)
+    first = cache.get('sheet')
+    sheet.revision = 'r2'
+    sheet.fetch_fails = True
+    clock.now += 2
+    assert cache.get('sheet') is first
+    clock.now += 2
+    assert cache.get('sheet') is first
+    assert cache.stats['fetches'] == 2 and cache.stats['backoff_reuses'] == 1
+
+
+def test_restart_serves_stored_snapshot(tmp_path):
+    sheet = FakeSheet()
+    store = SnapshotStore(str(tmp_path))
+    cache = RevisionCache(sheet.fetch, sheet.probe, derive=lambda s: ('parsed', s['revision']), store=store)
+    assert cache.get('sheet').derived == ('parsed', 'r1')
+    assert store.load('sheet').revision == 'r1'
+
+    # A new process restores the stored snapshot instead of fetching, then checks it in the background
+    restarted = RevisionCache(sheet.fetch, sheet.probe, derive=lambda s: ('parsed', s['revision']), store=store)
+    entry = restarted.get('sheet')
+    assert entry.derived == ('parsed', 'r1') and entry.revision == 'r1' and entry.spreadsheet is None
+    assert restarted.stats['restored'] == 1
+    for thread in threading.enumerate():
+        if thread.name.startswith('revision-check-'):
+            thread.join()
+    assert sheet.fetched == ['r1'] and restarted.stats['probes'] == 1
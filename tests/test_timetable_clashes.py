@@ -0,0 +1,65 @@
+import random
+from typing import NamedTuple
+
+import pytest
+
+from cell_parsers import UNKNOWN_MINUTE, parse_time_range
+from timetable_clashes import day_range, find_clashes
+
+
+class Entry(NamedTuple):
+    seq: int
+    start: int
+    end: int
+
+
+def random_entries(rnd, count):
+    entries = []
+    for _ in range(count):
+        if rnd.random() < 0.05:
+            entries.append(Entry(rnd.randrange(count), UNKNOWN_MINUTE, UNKNOWN_MINUTE))
+            continue
+        # Morning and unmarked afternoon starts, including single-time slots
+        start = rnd.randrange(1 * 60, 12 * 60, 5)
+        length = rnd.choice([0, 50, 50, 80, 165])
+        entries.append(Entry(rnd.randrange(count), start, start + length))
+    return entries
+
+
+def brute_force_pairs(entries):
+    pairs = set()
+    for i, first in enumerate(entries):
+        for second in entries[i + 1:]:
+            if UNKNOWN_MINUTE in (first.start, second.start) or first.seq == second.seq:
+                continue
+            a_start, a_end = day_range(first.start, first.end)
+            b_start, b_end = day_range(second.start, second.end)
+            if a_start < b_end and b_start < a_end:
+                pairs.add(frozenset((first, second)))
+    return pairs
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_find_clashes_matches_brute_force(seed):
+    rnd = random.Random(seed)
+    # Unique entries so pairs compare as sets; duplicate seqs still occur
+    entries_by_day = {day: list(dict.fromkeys(random_entries(rnd, rnd.randrange(0, 40))))
+                      for day in ('Monday', 'Tuesday', 'Wednesday')}
+
+    clashes = find_clashes(entries_by_day)
+    for day, entries in entries_by_day.items():
+        found = [frozenset((c.first, c.second)) for c in clashes if c.day == day]
+        assert len(found) == len(set(found))
+        assert set(found) == brute_force_pairs(entries)
+    for clash in clashes:
+        assert day_range(clash.first.start, clash.first.end) <= day_range(clash.second.start, clash.second.end)
+
+
+def test_afternoon_times_without_pm_follow_the_morning():
+    def entry(seq, slot):
+        return Entry(seq, *parse_time_range(slot))
+
+    clashes = find_clashes({'Monday': [entry(1, '01:30-02:20'), entry(2, '12:35-01:25'),
+                                       entry(3, '11:40-12:30'), entry(4, '11:00-01:45'),
+                                       entry(5, '08:00-08:50')]})
+    assert [(c.first.seq, c.second.seq) for c in clashes] == [(4, 3), (4, 2), (4, 1)]
@@ -0,0 +1,358 @@
+"""Local JSON API over one parsed timetable snapshot, served with asyncio.
+
+The spreadsheet is loaded and parsed once at startup. Every batch/section
+timetable and the course catalog are encoded to JSON bytes up front, so most
+requests are a dictionary lookup and a socket write on the event loop, with no
+Streamlit rerun and no re-parsing per client.
+
+    GET  /health
+    GET  /metrics                                 stage timings (Prometheus text; /metrics.json for JSON)
+    GET  /batches                                 batches and their sections
+    GET  /timetable?batch=BS%20CS%20(2021)&section=A
+    GET  /courses?q=net&department=CS&batch=...&year=2021
+    POST /custom   {"courses": [{"name", "department", "section", "batch"}, ...]}
+
+    python timetable_api.py --input spreadsheet.json --port 8765
+    python timetable_api.py --sheet-url URL --credentials key.json --host 0.0.0.0
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from course_extractor import course_key, extract_course_catalog
+from export_timetables import course_record, entry_record, fetch_spreadsheet_with_key, load_spreadsheet
+from extract_timetable import TimetableSnapshot, batch_timetable_entries, custom_timetable_entries
+from metrics import METRICS
+from timetable_clashes import find_clashes
+
+DEFAULT_PORT = 8765
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+MAX_SELECTED_COURSES = 50
+RESPONSE_CACHE_SIZE = 1024
+KEEP_ALIVE_SECONDS = 15
+
+JSON_TYPE = "application/json; charset=utf-8"
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+COURSE_FIELDS = ('name', 'department', 'section', 'batch')
+
+REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           408: 'Request Timeout', 413: 'Payload Too Large', 431: 'Request Header Fields Too Large',
+           500: 'Internal Server Error'}
+
+logger = logging.getLogger(__name__)
+
+
+class Response(NamedTuple):
+    """A body that isn't JSON; routes return plain bytes for JSON"""
+    body: bytes
+    content_type: str
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def encode_json(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class ResponseCache:
+    """Bounded LRU of encoded responses for queries that can't all be precomputed"""
+
+    def __init__(self, size: int = RESPONSE_CACHE_SIZE):
+        self.size = size
+        self._items = OrderedDict()
+
+    def get(self, key) -> Optional[bytes]:
+        body = self._items.get(key)
+        if body is not None:
+            self._items.move_to_end(key)
+        return body
+
+    def put(self, key, body: bytes) -> bytes:
+        self._items[key] = body
+        self._items.move_to_end(key)
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+        return body
+
+
+class TimetableService:
+    """Answers API queries from one immutable snapshot.
+
+    All handlers run on the event loop thread, so the caches need no locking.
+    """
+
+    def __init__(self, snapshot: TimetableSnapshot):
+        started = time.perf_counter()
+        self.snapshot = snapshot
+        self.catalog = extract_course_catalog(snapshot)
+
+        sections = {}
+        self.timetables = {}
+        for batch, section in snapshot.section_pairs():
+            sections.setdefault(batch, []).append(section)
+            self.timetables[(batch, section)] = encode_json(
+                self._timetable_payload(batch, section, batch_timetable_entries(snapshot, batch, section)))
+        self.batches = encode_json({'batches': [{'batch': batch, 'sections': sections.get(batch, [])}
+                                                for batch in sorted(snapshot.batch_color)]})
+        self.courses = encode_json({'courses': [course_record(c) for c in self.catalog.sorted_courses()]})
+        self.searches = ResponseCache()
+        self.customs = ResponseCache()
+        self.loaded_at = time.time()
+        self.load_seconds = time.perf_counter() - started
+
+    @staticmethod
+    def _timetable_payload(batch: str, section: str, timetable: Dict[str, List]) -> Dict:
+        return {'batch': batch, 'section': section,
+                'days': {day: [entry_record(entry) for entry in entries] for day, entries in timetable.items()}}
+
+    def health(self) -> bytes:
+        return encode_json({'status': 'ok', 'spreadsheet_id': self.snapshot.spreadsheet_id,
+                            'timetables': len(self.timetables), 'courses': len(self.catalog),
+                            'loaded_at': self.loaded_at, 'load_seconds': round(self.load_seconds, 3)})
+
+    def timetable(self, batch: str, section: str) -> bytes:
+        if not batch or not section:
+            raise ApiError(400, "batch and section are required")
+        body = self.timetables.get((batch, section))
+        if body is not None:
+            return body
+        if batch not in self.snapshot.batch_color:
+            raise ApiError(404, f"Batch '{batch}' not found")
+        # A known batch with no classes in this section
+        return encode_json(self._timetable_payload(batch, section, {}))
+
+    def search_courses(self, query: str, department: str, batch: str, year: str) -> bytes:
+        if not (query or department or batch or year):
+            return self.courses
+        key = (query, department, batch, year)
+        body = self.searches.get(key)
+        if body is None:
+            courses = self.catalog.search(query, department, batch, year)
+            body = self.searches.put(key, encode_json({'courses': [course_record(c) for c in courses]}))
+        return body
+
+    async def custom(self, payload) -> bytes:
+        selected = payload.get('courses') if isinstance(payload, dict) else None
+        if not isinstance(selected, list) or not selected:
+            raise ApiError(400, "Body must be a JSON object with a non-empty 'courses' list")
+        if len(selected) > MAX_SELECTED_COURSES:
+            raise ApiError(400, f"At most {MAX_SELECTED_COURSES} courses can be selected")
+
+        keys = []
+        for course in selected:
+            if not isinstance(course, dict) or not all(isinstance(course.get(f), str) for f in COURSE_FIELDS):
+                raise ApiError(400, "Each course needs string name, department, section and batch")
+            keys.append(course_key(course))
+        key = tuple(keys)
+        body = self.customs.get(key)
+        if body is not None:
+            return body
+
+        # Matching a large selection takes milliseconds, so keep it off the event loop
+        body = await asyncio.get_running_loop().run_in_executor(None, self._custom_body, keys)
+        return self.customs.put(key, body)
+
+    def _custom_body(self, keys: List[Tuple]) -> bytes:
+        """The /custom response for course keys; reads only shared, read-only state"""
+        # Match the catalog's own course dicts, like a selection made in the app
+        courses = [self.catalog.get(k) for k in keys]
+        unknown = [dict(zip(COURSE_FIELDS, k)) for k, c in zip(keys, courses) if c is None]
+        known = [c for c in courses if c is not None]
+        timetable = custom_timetable_entries(self.snapshot, known) if known else {}
+        clashes = [{'day': clash.day, 'first': self._custom_record(clash.first), 'second': self._custom_record(clash.second)}
+                   for clash in find_clashes(timetable)]
+        return encode_json({
+            'days': {day: [self._custom_record(entry) for entry in entries] for day, entries in timetable.items()},
+            'clashes': clashes,
+            'unknown_courses': unknown,
+        })
+
+    @staticmethod
+    def _custom_record(entry) -> Dict:
+        return dict(entry_record(entry), section=entry.section, batch=entry.batch)
+
+    async def route(self, method: str, target: str, body: bytes) -> bytes:
+        url = urlsplit(target)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        path = url.path.rstrip('/') or '/'
+
+        if path == '/custom':
+            if method != 'POST':
+                raise ApiError(405, "Use POST for /custom")
+            try:
+                payload = json.loads(body.decode('utf-8')) if body else None
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                raise ApiError(400, "Body is not valid JSON")
+            return await self.custom(payload)
+
+        if method not in ('GET', 'HEAD'):
+            raise ApiError(405, f"Use GET for {path}")
+        if path in ('/', '/health'):
+            return self.health()
+        if path == '/metrics':
+            return Response(METRICS.to_prometheus().encode('utf-8'), PROMETHEUS_TYPE)
+        if path == '/metrics.json':
+            return METRICS.to_json().encode('utf-8')
+        if path == '/batches':
+            return self.batches
+        if path == '/timetable':
+            return self.timetable(query.get('batch', ''), query.get('section', '').upper())
+        if path == '/courses':
+            return self.search_courses(query.get('q', ''), query.get('department', ''),
+                                       query.get('batch', ''), query.get('year', ''))
+        raise ApiError(404, f"No endpoint {path}")
+
+
+def http_response(status: int, body: bytes, keep_alive: bool, head: bool = False,
+                  content_type: str = JSON_TYPE) -> bytes:
+    headers = [
+        f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        "Access-Control-Allow-Origin: *",
+        "Access-Control-Allow-Headers: Content-Type",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    head_bytes = ("\r\n".join(headers) + "\r\n\r\n").encode('latin-1')
+    return head_bytes if head else head_bytes + body
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """(method, target, headers, body) of the next request, None when the client closed the connection"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise ApiError(400, "Incomplete request")
+        return None
+    except asyncio.LimitOverrunError:
+        raise ApiError(431, "Request headers too large")
+
+    lines = head.decode('latin-1').split("\r\n")
+    try:
+        method, target, version = lines[0].split(' ', 2)
+    except ValueError:
+        raise ApiError(400, "Malformed request line")
+    headers = {'_version': version}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', '0'))
+    except ValueError:
+        raise ApiError(400, "Invalid Content-Length")
+    if length < 0:
+        raise ApiError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise ApiError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target, headers, body
+
+
+def wants_keep_alive(headers: Dict[str, str]) -> bool:
+    connection = headers.get('connection', '').lower()
+    if headers.get('_version') == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+
+class TimetableServer:
+    """HTTP/1.1 keep-alive server around a TimetableService"""
+
+    def __init__(self, service: TimetableService):
+        self.service = service
+        self.requests = 0
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                keep_alive = False
+                head = False
+                request = None
+                try:
+                    request = await asyncio.wait_for(read_request(reader), KEEP_ALIVE_SECONDS)
+                    if request is None:
+                        break
+                    started = time.perf_counter()
+                    method, target, headers, body = request
+                    keep_alive = wants_keep_alive(headers)
+                    head = method == 'HEAD'
+                    if method == 'OPTIONS':
+                        status, payload = 204, b''
+                    else:
+                        status, payload = 200, await self.service.route(method, target, body)
+                except asyncio.TimeoutError:
+                    break
+                except ApiError as e:
+                    status, payload = e.status, encode_json({'error': str(e)})
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception:
+                    # A bug in one route shouldn't drop the socket without a response
+                    logger.exception("Unhandled error serving %s", request[1] if request else "request")
+                    status, payload = 500, encode_json({'error': "Internal server error"})
+                    keep_alive = False
+                content_type = JSON_TYPE
+                if isinstance(payload, Response):
+                    payload, content_type = payload
+                self.requests += 1
+                if request is not None:
+                    METRICS.record('api_request', time.perf_counter() - started, {f"status_{status}": 1})
+                writer.write(http_response(status, payload, keep_alive, head, content_type))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        addresses = ", ".join(f"{s.getsockname()[0]}:{s.getsockname()[1]}" for s in server.sockets)
+        print(f"Serving {len(self.service.timetables)} timetables and {len(self.service.catalog)} courses "
+              f"on {addresses}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help="Saved spreadsheet JSON")
+    source.add_argument('--sheet-url', help="Fetch this Google Sheet (needs --credentials)")
+    parser.add_argument('--credentials', help="Service account JSON key for --sheet-url")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    if args.sheet_url and not args.credentials:
+        parser.error("--sheet-url needs --credentials")
+
+    if args.input:
+        spreadsheet = load_spreadsheet(args.input)
+    else:
+        spreadsheet = fetch_spreadsheet_with_key(args.sheet_url, args.credentials)
+    service = TimetableService(TimetableSnapshot(spreadsheet))
+    del spreadsheet
+
+    try:
+        asyncio.run(TimetableServer(service).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
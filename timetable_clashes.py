@@ -0,0 +1,83 @@
+"""Find overlapping sessions in a timetable with a per-day interval index.
+
+Header times in the sheets are written on a 12-hour clock without AM/PM, so
+'01:30-02:20' is an afternoon slot. day_range() moves such times past noon
+before intervals are compared.
+"""
+import heapq
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+from cell_parsers import UNKNOWN_MINUTE
+
+# Start times before this are read as afternoon times written without PM
+DAY_START_MINUTE = 7 * 60
+NOON_SHIFT = 12 * 60
+
+
+class Clash(NamedTuple):
+    """Two entries of one day whose time ranges overlap; first starts no later than second"""
+    day: str
+    first: object
+    second: object
+
+
+def day_range(start: int, end: int) -> Tuple[int, int]:
+    """(start, end) minutes on the teaching day, with unmarked afternoon times moved past noon.
+
+    Single-time slots get one minute so they can still collide with a range.
+    """
+    if start < DAY_START_MINUTE:
+        start += NOON_SHIFT
+        end += NOON_SHIFT
+    return start, max(end, start + 1)
+
+
+class IntervalIndex:
+    """Entries of one day sorted by start minute.
+
+    entries must have start and end attributes in minutes and the seq of their
+    cell (like Session or TimetableEntry). Entries with an unknown time are left out.
+    """
+
+    def __init__(self, entries: Iterable):
+        ranged = []
+        for entry in entries:
+            if entry.start >= UNKNOWN_MINUTE:
+                continue
+            start, end = day_range(entry.start, entry.end)
+            ranged.append((start, end, len(ranged), entry))
+        ranged.sort()
+        self._ranged = ranged
+
+    def __len__(self):
+        return len(self._ranged)
+
+    def overlapping_pairs(self) -> List[Tuple[object, object]]:
+        """Every pair of overlapping entries, found with one sweep in start order.
+
+        Entries read from the same cell (e.g. one session matched by two selected
+        courses) are not a clash with each other.
+        """
+        pairs = []
+        active = []  # heap of (end, order, entry) still running at the current start
+        for start, end, order, entry in self._ranged:
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            for _, _, other in sorted(active, key=lambda a: a[1]):
+                if other.seq != entry.seq:
+                    pairs.append((other, entry))
+            heapq.heappush(active, (end, order, entry))
+        return pairs
+
+
+def build_day_index(entries_by_day: Dict[str, Sequence]) -> Dict[str, IntervalIndex]:
+    """One IntervalIndex per day"""
+    return {day: IntervalIndex(entries) for day, entries in entries_by_day.items()}
+
+
+def find_clashes(entries_by_day: Dict[str, Sequence]) -> List[Clash]:
+    """Every overlapping pair of entries, day by day in the order of entries_by_day"""
+    clashes = []
+    for day, index in build_day_index(entries_by_day).items():
+        clashes.extend(Clash(day, first, second) for first, second in index.overlapping_pairs())
+    return clashes
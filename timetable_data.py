@@ -0,0 +1,104 @@
+"""Everything the app reads from one fetched sheet revision, built once and shared.
+
+A TimetableData is created when a revision is fetched (or restored from the
+snapshot store), then handed by reference to every session until the next
+revision replaces it. Nothing in it is modified after build_timetable_data()
+returns, so sessions can read it concurrently without copies or locks. A refresh
+builds a new TimetableData and swaps the cache entry that points at it.
+"""
+import re
+from typing import Dict, List, NamedTuple, Tuple
+
+from course_extractor import CourseCatalog, course_key, extract_course_catalog, format_course_display
+from extract_timetable import TimetableSnapshot, extract_year
+
+BATCH_DEPARTMENT_PATTERN = re.compile(r"BS\s+([A-Z]+)")
+
+
+class CourseOptions(NamedTuple):
+    """Course dropdown for one (department, year) filter.
+
+    labels starts with the "" clear option, then one label per course in display order;
+    courses maps each label to its course.
+    """
+    labels: List[str]
+    courses: Dict[str, Dict]
+
+
+class Facets(NamedTuple):
+    """Dropdown lists of both app tabs, keyed by the filter values the user can pick.
+
+    batches and batch_departments/batch_years feed the batch timetable tab;
+    departments/years and course_options feed the custom selection tab. "" in a
+    filter key means no filter.
+    """
+    batches: List[str]
+    batch_departments: List[str]
+    batch_years: List[str]
+    batches_by_filter: Dict[Tuple[str, str], List[str]]
+    departments: List[str]
+    years: List[str]
+    course_options: Dict[Tuple[str, str], CourseOptions]
+    course_labels: Dict[Tuple[str, str, str, str], str]
+
+    def filtered_batches(self, department: str, year: str) -> List[str]:
+        return self.batches_by_filter.get((department, year), [])
+
+    def options(self, department: str, year: str) -> CourseOptions:
+        return self.course_options.get((department, year), EMPTY_OPTIONS)
+
+    def course_label(self, course: Dict) -> str:
+        """Display string of a course, precomputed for catalog courses"""
+        label = self.course_labels.get(course_key(course))
+        return label if label is not None else format_course_display(course)
+
+
+EMPTY_OPTIONS = CourseOptions([""], {})
+
+
+def build_facets(batch_colors: Dict[int, str], catalog: CourseCatalog) -> Facets:
+    """Every dropdown list and course label, with the same contents and order the app used to compute per rerun"""
+    batches = list(batch_colors.values())
+    batch_departments = sorted({m.group(1) for m in map(BATCH_DEPARTMENT_PATTERN.search, map(str, batches)) if m})
+    batch_years = sorted({y for y in map(extract_year, batches) if y})
+    # Batch filters match substrings of the batch name, as the selectboxes always did
+    batches_by_filter = {
+        (department, year): [b for b in batches if department in str(b) and year in str(b)]
+        for department in [""] + batch_departments for year in [""] + batch_years
+    }
+
+    course_labels = {course_key(c): format_course_display(c) for c in catalog.sorted_courses()}
+    departments, years = catalog.departments(), catalog.years()
+    course_options = {}
+    for department in [""] + departments:
+        in_department = catalog.filter(department=department)
+        for year in [""] + years:
+            # A year matches any batch name containing it, as the course dropdown always did
+            courses = [c for c in in_department if year in str(c.get('batch', ''))]
+            labels = [course_labels[course_key(c)] for c in courses]
+            # Later courses win on equal labels, like the per-rerun dict did
+            course_options[(department, year)] = CourseOptions([""] + labels, dict(zip(labels, courses)))
+
+    return Facets(batches, batch_departments, batch_years, batches_by_filter,
+                  departments, years, course_options, course_labels)
+
+
+class TimetableData(NamedTuple):
+    """Parsed snapshot, course catalog, batch colors and dropdown facets of one sheet revision; treat as read-only"""
+    snapshot: TimetableSnapshot
+    catalog: CourseCatalog
+    batch_colors: Dict[int, str]
+    facets: Facets
+
+
+def build_timetable_data(spreadsheet, workers=None) -> TimetableData:
+    """Parse a fetched grid, render every batch/section timetable and index the course catalog.
+
+    All lazily built indexes are built here, before the data is shared between sessions.
+    """
+    snapshot = TimetableSnapshot(spreadsheet, materialize=True, workers=workers)
+    # Custom timetables read the cell text features memo; fill it now instead of on first use
+    for session in snapshot.sessions:
+        snapshot.text_features(session)
+    catalog = extract_course_catalog(snapshot)
+    return TimetableData(snapshot, catalog, snapshot.batch_colors, build_facets(snapshot.batch_colors, catalog))
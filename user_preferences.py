@@ -1,25 +1,21 @@
 import streamlit as st
 from typing import List, Dict, Optional
-import re
 
-def format_course_display(course: dict) -> str:
-    """Return a compact display string for a course: 'name dept section year-or-batch'
-    Example: 'Data St CS A 2024' (falls back to full batch string if year not found)
-    """
-    name = course.get('name', '').strip()
-    dept = course.get('department', '').strip()
-    section = course.get('section', '').strip()
-    batch = str(course.get('batch', '')).strip()
-    # Prefer year (e.g., 2024) when available inside the batch string
-    m = re.search(r"(20\d{2})", batch)
-    year = m.group(1) if m else batch
-    parts = [p for p in [name, dept, section, year] if p]
-    return " ".join(parts)
+from course_extractor import CourseCatalog, course_id, format_course_display
+
+# The selection is stored per session as {course_id: None}, an insertion-ordered set of
+# short IDs; courses are looked up in the shared catalog instead of copied into each session
 
 def initialize_session_state():
     """Initialize session state variables if they don't exist"""
-    if 'selected_courses' not in st.session_state:
-        st.session_state.selected_courses = []
+    if 'selected_course_ids' not in st.session_state:
+        st.session_state.selected_course_ids = {}
+
+    # Sessions started before IDs were used hold full course dicts
+    if 'selected_courses' in st.session_state:
+        for course in st.session_state.selected_courses:
+            st.session_state.selected_course_ids.setdefault(course_id(course), None)
+        del st.session_state.selected_courses
     
     if 'search_query' not in st.session_state:
         st.session_state.search_query = ""
@@ -35,40 +31,39 @@ def initialize_session_state():
 
 def add_course_to_selection(course: Dict):
     """Add a course to the user's selection"""
-    # Check if course is already selected
-    course_key = f"{course['name']}_{course['department']}_{course['section']}_{course['batch']}"
-    
-    for selected_course in st.session_state.selected_courses:
-        selected_key = f"{selected_course['name']}_{selected_course['department']}_{selected_course['section']}_{selected_course['batch']}"
-        if selected_key == course_key:
-            st.warning(f"Course '{format_course_display(course)}' is already selected!")
-            return False
+    selected_ids = st.session_state.selected_course_ids
+    id_ = course_id(course)
+    if id_ in selected_ids:
+        st.warning(f"Course '{format_course_display(course)}' is already selected!")
+        return False
     
     # Add course to selection
-    st.session_state.selected_courses.append(course)
+    selected_ids[id_] = None
     return True
 
 def remove_course_from_selection(course: Dict):
     """Remove a course from the user's selection"""
-    course_key = f"{course['name']}_{course['department']}_{course['section']}_{course['batch']}"
-    
-    for i, selected_course in enumerate(st.session_state.selected_courses):
-        selected_key = f"{selected_course['name']}_{selected_course['department']}_{selected_course['section']}_{selected_course['batch']}"
-        if selected_key == course_key:
-            removed_course = st.session_state.selected_courses.pop(i)
-            st.success(f"Removed '{format_course_display(removed_course)}' from selection")
-            return True
+    selected_ids = st.session_state.selected_course_ids
+    id_ = course_id(course)
+    if id_ in selected_ids:
+        del selected_ids[id_]
+        st.success(f"Removed '{format_course_display(course)}' from selection")
+        return True
     
     return False
 
 def clear_all_selections():
     """Clear all selected courses"""
-    st.session_state.selected_courses = []
+    st.session_state.selected_course_ids = {}
     st.success("All course selections cleared!")
 
-def get_selected_courses() -> List[Dict]:
-    """Get list of currently selected courses"""
-    return st.session_state.selected_courses
+def get_selected_courses(catalog: CourseCatalog) -> List[Dict]:
+    """Get list of currently selected courses from the catalog.
+
+    Courses missing from the catalog are skipped but stay selected, so a bad fetch or a
+    briefly edited cell doesn't wipe the selection; clear_all_selections removes them.
+    """
+    return catalog.resolve(st.session_state.selected_course_ids)
 
 def update_search_filters(query: str = "", department: str = "", batch: str = ""):
     """Update search filters in session state"""
@@ -94,18 +89,12 @@ def get_last_search_results() -> List[Dict]:
 
 def is_course_selected(course: Dict) -> bool:
     """Check if a course is already selected"""
-    course_key = f"{course['name']}_{course['department']}_{course['section']}_{course['batch']}"
-    
-    for selected_course in st.session_state.selected_courses:
-        selected_key = f"{selected_course['name']}_{selected_course['department']}_{selected_course['section']}_{selected_course['batch']}"
-        if selected_key == course_key:
-            return True
-    
-    return False
+    return course_id(course) in st.session_state.selected_course_ids
 
-def get_selection_summary() -> Dict:
+def get_selection_summary(catalog: CourseCatalog) -> Dict:
     """Get a summary of current selections"""
-    if not st.session_state.selected_courses:
+    selected_courses = get_selected_courses(catalog)
+    if not selected_courses:
         return {
             'total_courses': 0,
             'departments': set(),
@@ -113,12 +102,12 @@ def get_selection_summary() -> Dict:
             'sections': set()
         }
     
-    departments = set(course['department'] for course in st.session_state.selected_courses)
-    batches = set(course['batch'] for course in st.session_state.selected_courses)
-    sections = set(course['section'] for course in st.session_state.selected_courses)
+    departments = set(course['department'] for course in selected_courses)
+    batches = set(course['batch'] for course in selected_courses)
+    sections = set(course['section'] for course in selected_courses)
     
     return {
-        'total_courses': len(st.session_state.selected_courses),
+        'total_courses': len(selected_courses),
         'departments': departments,
         'batches': batches,
         'sections': sections